@@ -0,0 +1,89 @@
+// SPDX-License-Identifier: GPL-2.0
+/*
+ * cgroup egress filter for contest-manager
+ *
+ * Attached to a contest user's systemd slice (user-<uid>.slice). Packets whose destination
+ * is covered by a prefix in blocked_v4 / blocked_v6 (LPM tries filled from the IP cache)
+ * are dropped. stats counts inspected and dropped packets.
+ *
+ * Build: clang -O2 -g -target bpf -c contest_egress.bpf.c -o contest_egress.bpf.o
+ */
+#include <linux/bpf.h>
+#include <linux/if_ether.h>
+#include <linux/ip.h>
+#include <linux/ipv6.h>
+#include <bpf/bpf_helpers.h>
+#include <bpf/bpf_endian.h>
+
+#define MAX_PREFIXES 1048576
+#define STAT_PACKETS 0
+#define STAT_DROPPED 1
+
+struct v4_key {
+	__u32 prefixlen;
+	__u8 addr[4];
+};
+
+struct v6_key {
+	__u32 prefixlen;
+	__u8 addr[16];
+};
+
+struct {
+	__uint(type, BPF_MAP_TYPE_LPM_TRIE);
+	__uint(max_entries, MAX_PREFIXES);
+	__uint(map_flags, BPF_F_NO_PREALLOC);
+	__type(key, struct v4_key);
+	__type(value, __u8);
+} blocked_v4 SEC(".maps");
+
+struct {
+	__uint(type, BPF_MAP_TYPE_LPM_TRIE);
+	__uint(max_entries, MAX_PREFIXES);
+	__uint(map_flags, BPF_F_NO_PREALLOC);
+	__type(key, struct v6_key);
+	__type(value, __u8);
+} blocked_v6 SEC(".maps");
+
+struct {
+	__uint(type, BPF_MAP_TYPE_ARRAY);
+	__uint(max_entries, 2);
+	__type(key, __u32);
+	__type(value, __u64);
+} stats SEC(".maps");
+
+static __always_inline void count(__u32 index)
+{
+	__u64 *value = bpf_map_lookup_elem(&stats, &index);
+
+	if (value)
+		__sync_fetch_and_add(value, 1);
+}
+
+SEC("cgroup_skb/egress")
+int contest_egress(struct __sk_buff *skb)
+{
+	count(STAT_PACKETS);
+	if (skb->protocol == bpf_htons(ETH_P_IP)) {
+		struct v4_key key = { .prefixlen = 32 };
+
+		if (bpf_skb_load_bytes(skb, __builtin_offsetof(struct iphdr, daddr), key.addr, 4) < 0)
+			return 1;
+		if (bpf_map_lookup_elem(&blocked_v4, &key)) {
+			count(STAT_DROPPED);
+			return 0;
+		}
+	} else if (skb->protocol == bpf_htons(ETH_P_IPV6)) {
+		struct v6_key key = { .prefixlen = 128 };
+
+		if (bpf_skb_load_bytes(skb, __builtin_offsetof(struct ipv6hdr, daddr), key.addr, 16) < 0)
+			return 1;
+		if (bpf_map_lookup_elem(&blocked_v6, &key)) {
+			count(STAT_DROPPED);
+			return 0;
+		}
+	}
+	return 1;
+}
+
+char LICENSE[] SEC("license") = "GPL";
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Packet-Path Benchmark CLI
+"""
+import sys
+import json
+import argparse
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.benchmark import (
+    BENCH_USER, DEFAULT_SIZES, DEFAULT_DURATION, DEFAULT_CONNECTS, DEFAULT_TOLERANCE, available_backends,
+    run_benchmark, save_report, compare_reports
+)
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure packet rate and connection latency of generated rulesets in a private network namespace",
+        prog="contest-benchmark"
+    )
+    parser.add_argument(
+        '--backend', action='append', choices=['nft', 'restore', 'ipset', 'legacy'], dest='backends',
+        help='Backend to measure (repeatable, default: every installed one)'
+    )
+    parser.add_argument(
+        '--size', action='append', type=int, dest='sizes',
+        help=f"Blocked addresses in the synthetic cache (repeatable, default: {', '.join(map(str, DEFAULT_SIZES))})"
+    )
+    parser.add_argument(
+        '--duration', type=float, default=DEFAULT_DURATION,
+        help=f'Seconds of UDP traffic per measurement (default: {DEFAULT_DURATION})'
+    )
+    parser.add_argument(
+        '--connects', type=int, default=DEFAULT_CONNECTS,
+        help=f'TCP connections opened per measurement (default: {DEFAULT_CONNECTS})'
+    )
+    parser.add_argument(
+        '--user', default=BENCH_USER, help=f'Test user, created and removed if missing (default: {BENCH_USER})'
+    )
+    parser.add_argument(
+        '--output', help='Report file (default: cache/benchmark_<time>.json)'
+    )
+    parser.add_argument(
+        '--compare', metavar='REPORT', help='Earlier report to check for regressions (exit status 1 if any)'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help=f'Fraction a result may get worse before it counts as a regression (default: {DEFAULT_TOLERANCE})'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Show the output of every restrict/unrestrict step'
+    )
+    return parser
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    backends = args.backends or available_backends()
+    if not backends:
+        print("❌ No firewall backend found (nft, iptables-restore, ipset or iptables).")
+        sys.exit(1)
+    previous = None
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot read report {args.compare}: {e}")
+            sys.exit(1)
+    sizes = args.sizes or list(DEFAULT_SIZES)
+    print(f"\n⏱️  Benchmarking {', '.join(backends)} at {', '.join(map(str, sizes))} addresses\n" + ("="*40))
+    try:
+        report = run_benchmark(backends, sizes, user=args.user, duration=args.duration, connects=args.connects,
+                               verbose=args.verbose)
+    except (OSError, RuntimeError) as e:
+        print(f"❌ Benchmark failed: {e}")
+        sys.exit(1)
+    path = save_report(report, args.output)
+    print(f"\n✅ Report written to {path}")
+    if previous is not None:
+        regressions = compare_reports(previous, report, args.tolerance)
+        if regressions:
+            print(f"\n⚠️  {len(regressions)} regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.compare}")
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Check CLI
+"""
+import sys
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.internet_handler import get_domain_policy
+from contest_manager.utils.domain_policy import check
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Check whether a hostname is covered by the blacklist",
+        prog="contest-check"
+    )
+    parser.add_argument(
+        'hostname', help='Hostname to check'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Enable verbose output'
+    )
+    return parser
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    policy = get_domain_policy(BLACKLIST_TXT)
+    blocked, match = check(policy, args.hostname)
+    print(f"\n🔎 Checking {args.hostname}\n" + ("="*40))
+    if match is None:
+        print(f"  {args.hostname} is not covered by the blacklist.")
+    else:
+        pattern = {'block': match['domain'], 'wildcard': f"*.{match['domain']}", 'allow': f"!{match['domain']}"}[match['kind']]
+        print(f"  {args.hostname} is {'🚫 blocked' if blocked else '✅ allowed'} by entry: {pattern}")
+        if match['tags']:
+            print(f"  Categories: {', '.join(match['tags'])}")
+    if args.verbose:
+        print(f"  Policy entries: {policy['entries']}")
+    sys.exit(0 if blocked else 2)
+
+if __name__ == "__main__":
+    main()
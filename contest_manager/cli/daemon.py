@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Enforcement Daemon CLI
+"""
+import sys
+import pwd
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.dns_resolver import DEFAULT_TIMEOUT
+from contest_manager.utils.ip_cache import DEFAULT_EVICT_AFTER
+from contest_manager.utils.refresh_daemon import DEFAULT_MAX_QUERIES, DEFAULT_JITTER, run_daemon
+from contest_manager.utils.user_manager import extract_user_password_pairs
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+ALLOWLIST_TXT = CONFIG_DIR / 'allowlist.txt'
+USERS_TXT = CONFIG_DIR / 'users.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Keep restricted users' IP caches and rules fresh, re-resolving names as their TTLs expire",
+        prog="contest-daemon"
+    )
+    parser.add_argument(
+        'users', nargs='*', metavar='user', help='Usernames to serve (default: participant)'
+    )
+    parser.add_argument(
+        '--all', action='store_true', help='Serve every user listed in config/users.txt'
+    )
+    parser.add_argument(
+        '--max-queries', type=int, default=DEFAULT_MAX_QUERIES,
+        help=f'Maximum concurrent DNS queries (default: {DEFAULT_MAX_QUERIES})'
+    )
+    parser.add_argument(
+        '--jitter', type=float, default=DEFAULT_JITTER,
+        help=f'Delay refreshes by up to this fraction of the TTL (default: {DEFAULT_JITTER})'
+    )
+    parser.add_argument(
+        '--evict-after', type=int, default=DEFAULT_EVICT_AFTER,
+        help=f'Drop cached addresses not seen for this many seconds (default: {DEFAULT_EVICT_AFTER})'
+    )
+    parser.add_argument(
+        '--prune', action='store_true', help='Also remove blocked addresses that are no longer in the cache'
+    )
+    parser.add_argument(
+        '--nameserver', action='append', metavar='IP[:PORT]', help='Nameserver to resolve the blacklist with (repeatable)'
+    )
+    parser.add_argument(
+        '--dns-timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Per-query DNS timeout in seconds (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Print every refresh batch'
+    )
+    return parser
+
+def get_users(args):
+    if args.all:
+        return [username for username, _ in extract_user_password_pairs(USERS_TXT)]
+    return args.users or ['participant']
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    users = []
+    for user in get_users(args):
+        try:
+            users.append((user, pwd.getpwnam(user).pw_uid))
+        except KeyError:
+            print(f"❌ User {user} not found.")
+            sys.exit(1)
+    if not users:
+        sys.exit(1)
+    run_daemon(users, BLACKLIST_TXT, ALLOWLIST_TXT, verbose=args.verbose, max_queries=args.max_queries,
+               jitter=args.jitter, evict_after=args.evict_after, prune=args.prune,
+               nameservers=args.nameserver, timeout=args.dns_timeout)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Blocked-Attempt Log CLI
+"""
+import sys
+import pwd
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.drop_log import FLUSH_INTERVAL, run_drop_log
+from contest_manager.utils.user_manager import extract_user_password_pairs
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+USERS_TXT = CONFIG_DIR / 'users.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Count the blocked connection attempts logged for restricted users (restrict --log-drops)",
+        prog="contest-drop-log"
+    )
+    parser.add_argument(
+        'users', nargs='*', metavar='user', help='Usernames to count for (default: participant)'
+    )
+    parser.add_argument(
+        '--all', action='store_true', help='Count for every user listed in config/users.txt'
+    )
+    parser.add_argument(
+        '--flush-interval', type=float, default=FLUSH_INTERVAL,
+        help=f'Write a summary every this many seconds (default: {FLUSH_INTERVAL})'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Print every new blocked attempt'
+    )
+    return parser
+
+def get_users(args):
+    if args.all:
+        return [username for username, _ in extract_user_password_pairs(USERS_TXT)]
+    return args.users or ['participant']
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    users = []
+    for user in get_users(args):
+        try:
+            users.append((user, pwd.getpwnam(user).pw_uid))
+        except KeyError:
+            print(f"❌ User {user} not found.")
+            sys.exit(1)
+    if not users:
+        sys.exit(1)
+    if not run_drop_log(users, flush_interval=args.flush_interval, verbose=args.verbose):
+        sys.exit(1)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Explain CLI
+"""
+import sys
+import argparse
+import ipaddress
+
+from contest_manager.utils.internet_handler import get_user_cache_path
+from contest_manager.utils.ip_index import index_path, open_index, close_index, lookup_ip, lookup_name
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Explain why an address or domain is blocked for a user",
+        prog="contest-explain"
+    )
+    parser.add_argument(
+        'target', help='IP address or domain name to look up'
+    )
+    parser.add_argument(
+        '--user', default='participant', help='Username whose cache to query (default: participant)'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Enable verbose output'
+    )
+    return parser
+
+def explain_ip(index, ip):
+    names = lookup_ip(index, ip)
+    if not names:
+        print(f"  {ip} is not in the IP cache; it is not blocked by address.")
+        return False
+    print(f"  {ip} is blocked because it was resolved from:")
+    for name in names:
+        print(f"    - {name}")
+    return True
+
+def explain_domain(index, domain):
+    domain = domain.lower().rstrip('.')
+    labels = domain.split('.')
+    for i in range(len(labels) - 1):
+        name = '.'.join(labels[i:])
+        addresses = lookup_name(index, name)
+        if addresses is None:
+            continue
+        if name == domain:
+            print(f"  {domain} is in the IP cache with {len(addresses)} address(es):")
+        else:
+            print(f"  {domain} is not cached itself; its parent {name} is, with {len(addresses)} address(es):")
+        for address in addresses:
+            print(f"    - {address}")
+        return True
+    print(f"  {domain} is not in the IP cache.")
+    return False
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    cache_path = get_user_cache_path(args.user)
+    idx_path = index_path(cache_path)
+    index = open_index(idx_path)
+    if index is None:
+        print(f"❌ IP index {idx_path} not found. Run restrict or update-restriction first.")
+        sys.exit(1)
+    print(f"\n🔎 Explaining {args.target} for user: {args.user}\n" + ("="*40))
+    try:
+        try:
+            ipaddress.ip_address(args.target)
+            found = explain_ip(index, args.target)
+        except ValueError:
+            found = explain_domain(index, args.target)
+    finally:
+        close_index(index)
+    sys.exit(0 if found else 2)
+
+if __name__ == "__main__":
+    main()
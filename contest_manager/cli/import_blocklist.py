@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Import Blocklist CLI
+"""
+import sys
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.internet_handler import IMPORTED_BLACKLIST_DIR, get_blacklist_entries
+from contest_manager.utils.blocklist_importer import FORMATS, import_blocklist
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Import a third-party blocklist (hosts, adblock or plain format) into the blacklist",
+        prog="contest-import-blocklist"
+    )
+    parser.add_argument(
+        'source', help='Path of the blocklist file to import'
+    )
+    parser.add_argument(
+        '--format', choices=FORMATS, default='auto', help='Input format (default: auto-detect per line)'
+    )
+    parser.add_argument(
+        '--name', help=f'Name of the imported list in config/{IMPORTED_BLACKLIST_DIR} (default: source file name)'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Enable verbose output'
+    )
+    return parser
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    source = Path(args.source)
+    if not source.exists():
+        print(f"❌ Blocklist file {source} not found.")
+        sys.exit(1)
+    name = args.name or source.stem
+    dest = CONFIG_DIR / IMPORTED_BLACKLIST_DIR / f"{name}.txt"
+    print(f"\n📥 Importing {source} into {dest}\n" + ("="*40))
+    stats = import_blocklist(source, dest, existing=get_blacklist_entries(BLACKLIST_TXT), fmt=args.format)
+    print(f"  Imported:   {stats['imported']}")
+    print(f"  Duplicates: {stats['duplicate']}")
+    print(f"  Rejected:   {stats['rejected']}")
+    print("\n✅ Blocklist imported. Run restrict or update-restriction to apply it.\n")
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Payload Inspector CLI
+"""
+import sys
+import pwd
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.internet_handler import get_policy_source
+from contest_manager.utils.payload_inspector import queue_number, run_inspector
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Check DNS query names and TLS server names queued for a restricted user",
+        prog="contest-inspector"
+    )
+    parser.add_argument(
+        'user', nargs='?', default='participant', help='Username whose queue to serve (default: participant)'
+    )
+    parser.add_argument(
+        '--queue-num', type=int, help='NFQUEUE number to serve (default: derived from the user UID)'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Print every checked name and its verdict'
+    )
+    return parser
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    queue_num = args.queue_num
+    if queue_num is None:
+        try:
+            queue_num = queue_number(pwd.getpwnam(args.user).pw_uid)
+        except KeyError:
+            print(f"❌ User {args.user} not found.")
+            sys.exit(1)
+    if not run_inspector(queue_num, get_policy_source(BLACKLIST_TXT), verbose=args.verbose):
+        sys.exit(1)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,35 @@ Contest Environment Manager - Main CLI Entry Point
 
 import sys
 import argparse
+import importlib
 from contest_manager.utils.utils import check_root
-from contest_manager.cli.setup import main as setup_main
-from contest_manager.cli.reset import main as reset_main
-from contest_manager.cli.restrict import main as restrict_main
-from contest_manager.cli.unrestrict import main as unrestrict_main
-from contest_manager.cli.status import main as status_main
-from contest_manager.cli.start_restriction import main as start_restriction_main
-from contest_manager.cli.update_restriction import main as update_restriction_main
+from contest_manager.utils.ip_cache import DEFAULT_EVICT_AFTER
+from contest_manager.utils.firewall import BACKENDS, DEFAULT_BACKEND
+
+# Commands are imported when run, so quick ones (status) do not pay for the resolver and daemon imports
+COMMANDS = {
+    'setup': 'setup', 'reset': 'reset', 'restrict': 'restrict', 'unrestrict': 'unrestrict', 'status': 'status',
+    'start-restriction': 'start_restriction', 'update-restriction': 'update_restriction', 'explain': 'explain',
+    'import-blocklist': 'import_blocklist', 'check': 'check', 'inspector': 'inspector', 'sinkhole': 'sinkhole',
+    'schedule': 'schedule', 'watch': 'watch', 'daemon': 'daemon', 'drop-log': 'drop_log',
+    'benchmark': 'benchmark',
+}
+
+def run_command(command):
+    importlib.import_module(f"contest_manager.cli.{COMMANDS[command]}").main()
+
+def add_resolver_arguments(parser):
+    parser.add_argument('--nameserver', action='append', metavar='IP[:PORT]', help='Nameserver to resolve the blacklist with (repeatable)')
+    parser.add_argument('--dns-timeout', type=float, help='Per-query DNS timeout in seconds')
+    parser.add_argument('--dns-workers', type=int, help='Maximum concurrent DNS queries')
+
+def resolver_argv(args):
+    argv = []
+    for ns in args.nameserver or []:
+        argv += ['--nameserver', ns]
+    argv += ['--dns-timeout', str(args.dns_timeout)] if args.dns_timeout is not None else []
+    argv += ['--dns-workers', str(args.dns_workers)] if args.dns_workers is not None else []
+    return argv
 
 def main():
     parser = argparse.ArgumentParser(
@@ -23,9 +44,22 @@ def main():
 Examples:
   sudo contest-manager setup                   # Set up lab PC for users in /config/users.txt
   sudo contest-manager restrict                # Restrict default user (participant)
+  sudo contest-manager restrict --all          # Restrict every user in /config/users.txt
+  sudo contest-manager restrict --mode allowlist  # Only allow the hosts in /config/allowlist.txt
   sudo contest-manager unrestrict              # Remove restrictions for participant
   sudo contest-manager reset                   # Reset participant account to clean state
   sudo contest-manager status                  # Check status for participant
+  sudo contest-manager status --all --json     # Status of every user in /config/users.txt as JSON
+  sudo contest-manager explain 142.250.1.1     # Show which blacklisted names an address belongs to
+  sudo contest-manager import-blocklist hosts  # Import a third-party blocklist
+  sudo contest-manager check chat.openai.com   # Check whether a hostname is blacklisted
+  sudo contest-manager inspector               # Run the payload inspector for participant
+  sudo contest-manager sinkhole                # Run the DNS sinkhole for participant
+  sudo contest-manager schedule --contest 09:00 --end 14:00  # Switch phases at fixed times
+  sudo contest-manager watch                   # Put back removed rules for participant as they go
+  sudo contest-manager daemon                  # Refresh participant's cache as DNS answers expire
+  sudo contest-manager drop-log                # Count participant's blocked attempts (restrict --log-drops)
+  sudo contest-manager benchmark               # Measure the packet path under each backend
         """
     )
 
@@ -39,24 +73,113 @@ Examples:
     reset_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
 
     restrict_parser = subparsers.add_parser('restrict', help='Enable internet restrictions')
-    restrict_parser.add_argument('user', nargs='?', default='participant', help='Username (default: participant)')
+    restrict_parser.add_argument('users', nargs='*', metavar='user', help='Usernames (default: participant)')
+    restrict_parser.add_argument('--all', action='store_true', help='Restrict every user listed in config/users.txt')
     restrict_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    restrict_parser.add_argument('--mode', choices=['blacklist', 'allowlist'], default='blacklist', help='Block config/blacklist.txt, or allow only config/allowlist.txt (default: blacklist)')
+    restrict_parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help=f'How firewall rules are applied (default: {DEFAULT_BACKEND})')
+    restrict_parser.add_argument('--inspector', action='store_true', help='Check DNS/TLS names with the payload inspector instead of string rules')
+    restrict_parser.add_argument('--sinkhole', action='store_true', help='Redirect the user\'s DNS traffic to a local resolver answering NXDOMAIN for blacklisted names')
+    restrict_parser.add_argument('--log-drops', action='store_true', help='Count blocked connection attempts with rate-limited NFLOG rules (nft and ipset backends)')
+    add_resolver_arguments(restrict_parser)
 
     unrestrict_parser = subparsers.add_parser('unrestrict', help='Disable internet restrictions')
     unrestrict_parser.add_argument('user', nargs='?', default='participant', help='Username (default: participant)')
     unrestrict_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
 
     status_parser = subparsers.add_parser('status', help='Show current restriction status')
-    status_parser.add_argument('user', nargs='?', default='participant', help='Username (default: participant)')
+    status_parser.add_argument('users', nargs='*', metavar='user', help='Usernames (default: participant)')
+    status_parser.add_argument('--all', action='store_true', help='Show every user listed in config/users.txt')
+    status_parser.add_argument('--json', action='store_true', help='Print the status as JSON')
     status_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
 
     start_restriction_parser = subparsers.add_parser('start-restriction', help='Start restriction system at boot (for persistence)')
     start_restriction_parser.add_argument('user', nargs='?', default='participant', help='Username to restrict (default: participant)')
     start_restriction_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    start_restriction_parser.add_argument('--backend', choices=BACKENDS, help='How firewall rules are applied (default: the one used by restrict)')
 
     update_restriction_parser = subparsers.add_parser('update-restriction', help='Update internet restrictions (refresh iptables rules)')
     update_restriction_parser.add_argument('user', nargs='?', default='participant', help='Username to update restrictions for (default: participant)')
     update_restriction_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    update_restriction_parser.add_argument('--backend', choices=BACKENDS, help='How firewall rules are applied (default: the one used by restrict)')
+    update_restriction_parser.add_argument('--evict-after', type=int, default=DEFAULT_EVICT_AFTER, help=f'Drop cached addresses not seen for this many seconds (default: {DEFAULT_EVICT_AFTER})')
+    update_restriction_parser.add_argument('--force', action='store_true', help='Re-resolve every name even if its TTL has not expired')
+    update_restriction_parser.add_argument('--prune', action='store_true', help='Also remove blocked addresses that are no longer in the cache')
+    add_resolver_arguments(update_restriction_parser)
+
+    explain_parser = subparsers.add_parser('explain', help='Explain why an IP address or domain is blocked')
+    explain_parser.add_argument('target', help='IP address or domain name')
+    explain_parser.add_argument('--user', default='participant', help='Username whose cache to query (default: participant)')
+    explain_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+
+    import_parser = subparsers.add_parser('import-blocklist', help='Import a hosts/adblock/plain blocklist into the blacklist')
+    import_parser.add_argument('source', help='Path of the blocklist file to import')
+    import_parser.add_argument('--format', choices=['auto', 'hosts', 'adblock', 'plain'], default='auto', help='Input format (default: auto)')
+    import_parser.add_argument('--name', help='Name of the imported list (default: source file name)')
+    import_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+
+    check_parser = subparsers.add_parser('check', help='Check whether a hostname is covered by the blacklist')
+    check_parser.add_argument('hostname', help='Hostname to check')
+    check_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+
+    inspector_parser = subparsers.add_parser('inspector', help='Run the DNS/TLS payload inspector daemon')
+    inspector_parser.add_argument('user', nargs='?', default='participant', help='Username whose queue to serve (default: participant)')
+    inspector_parser.add_argument('--queue-num', type=int, help='NFQUEUE number to serve (default: derived from the user UID)')
+    inspector_parser.add_argument('--verbose', '-v', action='store_true', help='Print every checked name and its verdict')
+
+    sinkhole_parser = subparsers.add_parser('sinkhole', help='Run the local filtering DNS resolver')
+    sinkhole_parser.add_argument('user', nargs='?', default='participant', help='Username whose DNS traffic to serve (default: participant)')
+    sinkhole_parser.add_argument('--port', type=int, help='Port to listen on (default: derived from the user UID)')
+    sinkhole_parser.add_argument('--listen', action='append', metavar='IP', help='Address to listen on (repeatable)')
+    sinkhole_parser.add_argument('--upstream', metavar='IP[:PORT]', help='Resolver to forward allowed queries to (default: from /etc/resolv.conf)')
+    sinkhole_parser.add_argument('--timeout', type=float, help='Upstream query timeout in seconds')
+    sinkhole_parser.add_argument('--verbose', '-v', action='store_true', help='Print every blocked name and upstream failure')
+
+    schedule_parser = subparsers.add_parser('schedule', help='Stage contest phase rulesets and switch them at set times')
+    schedule_parser.add_argument('users', nargs='*', metavar='user', help='Usernames (default: participant)')
+    schedule_parser.add_argument('--all', action='store_true', help='Schedule every user listed in config/users.txt')
+    for phase in ('practice', 'contest', 'freeze', 'end'):
+        schedule_parser.add_argument(f'--{phase}', metavar='TIME', help=f"Start of the {phase} phase ('YYYY-MM-DD HH:MM' or 'HH:MM' today)")
+    schedule_parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND, help=f'How firewall rules are applied (default: {DEFAULT_BACKEND})')
+    schedule_parser.add_argument('--list', action='store_true', help='Show the scheduled phases')
+    schedule_parser.add_argument('--clear', action='store_true', help='Remove the phase timers and staged rulesets')
+    schedule_parser.add_argument('--apply-phase', choices=['practice', 'contest', 'freeze', 'end'], help='Switch to a staged phase now (run by the phase timers)')
+    schedule_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+    add_resolver_arguments(schedule_parser)
+
+    watch_parser = subparsers.add_parser('watch', help='Run the tamper watcher (re-applies removed restrictions)')
+    watch_parser.add_argument('users', nargs='*', metavar='user', help='Usernames (default: participant)')
+    watch_parser.add_argument('--all', action='store_true', help='Watch every user listed in config/users.txt')
+    watch_parser.add_argument('--poll-interval', type=float, help='Also check every this many seconds')
+    watch_parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose output')
+
+    daemon_parser = subparsers.add_parser('daemon', help='Run the enforcement daemon (TTL-driven cache and rule refresh)')
+    daemon_parser.add_argument('users', nargs='*', metavar='user', help='Usernames (default: participant)')
+    daemon_parser.add_argument('--all', action='store_true', help='Serve every user listed in config/users.txt')
+    daemon_parser.add_argument('--max-queries', type=int, help='Maximum concurrent DNS queries')
+    daemon_parser.add_argument('--jitter', type=float, help='Delay refreshes by up to this fraction of the TTL')
+    daemon_parser.add_argument('--evict-after', type=int, default=DEFAULT_EVICT_AFTER, help=f'Drop cached addresses not seen for this many seconds (default: {DEFAULT_EVICT_AFTER})')
+    daemon_parser.add_argument('--prune', action='store_true', help='Also remove blocked addresses that are no longer in the cache')
+    daemon_parser.add_argument('--nameserver', action='append', metavar='IP[:PORT]', help='Nameserver to resolve the blacklist with (repeatable)')
+    daemon_parser.add_argument('--dns-timeout', type=float, help='Per-query DNS timeout in seconds')
+    daemon_parser.add_argument('--verbose', '-v', action='store_true', help='Print every refresh batch')
+
+    drop_log_parser = subparsers.add_parser('drop-log', help='Count blocked connection attempts (restrict --log-drops)')
+    drop_log_parser.add_argument('users', nargs='*', metavar='user', help='Usernames (default: participant)')
+    drop_log_parser.add_argument('--all', action='store_true', help='Count for every user listed in config/users.txt')
+    drop_log_parser.add_argument('--flush-interval', type=float, help='Write a summary every this many seconds')
+    drop_log_parser.add_argument('--verbose', '-v', action='store_true', help='Print every new blocked attempt')
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Measure packet rate and connect latency of generated rulesets')
+    benchmark_parser.add_argument('--backend', action='append', choices=['nft', 'restore', 'ipset', 'legacy'], dest='backends', help='Backend to measure (repeatable, default: every installed one)')
+    benchmark_parser.add_argument('--size', action='append', type=int, dest='sizes', help='Blocked addresses in the synthetic cache (repeatable)')
+    benchmark_parser.add_argument('--duration', type=float, help='Seconds of UDP traffic per measurement')
+    benchmark_parser.add_argument('--connects', type=int, help='TCP connections opened per measurement')
+    benchmark_parser.add_argument('--user', help='Test user, created and removed if missing')
+    benchmark_parser.add_argument('--output', help='Report file (default: cache/benchmark_<time>.json)')
+    benchmark_parser.add_argument('--compare', metavar='REPORT', help='Earlier report to check for regressions')
+    benchmark_parser.add_argument('--tolerance', type=float, help='Fraction a result may get worse before it counts as a regression')
+    benchmark_parser.add_argument('--verbose', '-v', action='store_true', help='Show the output of every restrict/unrestrict step')
 
     args = parser.parse_args()
 
@@ -68,25 +191,87 @@ Examples:
         check_root()
         if args.command == "setup":
             sys.argv = [sys.argv[0]] + (['--verbose'] if args.verbose else [])
-            setup_main()
+            run_command(args.command)
         elif args.command == "reset":
             sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if args.verbose else [])
-            reset_main()
+            run_command(args.command)
         elif args.command == "restrict":
-            sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if args.verbose else [])
-            restrict_main()
+            sys.argv = [sys.argv[0]] + args.users + (['--all'] if args.all else []) + (['--verbose'] if args.verbose else []) + resolver_argv(args)
+            sys.argv += ['--mode', args.mode, '--backend', args.backend] + (['--inspector'] if args.inspector else [])
+            sys.argv += (['--sinkhole'] if args.sinkhole else []) + (['--log-drops'] if args.log_drops else [])
+            run_command(args.command)
         elif args.command == "unrestrict":
             sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if args.verbose else [])
-            unrestrict_main()
+            run_command(args.command)
         elif args.command == "status":
-            sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if args.verbose else [])
-            status_main()
+            sys.argv = [sys.argv[0]] + args.users + (['--all'] if args.all else []) + (['--json'] if args.json else [])
+            sys.argv += ['--verbose'] if args.verbose else []
+            run_command(args.command)
         elif args.command == "start-restriction":
             sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if getattr(args, 'verbose', False) else [])
-            start_restriction_main()
+            sys.argv += ['--backend', args.backend] if args.backend else []
+            run_command(args.command)
         elif args.command == "update-restriction":
-            sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if getattr(args, 'verbose', False) else [])
-            update_restriction_main()
+            sys.argv = [sys.argv[0]] + [args.user] + (['--verbose'] if getattr(args, 'verbose', False) else []) + resolver_argv(args)
+            sys.argv += ['--evict-after', str(args.evict_after)] + (['--force'] if args.force else [])
+            sys.argv += ['--prune'] if args.prune else []
+            sys.argv += ['--backend', args.backend] if args.backend else []
+            run_command(args.command)
+        elif args.command == "explain":
+            sys.argv = [sys.argv[0], args.target, '--user', args.user] + (['--verbose'] if args.verbose else [])
+            run_command(args.command)
+        elif args.command == "import-blocklist":
+            sys.argv = [sys.argv[0], args.source, '--format', args.format] + (['--name', args.name] if args.name else []) + (['--verbose'] if args.verbose else [])
+            run_command(args.command)
+        elif args.command == "check":
+            sys.argv = [sys.argv[0], args.hostname] + (['--verbose'] if args.verbose else [])
+            run_command(args.command)
+        elif args.command == "inspector":
+            sys.argv = [sys.argv[0], args.user] + (['--queue-num', str(args.queue_num)] if args.queue_num is not None else [])
+            sys.argv += ['--verbose'] if args.verbose else []
+            run_command(args.command)
+        elif args.command == "sinkhole":
+            sys.argv = [sys.argv[0], args.user] + (['--port', str(args.port)] if args.port is not None else [])
+            for address in args.listen or []:
+                sys.argv += ['--listen', address]
+            sys.argv += ['--upstream', args.upstream] if args.upstream else []
+            sys.argv += ['--timeout', str(args.timeout)] if args.timeout is not None else []
+            sys.argv += ['--verbose'] if args.verbose else []
+            run_command(args.command)
+        elif args.command == "schedule":
+            sys.argv = [sys.argv[0]] + args.users + (['--all'] if args.all else []) + (['--verbose'] if args.verbose else []) + resolver_argv(args)
+            for phase in ('practice', 'contest', 'freeze', 'end'):
+                sys.argv += [f'--{phase}', getattr(args, phase)] if getattr(args, phase) else []
+            sys.argv += ['--backend', args.backend] + (['--list'] if args.list else []) + (['--clear'] if args.clear else [])
+            sys.argv += ['--apply-phase', args.apply_phase] if args.apply_phase else []
+            run_command(args.command)
+        elif args.command == "daemon":
+            sys.argv = [sys.argv[0]] + args.users + (['--all'] if args.all else []) + (['--verbose'] if args.verbose else [])
+            for ns in args.nameserver or []:
+                sys.argv += ['--nameserver', ns]
+            for option in ('max_queries', 'jitter', 'dns_timeout'):
+                value = getattr(args, option)
+                sys.argv += [f"--{option.replace('_', '-')}", str(value)] if value is not None else []
+            sys.argv += ['--evict-after', str(args.evict_after)] + (['--prune'] if args.prune else [])
+            run_command(args.command)
+        elif args.command == "watch":
+            sys.argv = [sys.argv[0]] + args.users + (['--all'] if args.all else []) + (['--verbose'] if args.verbose else [])
+            sys.argv += ['--poll-interval', str(args.poll_interval)] if args.poll_interval is not None else []
+            run_command(args.command)
+        elif args.command == "drop-log":
+            sys.argv = [sys.argv[0]] + args.users + (['--all'] if args.all else []) + (['--verbose'] if args.verbose else [])
+            sys.argv += ['--flush-interval', str(args.flush_interval)] if args.flush_interval is not None else []
+            run_command(args.command)
+        elif args.command == "benchmark":
+            sys.argv = [sys.argv[0]] + (['--verbose'] if args.verbose else [])
+            for backend in args.backends or []:
+                sys.argv += ['--backend', backend]
+            for size in args.sizes or []:
+                sys.argv += ['--size', str(size)]
+            for option in ('duration', 'connects', 'user', 'output', 'compare', 'tolerance'):
+                value = getattr(args, option)
+                sys.argv += [f"--{option}", str(value)] if value is not None else []
+            run_command(args.command)
         else:
             parser.print_help()
             sys.exit(1)
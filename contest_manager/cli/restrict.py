@@ -9,10 +9,15 @@ from pathlib import Path
 from contest_manager.utils.utils import check_root
 from contest_manager.utils.internet_handler import *
 from contest_manager.utils.usb_handler import *
-from contest_manager.utils.persistence_handler import start_persistence
+from contest_manager.utils.persistence_handler import start_persistence, stop_services
+from contest_manager.utils.dns_resolver import DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from contest_manager.utils.firewall import BACKENDS, DEFAULT_BACKEND
+from contest_manager.utils.user_manager import extract_user_password_pairs
 
 CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
 BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+ALLOWLIST_TXT = CONFIG_DIR / 'allowlist.txt'
+USERS_TXT = CONFIG_DIR / 'users.txt'
 
 def create_parser():
     parser = argparse.ArgumentParser(
@@ -20,38 +25,108 @@ def create_parser():
         prog="contest-restrict"
     )
     parser.add_argument(
-        'user', nargs='?', default='participant', help='Username to restrict (default: participant)'
+        'users', nargs='*', metavar='user', help='Usernames to restrict (default: participant)'
+    )
+    parser.add_argument(
+        '--all', action='store_true', help='Restrict every user listed in config/users.txt'
     )
     parser.add_argument(
         '--config-dir', type=str, help='Configuration directory path (default: project root)'
     )
+    parser.add_argument(
+        '--mode', choices=['blacklist', 'allowlist'], default='blacklist',
+        help='Block config/blacklist.txt, or allow only config/allowlist.txt (default: blacklist)'
+    )
+    parser.add_argument(
+        '--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+        help=f'How firewall rules are applied (default: {DEFAULT_BACKEND})'
+    )
+    parser.add_argument(
+        '--inspector', action='store_true',
+        help='Check DNS/TLS names with the payload inspector daemon instead of per-domain string rules'
+    )
+    parser.add_argument(
+        '--sinkhole', action='store_true',
+        help="Redirect the user's DNS traffic to a local resolver answering NXDOMAIN for blacklisted names"
+    )
+    parser.add_argument(
+        '--log-drops', action='store_true',
+        help='Count blocked connection attempts with rate-limited NFLOG rules (nft and ipset backends)'
+    )
+    parser.add_argument(
+        '--nameserver', action='append', metavar='IP[:PORT]',
+        help='Nameserver to resolve the blacklist with (repeatable, default: system resolvers)'
+    )
+    parser.add_argument(
+        '--dns-timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Per-query DNS timeout in seconds (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--dns-workers', type=int, default=DEFAULT_WORKERS, help=f'Maximum concurrent DNS queries (default: {DEFAULT_WORKERS})'
+    )
     parser.add_argument(
         '--verbose', '-v', action='store_true', help='Enable verbose output'
     )
     return parser
 
+def get_users(args):
+    if args.all:
+        return [username for username, _ in extract_user_password_pairs(USERS_TXT)]
+    return args.users or ['participant']
+
 def main():
     parser = create_parser()
     args = parser.parse_args()
+    if args.backend == 'bpf' and args.mode == 'blacklist':
+        # The eBPF program only matches addresses: there is no queue or log rule to attach
+        if args.inspector:
+            parser.error('--inspector needs a netfilter backend (restore, ipset, legacy or nft), not bpf')
+        if args.log_drops:
+            parser.error('--log-drops needs the nft or ipset backend, not bpf')
     check_root()
+    users = get_users(args)
+    if not users:
+        sys.exit(1)
+    if args.sinkhole and args.mode == 'blacklist' and not sinkhole_ports_free(users):
+        sys.exit(1)
     print("\n🧹 STEP 1: Remove Previous Restrictions\n" + ("="*40))
-    print("Removing internet restriction...")
-    unrestrict_internet(args.user, BLACKLIST_TXT, verbose=args.verbose)
-    print("Removing USB restriction...")
-    unrestrict_usb_storage_device(args.user, verbose=args.verbose)
+    for user in users:
+        stop_services(user)
+        print(f"Removing internet restriction for user: {user} ...")
+        unrestrict_internet(user, BLACKLIST_TXT, verbose=args.verbose)
+        print(f"Removing USB restriction for user: {user} ...")
+        unrestrict_usb_storage_device(user, verbose=args.verbose)
     print("✅ Previous restrictions removed.\n")
 
     print("\n🌐 STEP 2: Restrict Internet Access\n" + ("="*40))
-    print("Woriing on it. Please wait, it may take few minutes.")
-    restrict_internet(args.user, BLACKLIST_TXT, verbose=args.verbose)
+    resolve_options = dict(nameservers=args.nameserver, timeout=args.dns_timeout, workers=args.dns_workers)
+    if args.mode == 'allowlist':
+        for user in users:
+            restrict_internet_allowlist(user, ALLOWLIST_TXT, verbose=args.verbose, backend=args.backend,
+                                        **resolve_options)
+    elif len(users) == 1:
+        print("Working on it. Please wait, resolving the blacklist may take a few seconds.")
+        restrict_internet(users[0], BLACKLIST_TXT, verbose=args.verbose, backend=args.backend,
+                          inspector=args.inspector, sinkhole=args.sinkhole, log_drops=args.log_drops,
+                          **resolve_options)
+    else:
+        print("Working on it. Please wait, resolving the blacklist may take a few seconds.")
+        restrict_internet_for_users(users, BLACKLIST_TXT, verbose=args.verbose, backend=args.backend,
+                                    inspector=args.inspector, sinkhole=args.sinkhole, log_drops=args.log_drops,
+                                    **resolve_options)
     print("✅ Internet access restricted.\n")
 
     print("\n🔌 STEP 3: Block USB Storage Devices\n" + ("="*40))
-    restrict_usb_storage_device(args.user, verbose=args.verbose)
+    for user in users:
+        restrict_usb_storage_device(user, verbose=args.verbose)
     print("✅ USB storage devices blocked.\n")
 
     print("\n⏰ STEP 4: Persisting Restrictions\n" + ("="*40))
-    start_persistence(args.user)
+    for user in users:
+        allowlist = args.mode == 'allowlist'
+        # log_drops is recorded as False when the backend cannot log
+        log_drops = not allowlist and load_user_state(user).get('log_drops', False)
+        start_persistence(user, inspector=args.inspector and not allowlist, sinkhole=args.sinkhole and not allowlist,
+                          log_drops=log_drops)
     print("✅ Restrictions persisted successfully!\n")
 
     print("\n🎉✅ Restrictions applied successfully!")
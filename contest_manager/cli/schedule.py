@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Schedule CLI
+"""
+import sys
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.firewall import BACKENDS, DEFAULT_BACKEND
+from contest_manager.utils.dns_resolver import DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from contest_manager.utils.internet_handler import load_user_state
+from contest_manager.utils.schedule_handler import PHASES, parse_phase_time, stage_schedule, apply_phase, clear_schedule
+from contest_manager.utils.user_manager import extract_user_password_pairs
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+ALLOWLIST_TXT = CONFIG_DIR / 'allowlist.txt'
+PHASES_TXT = CONFIG_DIR / 'phases.txt'
+USERS_TXT = CONFIG_DIR / 'users.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Schedule contest phases: stage each phase's ruleset and switch at the given times",
+        prog="contest-schedule"
+    )
+    parser.add_argument(
+        'users', nargs='*', metavar='user', help='Usernames to schedule (default: participant)'
+    )
+    parser.add_argument(
+        '--all', action='store_true', help='Schedule every user listed in config/users.txt'
+    )
+    for phase in PHASES:
+        parser.add_argument(
+            f'--{phase}', metavar='TIME', help=f"Start of the {phase} phase ('YYYY-MM-DD HH:MM' or 'HH:MM' today)"
+        )
+    parser.add_argument(
+        '--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+        help=f'How firewall rules are applied (default: {DEFAULT_BACKEND})'
+    )
+    parser.add_argument(
+        '--list', action='store_true', help='Show the scheduled phases'
+    )
+    parser.add_argument(
+        '--clear', action='store_true', help='Remove the phase timers and staged rulesets'
+    )
+    parser.add_argument(
+        '--apply-phase', choices=PHASES, help='Switch to a staged phase now (run by the phase timers)'
+    )
+    parser.add_argument(
+        '--nameserver', action='append', metavar='IP[:PORT]',
+        help='Nameserver to resolve the blacklist with (repeatable, default: system resolvers)'
+    )
+    parser.add_argument(
+        '--dns-timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Per-query DNS timeout in seconds (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--dns-workers', type=int, default=DEFAULT_WORKERS, help=f'Maximum concurrent DNS queries (default: {DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Enable verbose output'
+    )
+    return parser
+
+def get_users(args):
+    if args.all:
+        return [username for username, _ in extract_user_password_pairs(USERS_TXT)]
+    return args.users or ['participant']
+
+def print_schedule(user):
+    schedule = load_user_state(user).get('schedule') or {}
+    print(f"\n📅 Schedule for user: {user}\n" + ("="*40))
+    if not schedule:
+        print("  No phases scheduled.")
+    for phase, entry in sorted(schedule.items(), key=lambda item: item[1]['at']):
+        print(f"  {phase:<8} {entry['at']}  {entry['mode']}")
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    users = get_users(args)
+    if not users:
+        sys.exit(1)
+    if args.apply_phase:
+        results = [apply_phase(user, args.apply_phase, verbose=args.verbose) for user in users]
+        sys.exit(0 if all(results) else 1)
+    if args.list:
+        for user in users:
+            print_schedule(user)
+        sys.exit(0)
+    if args.clear:
+        for user in users:
+            clear_schedule(user)
+        sys.exit(0)
+    try:
+        times = {phase: parse_phase_time(getattr(args, phase)) for phase in PHASES if getattr(args, phase)}
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if not times:
+        parser.error('give the start time of at least one phase (--practice, --contest, --freeze, --end)')
+    ordered = [times[phase] for phase in PHASES if phase in times]
+    if ordered != sorted(ordered):
+        print("❌ Phase times must follow the order practice, contest, freeze, end.")
+        sys.exit(1)
+    print("\n📦 Staging phase rulesets\n" + ("="*40))
+    print("Working on it. Please wait, resolving the lists may take a few seconds.")
+    if not stage_schedule(users, times, BLACKLIST_TXT, ALLOWLIST_TXT, PHASES_TXT, args.backend, verbose=args.verbose,
+                          nameservers=args.nameserver, timeout=args.dns_timeout, workers=args.dns_workers):
+        sys.exit(1)
+    for user in users:
+        print_schedule(user)
+    print("\n✅ Phases scheduled. Each switch loads its staged ruleset in one transaction.\n")
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
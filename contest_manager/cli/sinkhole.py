@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Contest Environment DNS Sinkhole CLI
+"""
+import sys
+import pwd
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.internet_handler import get_policy_source
+from contest_manager.utils.dns_sinkhole import (
+    DEFAULT_TIMEOUT, LISTEN_ADDRESSES, sinkhole_port, parse_upstream, system_upstream, run_sinkhole
+)
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Answer DNS queries of a restricted user, with NXDOMAIN for blacklisted names",
+        prog="contest-sinkhole"
+    )
+    parser.add_argument(
+        'user', nargs='?', default='participant', help='Username whose DNS traffic to serve (default: participant)'
+    )
+    parser.add_argument(
+        '--port', type=int, help='Port to listen on (default: derived from the user UID)'
+    )
+    parser.add_argument(
+        '--listen', action='append', metavar='IP',
+        help=f"Address to listen on (repeatable, default: {', '.join(LISTEN_ADDRESSES)})"
+    )
+    parser.add_argument(
+        '--upstream', metavar='IP[:PORT]', help='Resolver to forward allowed queries to (default: first nameserver in /etc/resolv.conf)'
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Upstream query timeout in seconds (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Print every blocked name and upstream failure'
+    )
+    return parser
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    port = args.port
+    if port is None:
+        try:
+            port = sinkhole_port(pwd.getpwnam(args.user).pw_uid)
+        except KeyError:
+            print(f"❌ User {args.user} not found.")
+            sys.exit(1)
+    upstream = parse_upstream(args.upstream) if args.upstream else system_upstream()
+    if not run_sinkhole(port, get_policy_source(BLACKLIST_TXT), upstream,
+                        addresses=args.listen or LISTEN_ADDRESSES, timeout=args.timeout, verbose=args.verbose):
+        sys.exit(1)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@ import argparse
 from pathlib import Path
 
 from contest_manager.utils.utils import check_root
-from contest_manager.utils.internet_handler import apply_restrictions_from_cache
+from contest_manager.utils.firewall import BACKENDS
+from contest_manager.utils.internet_handler import apply_restrictions_from_cache, apply_boot_ruleset
 from contest_manager.utils.usb_handler import restrict_usb_storage_device
 
 CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
@@ -22,6 +23,9 @@ def create_parser():
     parser.add_argument(
         'user', nargs='?', default='participant', help='Username to restrict (default: participant)'
     )
+    parser.add_argument(
+        '--backend', choices=BACKENDS, help='How firewall rules are applied (default: the one used by restrict)'
+    )
     parser.add_argument(
         '--verbose', '-v', action='store_true', help='Enable verbose output'
     )
@@ -33,7 +37,11 @@ def main():
     check_root()
     user = args.user
     print("\n🌐 Applying internet restrictions from cache\n" + ("="*40))
-    apply_restrictions_from_cache(user, verbose=args.verbose)
+    # The precompiled ruleset is loaded in one restore call; an explicit backend recompiles
+    if args.backend or not apply_boot_ruleset(user, verbose=args.verbose):
+        if not args.backend:
+            print("⚠️  No valid boot ruleset found, compiling the rules from the cache.")
+        apply_restrictions_from_cache(user, verbose=args.verbose, backend=args.backend)
     print("\n🔌 Blocking USB storage devices\n" + ("="*40))
     restrict_usb_storage_device(user, verbose=args.verbose)
     print("\n✅ Internet and USB restrictions applied from cache.\n")
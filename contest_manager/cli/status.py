@@ -2,38 +2,115 @@
 """
 Contest Environment Status CLI
 """
-#!/usr/bin/env python3
-"""
-Contest Environment Status CLI
-"""
 import sys
+import pwd
+import json
+import time
 import argparse
-from contest_manager.utils.usb_handler import usb_restriction_check
-from contest_manager.utils.internet_handler import internet_restriction_check
+from pathlib import Path
+
+from contest_manager.utils.status_snapshot import collect_status
+from contest_manager.utils.user_manager import extract_user_password_pairs
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+USERS_TXT = CONFIG_DIR / 'users.txt'
 
 def create_parser():
     parser = argparse.ArgumentParser(
-        description="Show current restriction status for a user",
+        description="Show current restriction status for contest users",
         prog="contest-status"
     )
     parser.add_argument(
-        'user', nargs='?', default='participant', help='Username to check (default: participant)'
+        'users', nargs='*', metavar='user', help='Usernames to check (default: participant)'
+    )
+    parser.add_argument(
+        '--all', action='store_true', help='Show every user listed in config/users.txt'
+    )
+    parser.add_argument(
+        '--json', action='store_true', help='Print the status as JSON (for monitoring)'
+    )
+    parser.add_argument(
+        '--fail-inactive', action='store_true', help='Exit with status 1 if any user\'s internet restrictions are inactive'
     )
     parser.add_argument(
         '--verbose', '-v', action='store_true', help='Enable verbose output'
     )
     return parser
 
+def get_users(args):
+    if args.all:
+        return [username for username, _ in extract_user_password_pairs(USERS_TXT)]
+    return args.users or ['participant']
+
+def format_age(seconds):
+    if seconds is None:
+        return 'no cache'
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return f"{seconds // size}{unit} ago"
+    return f"{seconds}s ago"
+
+def format_drift(drift):
+    if drift is None:
+        return 'unknown (no compiled ruleset)'
+    if not any(drift.values()):
+        return '✅ none'
+    return f"⚠️  {drift['missing']} missing, {drift['extra']} extra, {drift['duplicates']} duplicate"
+
+def format_drops(drops, now):
+    top = ', '.join(f"{name} {count}" for name, count in list(drops['domains'].items())[:3])
+    return (f"{drops['attempts']} since {time.strftime('%Y-%m-%d %H:%M', time.localtime(drops['since']))}"
+            f" (updated {format_age(max(0, int(now - drops['updated'])))})" + (f", top: {top}" if top else ''))
+
+def print_status(status):
+    print(f"\n  {status['user']} (UID {status['uid']})")
+    if 'error' in status:
+        print(f"    ❌ {status['error']}")
+        return
+    backend = f", {status['backend']} backend" if status['backend'] else ''
+    print(f"    Internet restrictions: {'✅ Active' if status['active'] else '❌ Inactive'} ({status['mode']} mode{backend})")
+    if status['phase']:
+        print(f"    Phase: {status['phase']}")
+    rules = ', '.join(f"{family} {count}" for family, count in status['rules'].items())
+    jumps = [family for family, jumped in status['jump'].items() if jumped]
+    print(f"    Rules: {rules or 'none'} (OUTPUT jump: {', '.join(jumps) or 'none'})")
+    if status['legacy_rules']:
+        print(f"    Legacy OUTPUT DROP rules: {status['legacy_rules']}")
+    if status['sets']:
+        print(f"    Sets: {', '.join(f'{name} {size}' for name, size in sorted(status['sets'].items()))}")
+    if 'bpf' in status:
+        print(f"    eBPF: {status['bpf']['dropped']} of {status['bpf']['packets']} packets dropped")
+    if status['sinkhole']:
+        print(f"    DNS sinkhole: {'✅ Redirected' if status['dns_redirect'] else '❌ Not redirected'}")
+    print(f"    Cache: {format_age(status['cache_age'])}")
+    print(f"    Drift: {format_drift(status['drift'])}")
+    if status['drops']:
+        print(f"    Blocked attempts: {format_drops(status['drops'], time.time())}")
+    print(f"    USB restrictions: {'✅ Active' if status['usb'] else '❌ Inactive'}")
+
 def main():
     parser = create_parser()
     args = parser.parse_args()
-    user = args.user
-    print(f"\n🔎 Restriction Status for user: {user}\n" + ("="*40))
-    net_status = internet_restriction_check(user)
-    print(f"  Internet restrictions: {'✅ Active' if net_status else '❌ Inactive'}")
-    usb_status = usb_restriction_check(user)
-    print(f"  USB restrictions: {'✅ Active' if usb_status else '❌ Inactive'}")
-    print("\nStatus check complete.\n")
+    names = get_users(args)
+    users, statuses = [], {}
+    for user in names:
+        try:
+            users.append((user, pwd.getpwnam(user).pw_uid))
+        except KeyError:
+            statuses[user] = {'user': user, 'uid': None, 'error': 'user not found'}
+    for status in collect_status(users):
+        statuses[status['user']] = status
+    statuses = [statuses[user] for user in names]
+    if args.json:
+        print(json.dumps(statuses, indent=2))
+    else:
+        print("\n🔎 Restriction Status\n" + ("="*40))
+        for status in statuses:
+            print_status(status)
+        print("\nStatus check complete.\n")
+    if args.fail_inactive and not all(status.get('active') for status in statuses):
+        sys.exit(1)
+    sys.exit(0)
 
 if __name__ == "__main__":
     main()
@@ -7,10 +7,17 @@ import argparse
 from pathlib import Path
 
 from contest_manager.utils.utils import check_root
-from contest_manager.utils.internet_handler import update_ip_cache, apply_restrictions_from_cache
+from contest_manager.utils.firewall import BACKENDS
+from contest_manager.utils.internet_handler import (
+    update_ip_cache, update_restrictions_from_cache, get_restriction_mode, update_allowlist_cache,
+    apply_restrictions_from_cache
+)
+from contest_manager.utils.dns_resolver import DEFAULT_TIMEOUT, DEFAULT_WORKERS
+from contest_manager.utils.ip_cache import DEFAULT_EVICT_AFTER
 
 CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
 BLACKLIST_TXT = CONFIG_DIR / 'blacklist.txt'
+ALLOWLIST_TXT = CONFIG_DIR / 'allowlist.txt'
 
 def create_parser():
     parser = argparse.ArgumentParser(
@@ -20,6 +27,29 @@ def create_parser():
     parser.add_argument(
         'user', nargs='?', default='participant', help='Username to update restrictions for (default: participant)'
     )
+    parser.add_argument(
+        '--evict-after', type=int, default=DEFAULT_EVICT_AFTER,
+        help=f'Drop cached addresses not seen for this many seconds (default: {DEFAULT_EVICT_AFTER})'
+    )
+    parser.add_argument(
+        '--force', action='store_true', help='Re-resolve every name even if its TTL has not expired'
+    )
+    parser.add_argument(
+        '--nameserver', action='append', metavar='IP[:PORT]',
+        help='Nameserver to resolve the blacklist with (repeatable, default: system resolvers)'
+    )
+    parser.add_argument(
+        '--dns-timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Per-query DNS timeout in seconds (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--dns-workers', type=int, default=DEFAULT_WORKERS, help=f'Maximum concurrent DNS queries (default: {DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--prune', action='store_true', help='Also remove blocked addresses that are no longer in the cache'
+    )
+    parser.add_argument(
+        '--backend', choices=BACKENDS, help='How firewall rules are applied (default: the one used by restrict)'
+    )
     parser.add_argument(
         '--verbose', '-v', action='store_true', help='Enable verbose output'
     )
@@ -30,13 +60,23 @@ def main():
     args = parser.parse_args()
     check_root()
     user = args.user
+    if get_restriction_mode(user) == 'allowlist':
+        print("\n🌐 Re-resolving the allowlist\n" + ("="*40))
+        update_allowlist_cache(user, ALLOWLIST_TXT, verbose=args.verbose, nameservers=args.nameserver,
+                               timeout=args.dns_timeout, workers=args.dns_workers)
+        if apply_restrictions_from_cache(user, verbose=args.verbose, backend=args.backend):
+            print("\n✅ Allowlist restrictions updated.\n")
+        sys.exit(0)
     print("\n🌐 Updating stored IP cache\n" + ("="*40))
-    success, cache_path = update_ip_cache(user, BLACKLIST_TXT, verbose=args.verbose)
+    success, cache_path = update_ip_cache(user, BLACKLIST_TXT, verbose=args.verbose,
+                                          evict_after=args.evict_after, force=args.force,
+                                          nameservers=args.nameserver, timeout=args.dns_timeout,
+                                          workers=args.dns_workers)
     if success:
         print(f"\n✅ IP cache updated at {cache_path}\n")
-        print("\n🌐 Re-applying internet restrictions from updated cache\n" + ("="*40))
-        apply_restrictions_from_cache(user, verbose=args.verbose)
-        print("\n✅ Internet restrictions updated and applied from cache.\n")
+        print("\n🌐 Applying changes from updated cache\n" + ("="*40))
+        if update_restrictions_from_cache(user, verbose=args.verbose, backend=args.backend, prune=args.prune):
+            print("\n✅ Internet restrictions updated and applied from cache.\n")
     else:
         print("\n❌ Failed to update IP cache.\n")
     sys.exit(0)
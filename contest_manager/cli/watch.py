@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Contest Environment Tamper Watcher CLI
+"""
+import sys
+import pwd
+import argparse
+from pathlib import Path
+
+from contest_manager.utils.utils import check_root
+from contest_manager.utils.tamper_watcher import POLL_INTERVAL, run_watcher
+from contest_manager.utils.user_manager import extract_user_password_pairs
+
+CONFIG_DIR = Path(__file__).parent.parent.parent / 'config'
+USERS_TXT = CONFIG_DIR / 'users.txt'
+
+def create_parser():
+    parser = argparse.ArgumentParser(
+        description="Watch restricted users' rules, USB rule and cached ruleset, and put back what is removed",
+        prog="contest-watch"
+    )
+    parser.add_argument(
+        'users', nargs='*', metavar='user', help='Usernames to watch (default: participant)'
+    )
+    parser.add_argument(
+        '--all', action='store_true', help='Watch every user listed in config/users.txt'
+    )
+    parser.add_argument(
+        '--poll-interval', type=float, default=POLL_INTERVAL,
+        help=f'Also check every this many seconds, for changes that send no notification (default: {POLL_INTERVAL})'
+    )
+    parser.add_argument(
+        '--verbose', '-v', action='store_true', help='Enable verbose output'
+    )
+    return parser
+
+def get_users(args):
+    if args.all:
+        return [username for username, _ in extract_user_password_pairs(USERS_TXT)]
+    return args.users or ['participant']
+
+def main():
+    parser = create_parser()
+    args = parser.parse_args()
+    check_root()
+    users = []
+    for user in get_users(args):
+        try:
+            users.append((user, pwd.getpwnam(user).pw_uid))
+        except KeyError:
+            print(f"❌ User {user} not found.")
+            sys.exit(1)
+    if not users:
+        sys.exit(1)
+    run_watcher(users, poll_interval=args.poll_interval, verbose=args.verbose)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Address aggregation for contest-manager
+
+Cached addresses are collapsed into the fewest CIDR blocks before rules are generated.
+config/aggregation.txt can widen them further and add provider ranges:
+
+    widen ipv4 24 4                 replace the addresses of a /24 by the whole /24 once
+                                    at least 4 of them are cached
+    prefixes /var/lib/pfx2as.txt    offline prefix table ("prefix<TAB>length<TAB>asn" as in
+                                    CAIDA pfx2as dumps, or "prefix/length asn")
+    provider example.com AS64500    block every prefix announced by AS64500 while example.com
+                                    is blacklisted
+    provider example.com auto       block the announced prefixes covering example.com's cached addresses
+"""
+
+import bisect
+import ipaddress
+from pathlib import Path
+
+FAMILY_VERSION = {'ipv4': 4, 'ipv6': 6}
+MAX_PREFIXLEN = {'ipv4': 32, 'ipv6': 128}
+AUTO = 'auto'
+
+def load_aggregation_config(config_path):
+    """
+    Read aggregation.txt. Returns {'widen': {family: [(prefixlen, min_addresses)]}, 'prefixes', 'providers'}.
+    Invalid lines are skipped with a warning.
+    """
+    config = {'widen': {family: [] for family in FAMILY_VERSION}, 'prefixes': None, 'providers': {}}
+    config_path = Path(config_path)
+    if not config_path.exists():
+        return config
+    with open(config_path) as f:
+        for line in f:
+            parts = line.split('#', 1)[0].split()
+            if not parts:
+                continue
+            try:
+                if parts[0] == 'widen' and len(parts) == 4 and parts[1] in FAMILY_VERSION:
+                    prefixlen, min_addresses = int(parts[2]), int(parts[3])
+                    if not 0 <= prefixlen <= MAX_PREFIXLEN[parts[1]] or min_addresses < 1:
+                        raise ValueError(line)
+                    config['widen'][parts[1]].append((prefixlen, min_addresses))
+                elif parts[0] == 'prefixes' and len(parts) == 2:
+                    path = Path(parts[1])
+                    config['prefixes'] = path if path.is_absolute() else config_path.parent / path
+                elif parts[0] == 'provider' and len(parts) >= 3:
+                    config['providers'][parts[1].lower()] = [_parse_asn(p) for p in parts[2:]]
+                else:
+                    raise ValueError(line)
+            except ValueError:
+                print(f"⚠️  Ignoring invalid aggregation setting: {line.strip()}")
+    return config
+
+def _parse_asn(value):
+    if value.lower() == AUTO:
+        return AUTO
+    value = value.upper()
+    return int(value[2:] if value.startswith('AS') else value)
+
+def parse_prefix_line(line):
+    """Parse one prefix table line into (network, [asns]), or None for comments and invalid lines."""
+    parts = line.split('#', 1)[0].split()
+    try:
+        if len(parts) >= 3 and '/' not in parts[0]:
+            network = ipaddress.ip_network(f"{parts[0]}/{parts[1]}", strict=False)
+            origin = parts[2]
+        elif len(parts) >= 2:
+            network = ipaddress.ip_network(parts[0], strict=False)
+            origin = parts[1]
+        else:
+            return None
+        # Multi-origin prefixes are written as "64500_64501" or "64500,64501"
+        asns = [_parse_asn(a) for a in origin.replace(',', '_').split('_') if a]
+    except ValueError:
+        return None
+    return network, asns
+
+def provider_prefixes(config, ip_map, is_blocked):
+    """
+    Stream the prefix table and return the networks to block for the configured providers.
+    is_blocked(domain) tells whether a provider domain is still blacklisted; 'auto' providers
+    take the announced prefixes covering the domain's cached addresses.
+    """
+    if not config['prefixes'] or not config['providers']:
+        return []
+    if not Path(config['prefixes']).exists():
+        print(f"⚠️  Prefix file {config['prefixes']} not found; provider ranges are not blocked.")
+        return []
+    asns = set()
+    auto_domains = set()
+    for domain, origins in config['providers'].items():
+        if not is_blocked(domain):
+            continue
+        asns.update(o for o in origins if o != AUTO)
+        if AUTO in origins:
+            auto_domains.add(domain)
+    probes = {4: [], 6: []}
+    for name, ips in ip_map:
+        if name in auto_domains or any(name.endswith('.' + d) for d in auto_domains):
+            for ip in ips:
+                address = ipaddress.ip_address(ip)
+                probes[address.version].append(int(address))
+    for version in probes:
+        probes[version].sort()
+
+    networks = []
+    with open(config['prefixes'], encoding='utf-8', errors='replace') as f:
+        for line in f:
+            parsed = parse_prefix_line(line)
+            if parsed is None:
+                continue
+            network, origins = parsed
+            if asns.intersection(origins) or _contains_any(probes[network.version], network):
+                networks.append(network)
+    return networks
+
+def _contains_any(sorted_ints, network):
+    i = bisect.bisect_left(sorted_ints, int(network.network_address))
+    return i < len(sorted_ints) and sorted_ints[i] <= int(network.broadcast_address)
+
+def widen(networks, rules):
+    """
+    Apply widening rules [(prefixlen, min_addresses)]: the networks inside a supernet of that
+    length are replaced by the supernet once at least min_addresses of them fall inside it.
+    Returns (networks, number of supernets introduced).
+    """
+    widened = 0
+    for prefixlen, min_addresses in sorted(rules, reverse=True):
+        groups = {}
+        for network in networks:
+            if network.prefixlen <= prefixlen:
+                groups.setdefault(network, []).append(network)
+            else:
+                groups.setdefault(network.supernet(new_prefix=prefixlen), []).append(network)
+        networks = []
+        for supernet, members in groups.items():
+            covered = sum(member.num_addresses for member in members)
+            if covered >= min_addresses and supernet.prefixlen == prefixlen and supernet not in members:
+                networks.append(supernet)
+                widened += 1
+            else:
+                networks.extend(members)
+    return networks, widened
+
+def aggregate(addresses, widen_rules=(), extra=()):
+    """
+    Collapse addresses (and extra networks) of one family into the minimal list of CIDR blocks.
+    Returns (sorted networks as strings, number of widened supernets).
+    """
+    networks = [ipaddress.ip_network(a, strict=False) for a in addresses]
+    networks.extend(extra)
+    networks = list(ipaddress.collapse_addresses(networks))
+    widened = 0
+    if widen_rules:
+        networks, widened = widen(networks, widen_rules)
+        networks = list(ipaddress.collapse_addresses(networks))
+    return [_format(n) for n in networks], widened
+
+def _format(network):
+    """Write host networks as plain addresses, as the rest of the tool does."""
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+def make_aggregator(config, extra_networks=(), stats=None):
+    """
+    Return an aggregate(family, addresses) callable for firewall.build_ruleset applying the
+    config's widening rules and adding the provider networks. Counters are accumulated in stats.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(addresses=0, networks=0, widened=0, provider_prefixes=len(extra_networks))
+
+    def aggregate_family(family, addresses):
+        version = FAMILY_VERSION[family]
+        unique = set(addresses)
+        extra = [n for n in extra_networks if n.version == version]
+        networks, widened = aggregate(unique, config['widen'][family], extra)
+        stats['addresses'] += len(unique)
+        stats['networks'] += len(networks)
+        stats['widened'] += widened
+        return networks
+    return aggregate_family
@@ -0,0 +1,86 @@
+"""
+Allowlist (default-deny) mode for contest-manager
+
+config/allowlist.txt lists the only destinations a restricted user may reach, one per line:
+
+    judge.example.com       resolved to its A/AAAA addresses when restrict/update-restriction run
+    203.0.113.10            a single address
+    10.0.0.0/24             a CIDR block
+
+The resolved entries are kept in a small per-user cache so start-restriction never needs DNS.
+"""
+
+import json
+import ipaddress
+from pathlib import Path
+from contest_manager.utils.utils import atomic_write
+
+RESOLV_CONF = '/etc/resolv.conf'
+
+def parse_allowlist_line(line):
+    """Return ('network', cidr) or ('host', name) for a line, or None for blanks and comments."""
+    entry = line.split('#', 1)[0].strip().lower()
+    if not entry:
+        return None
+    try:
+        return 'network', str(ipaddress.ip_network(entry, strict=False))
+    except ValueError:
+        return 'host', entry.rstrip('.')
+
+def load_allowlist(allowlist_path):
+    """Read allowlist.txt. Returns (hosts, networks) in file order, without duplicates."""
+    hosts, networks = [], []
+    if not Path(allowlist_path).exists():
+        return hosts, networks
+    with open(allowlist_path) as f:
+        for line in f:
+            parsed = parse_allowlist_line(line)
+            if parsed is None:
+                continue
+            kind, value = parsed
+            target = networks if kind == 'network' else hosts
+            if value not in target:
+                target.append(value)
+    return hosts, networks
+
+def system_nameservers(resolv_conf=RESOLV_CONF):
+    """Non-loopback nameservers from resolv.conf (loopback resolvers are reached through lo anyway)."""
+    nameservers = []
+    try:
+        with open(resolv_conf) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 2 or parts[0] != 'nameserver':
+                    continue
+                try:
+                    address = ipaddress.ip_address(parts[1].split('%')[0])
+                except ValueError:
+                    continue
+                if not address.is_loopback and str(address) not in nameservers:
+                    nameservers.append(str(address))
+    except OSError:
+        pass
+    return nameservers
+
+def allowed_networks(resolved, networks):
+    """Collapse the listed networks and the hosts' resolved addresses into the fewest CIDR blocks."""
+    collapsed = []
+    entries = [ipaddress.ip_network(n, strict=False) for n in networks]
+    entries += [ipaddress.ip_network(ip) for ips in resolved.values() for ip in ips]
+    for version in (4, 6):
+        collapsed.extend(str(n) for n in ipaddress.collapse_addresses(e for e in entries if e.version == version))
+    return collapsed
+
+def save_allowlist_cache(cache_path, resolved, networks):
+    """Write the allowlist cache atomically, so a reader never sees a partial file."""
+    with atomic_write(cache_path) as f:
+        json.dump({'hosts': resolved, 'networks': networks}, f, indent=2)
+
+def load_allowlist_cache(cache_path):
+    """Return (resolved hosts, networks) from the cache, or None if it is missing or unreadable."""
+    try:
+        with open(cache_path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data.get('hosts', {}), data.get('networks', [])
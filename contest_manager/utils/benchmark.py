@@ -0,0 +1,309 @@
+"""
+Packet-path benchmark for contest-manager
+
+Measures what the generated ruleset costs a restricted user. Everything runs locally in a
+private network namespace (unshare), so the host's rules and traffic are never touched and
+nothing is left behind when the process exits:
+
+    1. a synthetic IP cache of the requested size is written for a test user (addresses from
+       100.64.0.0/10 and 2001:db8::/32, spaced so aggregation cannot merge them, ADDRESSES_PER_NAME
+       per name)
+    2. apply_restrictions_from_cache applies it with the backend under test, exactly as restrict
+       does (aggregation, optimizer, backend); the apply time and the resulting rules and set
+       entries are recorded
+    3. a traffic generator running as the test user sends UDP packets to a local sink for
+       `duration` seconds (packets per second) and opens `connects` TCP connections to a local
+       listener (connection setup latency); every packet is a new flow, so it walks the whole chain
+    4. the user is unrestricted again
+
+A baseline without rules is measured first. The report is JSON; compare_reports flags results
+that got slower than an earlier report by more than a tolerance.
+"""
+
+import io
+import os
+import pwd
+import json
+import time
+import shutil
+import socket
+import ctypes
+import ctypes.util
+import platform
+import ipaddress
+import threading
+import contextlib
+import subprocess
+from contest_manager.utils.ip_cache import new_cache, save_cache
+from contest_manager.utils.firewall import RESTORE
+from contest_manager.utils.status_snapshot import collect_status
+from contest_manager.utils.internet_handler import (
+    get_cache_dir, get_user_cache_path, get_user_state_path, load_user_state, save_user_state,
+    apply_restrictions_from_cache, unrestrict_internet
+)
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+DEFAULT_DURATION = 2.0
+DEFAULT_CONNECTS = 200
+DEFAULT_TOLERANCE = 0.2
+MIN_APPLY_SECONDS = 0.1
+BENCH_USER = 'contest-bench'
+ADDRESSES_PER_NAME = 4
+IPV6_SHARE = 8
+LEGACY_MAX_ENTRIES = 1000
+V4_BASE = ipaddress.ip_address('100.64.0.0')
+V6_BASE = ipaddress.ip_address('2001:db8::')
+CLONE_NEWNET = 0x40000000
+
+def available_backends():
+    """Backends whose tools are installed. bpf attaches to the user's cgroup, not a namespace, so it is left out."""
+    backends = []
+    if shutil.which('nft'):
+        backends.append('nft')
+    if shutil.which(RESTORE['ipv4']):
+        backends.append('restore')
+        if shutil.which('ipset'):
+            backends.append('ipset')
+    if shutil.which('iptables'):
+        backends.append('legacy')
+    return backends
+
+def enter_namespace():
+    """Move this process into a new, empty network namespace with loopback up."""
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if libc.unshare(CLONE_NEWNET) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"unshare(CLONE_NEWNET) failed: {os.strerror(errno)}")
+    subprocess.run(['ip', 'link', 'set', 'lo', 'up'], check=True)
+
+def synthetic_cache(size, now=None):
+    """A cache of size addresses, ADDRESSES_PER_NAME per name; every IPV6_SHARE-th address is IPv6."""
+    now = int(now or time.time())
+    cache = new_cache()
+    for i in range(0, size, ADDRESSES_PER_NAME):
+        ips = {}
+        for j in range(i, min(i + ADDRESSES_PER_NAME, size)):
+            # Every other address, so no two of them collapse into a wider block
+            address = V6_BASE + 2 * j if j % IPV6_SHARE == IPV6_SHARE - 1 else V4_BASE + 2 * j
+            ips[str(address)] = now
+        cache['records'][f"bench-{i // ADDRESSES_PER_NAME}.invalid"] = {
+            'status': 'ok', 'ttl': 3600, 'resolved_at': now, 'ips': ips}
+    return cache
+
+def ensure_user(user):
+    """Create the test user if needed. Returns (uid, created)."""
+    try:
+        return pwd.getpwnam(user).pw_uid, False
+    except KeyError:
+        pass
+    subprocess.run(['useradd', '--system', '--no-create-home', '--shell', '/usr/sbin/nologin', user], check=True)
+    return pwd.getpwnam(user).pw_uid, True
+
+def remove_user_files(user):
+    cache_path = get_user_cache_path(user)
+    for path in (cache_path, cache_path.with_suffix('.idx'), get_user_state_path(user)):
+        if path.exists() or path.is_symlink():
+            path.unlink()
+
+@contextlib.contextmanager
+def _quiet(verbose):
+    if verbose:
+        yield
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+
+class Sinks:
+    """A UDP sink that is never read (full queues drop silently) and a TCP listener that accepts and closes."""
+
+    def __init__(self):
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(('127.0.0.1', 0))
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind(('127.0.0.1', 0))
+        self.tcp.listen(128)
+        thread = threading.Thread(target=self._accept, daemon=True)
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.tcp.accept()
+            except OSError:
+                return
+            connection.close()
+
+    def close(self):
+        self.udp.close()
+        self.tcp.close()
+
+def udp_flood(host, port, seconds):
+    """Send 64-byte UDP packets for seconds; returns the packets sent, failed sends and the time taken."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = b'x' * 64
+    sent = failed = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(256):
+            try:
+                sock.sendto(payload, (host, port))
+                sent += 1
+            except OSError:
+                failed += 1
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    sock.close()
+    return {'packets': sent, 'failed': failed, 'seconds': now - start}
+
+def tcp_connects(host, port, count):
+    """Open count TCP connections one after another; returns the setup times in seconds and the failures."""
+    samples, failed = [], 0
+    for _ in range(int(count)):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        start = time.perf_counter()
+        try:
+            sock.connect((host, port))
+            samples.append(time.perf_counter() - start)
+        except OSError:
+            failed += 1
+        sock.close()
+    return {'samples': samples, 'failed': failed}
+
+def run_as(uid, gid, function, *args):
+    """Run function(*args) in a child process with the user's identity, so its packets match the user's rules."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.close(read_fd)
+            os.setgroups([])
+            os.setgid(gid)
+            os.setuid(uid)
+            with os.fdopen(write_fd, 'w') as f:
+                json.dump(function(*args), f)
+            status = 0
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        output = f.read()
+    _, status = os.waitpid(pid, 0)
+    if status != 0 or not output:
+        raise RuntimeError(f"traffic generator running as UID {uid} failed")
+    return json.loads(output)
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def measure(uid, gid, sinks, duration, connects):
+    """Packets per second and connection setup latency (microseconds) for the user's traffic."""
+    udp = run_as(uid, gid, udp_flood, '127.0.0.1', sinks.udp.getsockname()[1], duration)
+    tcp = run_as(uid, gid, tcp_connects, '127.0.0.1', sinks.tcp.getsockname()[1], connects)
+    result = {'pps': int(udp['packets'] / udp['seconds']), 'send_failures': udp['failed'],
+              'connect_failures': tcp['failed'], 'connect_us': None}
+    if tcp['samples']:
+        result['connect_us'] = {name: round(_percentile(tcp['samples'], fraction) * 1e6, 1)
+                                for name, fraction in (('median', 0.5), ('p90', 0.9), ('p99', 0.99))}
+    return result
+
+def run_case(user, uid, gid, backend, size, sinks, duration, connects, verbose=False):
+    """Apply a synthetic ruleset of size addresses with a backend, measure, and remove it again."""
+    result = {'backend': backend, 'size': size}
+    if backend == 'legacy' and size > LEGACY_MAX_ENTRIES:
+        result['skipped'] = f"more than {LEGACY_MAX_ENTRIES} entries (one iptables call per rule)"
+        return result
+    cache_path = get_user_cache_path(user)
+    save_cache(synthetic_cache(size), cache_path)
+    save_user_state(user, mode='blacklist', backend=backend, inspector=False, sinkhole=False, log_drops=False)
+    try:
+        started = time.perf_counter()
+        with _quiet(verbose):
+            applied = apply_restrictions_from_cache(user, verbose=verbose, backend=backend)
+        result['apply_seconds'] = round(time.perf_counter() - started, 3)
+        if not applied:
+            result['skipped'] = 'apply failed'
+            return result
+        status = collect_status([(user, uid)])[0]
+        result['rules'] = sum(status['rules'].values())
+        result['set_entries'] = sum(status['sets'].values())
+        result.update(measure(uid, gid, sinks, duration, connects))
+    finally:
+        with _quiet(verbose):
+            unrestrict_internet(user, None, verbose=verbose)
+    return result
+
+def run_benchmark(backends, sizes, user=BENCH_USER, duration=DEFAULT_DURATION, connects=DEFAULT_CONNECTS,
+                  verbose=False, report=print):
+    """
+    Run every backend at every size in a private network namespace. Returns the report dict.
+    report(line) is called with a progress line after each case.
+    """
+    if load_user_state(user):
+        raise RuntimeError(f"user {user} has recorded restrictions; pick another --user for the benchmark")
+    uid, created = ensure_user(user)
+    gid = pwd.getpwnam(user).pw_gid
+    enter_namespace()
+    sinks = Sinks()
+    results = []
+    try:
+        baseline = dict(backend='none', size=0, **measure(uid, gid, sinks, duration, connects))
+        results.append(baseline)
+        report(format_result(baseline))
+        for backend in backends:
+            for size in sizes:
+                result = run_case(user, uid, gid, backend, size, sinks, duration, connects, verbose=verbose)
+                results.append(result)
+                report(format_result(result))
+    finally:
+        sinks.close()
+        remove_user_files(user)
+        if created:
+            subprocess.run(['userdel', user], check=False)
+    return {'started': int(time.time()), 'kernel': platform.release(), 'python': platform.python_version(),
+            'duration': duration, 'connects': connects, 'addresses_per_name': ADDRESSES_PER_NAME, 'results': results}
+
+def format_result(result):
+    label = f"{result['backend']:<8} {result['size']:>7}"
+    if 'skipped' in result:
+        return f"{label}  skipped: {result['skipped']}"
+    latency = result['connect_us']
+    connect = f"connect {latency['median']}/{latency['p99']} us (median/p99)" if latency else 'connect failed'
+    line = f"{label}  {result['pps']:>8} pps  {connect}"
+    if 'rules' not in result:
+        return line + "  (no rules)"
+    return line + f"  ({result['rules']} rules, {result['set_entries']} set entries, applied in {result['apply_seconds']}s)"
+
+def save_report(report, path=None):
+    """Write the report as JSON (default: cache/benchmark_<time>.json). Returns the path."""
+    path = path or get_cache_dir() / f"benchmark_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+def compare_reports(previous, current, tolerance=DEFAULT_TOLERANCE):
+    """
+    Return a line for every (backend, size) whose packet rate dropped, or whose median connect
+    latency or apply time grew, by more than tolerance compared with the previous report.
+    """
+    before = {(r['backend'], r['size']): r for r in previous.get('results', []) if 'skipped' not in r}
+    regressions = []
+    for result in current['results']:
+        old = before.get((result['backend'], result['size']))
+        if old is None or 'skipped' in result:
+            continue
+        label = f"{result['backend']} {result['size']}"
+        if result['pps'] < old['pps'] * (1 - tolerance):
+            regressions.append(f"{label}: {old['pps']} -> {result['pps']} pps")
+        if result['connect_us'] and old.get('connect_us') and \
+                result['connect_us']['median'] > old['connect_us']['median'] * (1 + tolerance):
+            regressions.append(f"{label}: connect median {old['connect_us']['median']} -> {result['connect_us']['median']} us")
+        # Applies faster than MIN_APPLY_SECONDS are too short to compare
+        if old.get('apply_seconds', 0) >= MIN_APPLY_SECONDS and result['apply_seconds'] > old['apply_seconds'] * (1 + tolerance):
+            regressions.append(f"{label}: apply {old['apply_seconds']} -> {result['apply_seconds']} s")
+    return regressions
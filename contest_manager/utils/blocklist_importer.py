@@ -0,0 +1,162 @@
+"""
+Streaming importer for third-party blocklists
+
+Supported formats (one entry per line):
+    hosts    "0.0.0.0 domain" / "127.0.0.1 domain [domain ...]"
+    adblock  "||domain^" (rules with paths, options or exceptions are rejected)
+    plain    "domain"
+
+Entries flow through a generator pipeline (parse -> normalise -> deduplicate) and are
+deduplicated with an external merge sort, so memory use is bounded by CHUNK_SIZE
+regardless of the size of the list.
+"""
+
+import re
+import os
+import heapq
+import tempfile
+import ipaddress
+from pathlib import Path
+
+CHUNK_SIZE = 100000
+FORMATS = ('auto', 'hosts', 'adblock', 'plain')
+HOSTS_ADDRESSES = {'0.0.0.0', '127.0.0.1', '::', '::1', '::0'}
+IGNORED_HOSTS = {'localhost', 'localhost.localdomain', 'local', 'broadcasthost',
+                 'ip6-localhost', 'ip6-loopback', '0.0.0.0'}
+LABEL_RE = re.compile(r'^(?!-)[a-z0-9_-]{1,63}(?<!-)$')
+ADBLOCK_RE = re.compile(r'^\|\|([^/^$*|]+)\^$')
+
+def normalize_domain(value):
+    """Return the normalised (lowercase, ASCII) form of a domain name, or None if it is not one."""
+    value = value.strip().lower().rstrip('.')
+    if not value or value in IGNORED_HOSTS or len(value) > 253:
+        return None
+    try:
+        ipaddress.ip_address(value)
+        return None
+    except ValueError:
+        pass
+    try:
+        value = value.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+    labels = value.split('.')
+    if len(labels) < 2 or not all(LABEL_RE.match(label) for label in labels):
+        return None
+    return value
+
+def detect_format(line):
+    """Guess the format of a single (non-comment) line."""
+    if line.startswith('||'):
+        return 'adblock'
+    first = line.split(None, 1)[0]
+    if first in HOSTS_ADDRESSES or _is_ip(first):
+        return 'hosts'
+    return 'plain'
+
+def _is_ip(value):
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+def _is_comment(line):
+    return not line or line.startswith(('#', '!', '[', ';'))
+
+def parse_lines(lines, fmt='auto'):
+    """
+    Yield (domain, None) for every accepted entry and (None, line) for every rejected one.
+    Comments and blank lines are skipped silently.
+    """
+    for raw in lines:
+        line = raw.strip()
+        if not line.startswith('||'):
+            line = line.split('#', 1)[0].strip()
+        if _is_comment(line):
+            continue
+        line_fmt = detect_format(line) if fmt == 'auto' else fmt
+        if line_fmt == 'hosts':
+            parts = line.split()
+            if len(parts) < 2 or not _is_ip(parts[0]):
+                yield None, raw
+                continue
+            candidates = parts[1:]
+        elif line_fmt == 'adblock':
+            match = ADBLOCK_RE.match(line)
+            if not match:
+                yield None, raw
+                continue
+            candidates = [match.group(1)]
+        else:
+            candidates = line.split()[:1]
+        for candidate in candidates:
+            if candidate.lower() in IGNORED_HOSTS:
+                continue
+            domain = normalize_domain(candidate)
+            yield (domain, None) if domain else (None, raw)
+
+def _write_chunk(chunk, tmp_dir):
+    fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.chunk')
+    with os.fdopen(fd, 'w') as f:
+        for domain in sorted(set(chunk)):
+            f.write(domain + '\n')
+    return path
+
+def _read_chunk(path):
+    with open(path) as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+def sorted_unique(domains, chunk_size=CHUNK_SIZE):
+    """
+    Yield the given domains sorted and deduplicated, holding at most chunk_size entries
+    in memory at a time.
+    """
+    with tempfile.TemporaryDirectory(prefix='contest-import-') as tmp_dir:
+        chunk_paths = []
+        chunk = []
+        for domain in domains:
+            chunk.append(domain)
+            if len(chunk) >= chunk_size:
+                chunk_paths.append(_write_chunk(chunk, tmp_dir))
+                chunk = []
+        chunk_paths.append(_write_chunk(chunk, tmp_dir))
+        previous = None
+        for domain in heapq.merge(*(_read_chunk(p) for p in chunk_paths)):
+            if domain == previous:
+                continue
+            previous = domain
+            yield domain
+
+def import_blocklist(source_path, dest_path, existing=(), fmt='auto', chunk_size=CHUNK_SIZE):
+    """
+    Stream a blocklist into dest_path as a sorted, deduplicated one-domain-per-line file.
+    Domains already in `existing` are skipped as duplicates.
+    Returns counters for imported, duplicate and rejected lines.
+    """
+    stats = {'imported': 0, 'duplicate': 0, 'rejected': 0, 'accepted': 0}
+    existing = set(existing)
+
+    def accepted():
+        with open(source_path, encoding='utf-8', errors='replace') as f:
+            for domain, _ in parse_lines(f, fmt):
+                if domain is None:
+                    stats['rejected'] += 1
+                    continue
+                stats['accepted'] += 1
+                yield domain
+
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest_path.with_name(dest_path.name + '.tmp')
+    with open(tmp_path, 'w') as out:
+        out.write(f"# Imported from {Path(source_path).name} by contest-manager import-blocklist\n")
+        for domain in sorted_unique(accepted(), chunk_size):
+            if domain in existing:
+                continue
+            out.write(domain + '\n')
+            stats['imported'] += 1
+    os.replace(tmp_path, dest_path)
+    stats['duplicate'] = stats.pop('accepted') - stats['imported']
+    return stats
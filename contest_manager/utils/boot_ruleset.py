@@ -0,0 +1,89 @@
+"""
+Precompiled boot ruleset for contest-manager
+
+restrict and update-restriction save the scripts that recreate a user's ruleset, in the
+formats their tools read, next to a checksum file in sha256sum format:
+
+    cache/boot/<user>.ipv4.rules    iptables-restore script for the user's chain
+    cache/boot/<user>.ipv6.rules    ip6tables-restore script
+    cache/boot/<user>.ipset         ipset restore script (ipset backend)
+    cache/boot/<user>.nft           nft -f script (nft backend)
+    cache/boot/<user>.sha256        checksums of the files above ('sha256sum -c' checks them by hand)
+
+start-restriction loads them with one call per tool instead of compiling the cache again,
+and only falls back to compiling when a file is missing or its checksum does not match.
+"""
+
+import hashlib
+from pathlib import Path
+from contest_manager.utils.utils import file_lock, atomic_write
+
+SUFFIXES = {'ipv4': 'ipv4.rules', 'ipv6': 'ipv6.rules', 'ipset': 'ipset', 'nft': 'nft'}
+
+def checksum_path(boot_dir, user):
+    return Path(boot_dir) / f"{user}.sha256"
+
+def script_path(boot_dir, user, key):
+    return Path(boot_dir) / f"{user}.{SUFFIXES[key]}"
+
+def _write(path, text):
+    """Write a file atomically (unique temporary file, fsync, rename)."""
+    with atomic_write(path) as f:
+        f.write(text)
+
+def artifact_lock(boot_dir, user):
+    """Exclusive lock on a user's boot scripts, so concurrent saves never mix their files."""
+    return file_lock(Path(boot_dir) / f"{user}.lock")
+
+def apply_lock(boot_dir, user):
+    """
+    Exclusive lock held while a user's rules are applied and their boot scripts saved. The
+    tamper watcher takes it before checking, so it never compares against a half-made change.
+    """
+    Path(boot_dir).mkdir(parents=True, exist_ok=True)
+    return file_lock(Path(boot_dir) / f"{user}.apply.lock")
+
+def save_artifact(boot_dir, user, scripts):
+    """
+    Save the user's boot scripts ({key: script}) and their checksums. The checksum file is
+    written last, so an interrupted save never leaves scripts that pass the check. Scripts of
+    other keys left by an earlier backend are removed.
+    """
+    Path(boot_dir).mkdir(parents=True, exist_ok=True)
+    with artifact_lock(boot_dir, user):
+        lines = []
+        for key, script in sorted(scripts.items()):
+            path = script_path(boot_dir, user, key)
+            _write(path, script)
+            lines.append(f"{hashlib.sha256(script.encode()).hexdigest()}  {path.name}")
+        for key in SUFFIXES:
+            if key not in scripts and script_path(boot_dir, user, key).exists():
+                script_path(boot_dir, user, key).unlink()
+        _write(checksum_path(boot_dir, user), '\n'.join(lines) + '\n')
+
+def load_artifact(boot_dir, user):
+    """Return the user's boot scripts ({key: script}) if every checksum matches, or None."""
+    names = {f"{user}.{suffix}": key for key, suffix in SUFFIXES.items()}
+    try:
+        with open(checksum_path(boot_dir, user)) as f:
+            entries = [line.split() for line in f if line.strip()]
+    except OSError:
+        return None
+    scripts = {}
+    for entry in entries:
+        if len(entry) != 2 or entry[1] not in names:
+            return None
+        try:
+            script = (Path(boot_dir) / entry[1]).read_text()
+        except OSError:
+            return None
+        if hashlib.sha256(script.encode()).hexdigest() != entry[0]:
+            return None
+        scripts[names[entry[1]]] = script
+    return scripts or None
+
+def remove_artifact(boot_dir, user):
+    """Delete the user's boot scripts and checksums."""
+    for path in [checksum_path(boot_dir, user)] + [script_path(boot_dir, user, key) for key in SUFFIXES]:
+        if path.exists():
+            path.unlink()
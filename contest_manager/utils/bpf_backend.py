@@ -0,0 +1,233 @@
+"""
+eBPF cgroup egress backend for contest-manager
+
+A cgroup_skb/egress program (contest_manager/bpf/contest_egress.bpf.c) is attached to the
+user's systemd slice, /sys/fs/cgroup/user.slice/user-<uid>.slice, and drops packets whose
+destination is in one of its LPM-trie maps. Lookups cost O(prefix length) whatever the number
+of blocked prefixes, and updates are plain map writes sent through one 'bpftool batch' call,
+so no ruleset is ever reloaded.
+
+Objects are pinned under /sys/fs/bpf/contest/<uid>/: prog, blocked_v4, blocked_v6 and stats.
+Requires clang (to compile the program once), bpftool, libbpf headers and cgroup v2.
+"""
+
+import os
+import sys
+import pwd
+import json
+import shutil
+import hashlib
+import tempfile
+import ipaddress
+import subprocess
+from pathlib import Path
+
+BPF_SOURCE = Path(__file__).parent.parent / 'bpf' / 'contest_egress.bpf.c'
+PIN_ROOT = Path('/sys/fs/bpf/contest')
+CGROUP_ROOT = Path('/sys/fs/cgroup/user.slice')
+BUILD_DIR = Path(__file__).parent.parent.parent / 'cache'
+LINGER_DIR = Path('/var/lib/systemd/linger')
+MAPS = {4: 'blocked_v4', 6: 'blocked_v6'}
+STATS = ('packets', 'dropped')
+
+def bpf_available():
+    """Return True if the tools needed to build and load the program are installed."""
+    return all(shutil.which(tool) for tool in ('clang', 'bpftool'))
+
+def pin_dir(uid):
+    return PIN_ROOT / str(uid)
+
+def cgroup_path(uid):
+    return CGROUP_ROOT / f"user-{uid}.slice"
+
+def _bpftool(args, verbose=False, **kwargs):
+    result = subprocess.run(['bpftool'] + args, capture_output=True, text=True, **kwargs)
+    if result.returncode != 0 and verbose:
+        print(f"[bpftool] {' '.join(args[:3])}: {result.stderr.strip()}")
+    return result
+
+def compile_program(build_dir=BUILD_DIR):
+    """Compile the program into build_dir, keyed by the source hash. Returns the object path or None."""
+    Path(build_dir).mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256(BPF_SOURCE.read_bytes()).hexdigest()[:16]
+    obj_path = Path(build_dir) / f"contest_egress_{digest}.bpf.o"
+    if obj_path.exists():
+        return obj_path
+    result = subprocess.run(['clang', '-O2', '-g', '-target', 'bpf', '-c', str(BPF_SOURCE), '-o', str(obj_path)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ Compiling {BPF_SOURCE.name} failed: {result.stderr.strip()}")
+        return None
+    return obj_path
+
+def linger_marker(uid, build_dir=BUILD_DIR):
+    """File recording that lingering was enabled for the user by this backend (and not before)."""
+    return Path(build_dir) / f"bpf_linger_{uid}"
+
+def ensure_slice(uid):
+    """
+    Make sure the user's slice exists and outlives their sessions: lingering keeps
+    user@<uid>.service, and with it user-<uid>.slice, running from boot. Lingering is only
+    enabled if it was off, and that is recorded so remove_bpf can turn it off again.
+    """
+    user = pwd.getpwuid(uid).pw_name
+    if not (LINGER_DIR / user).exists():
+        result = subprocess.run(['loginctl', 'enable-linger', user], capture_output=True)
+        if result.returncode == 0:
+            linger_marker(uid).touch()
+    if not cgroup_path(uid).exists():
+        subprocess.run(['systemctl', 'start', f"user-{uid}.slice"], capture_output=True)
+    return cgroup_path(uid).exists()
+
+def load_and_attach(uid, build_dir=BUILD_DIR, verbose=False):
+    """Load and pin the program and its maps for the user (once) and attach it to the user's slice."""
+    pins = pin_dir(uid)
+    if not (pins / 'prog').exists():
+        obj_path = compile_program(build_dir)
+        if obj_path is None:
+            return False
+        pins.mkdir(parents=True, exist_ok=True)
+        result = _bpftool(['prog', 'load', str(obj_path), str(pins / 'prog'), 'type', 'cgroup/skb',
+                           'pinmaps', str(pins)], verbose=True)
+        if result.returncode != 0:
+            print(f"❌ Loading the eBPF program for UID {uid} failed.")
+            return False
+    if not ensure_slice(uid):
+        print(f"❌ Slice {cgroup_path(uid).name} not found; is cgroup v2 in use?")
+        return False
+    if not attached(uid):
+        result = _bpftool(['cgroup', 'attach', str(cgroup_path(uid)), 'egress', 'pinned', str(pins / 'prog'), 'multi'],
+                          verbose=True)
+        if result.returncode != 0:
+            print(f"❌ Attaching the eBPF program to {cgroup_path(uid).name} failed.")
+            return False
+    if verbose:
+        print(f"[bpf] program pinned at {pins} and attached to {cgroup_path(uid)}")
+    return True
+
+def attached(uid):
+    """Return True if the user's pinned program is attached to their slice."""
+    if not cgroup_path(uid).exists():
+        return False
+    shown = _bpftool(['-j', 'cgroup', 'show', str(cgroup_path(uid))])
+    if shown.returncode != 0:
+        return False
+    info = _bpftool(['-j', 'prog', 'show', 'pinned', str(pin_dir(uid) / 'prog')])
+    if info.returncode != 0:
+        return False
+    # Matched by program id: the attach type is spelled differently across bpftool versions,
+    # and the pinned program is only ever attached for egress
+    prog_id = json.loads(info.stdout).get('id')
+    return prog_id is not None and any(entry.get('id') == prog_id for entry in json.loads(shown.stdout or '[]'))
+
+def encode_key(network):
+    """LPM trie key: prefix length (host byte order) followed by the address bytes."""
+    return network.prefixlen.to_bytes(4, sys.byteorder) + network.network_address.packed
+
+def decode_key(key_bytes):
+    prefixlen = int.from_bytes(key_bytes[:4], sys.byteorder)
+    address = ipaddress.ip_address(bytes(key_bytes[4:]))
+    return ipaddress.ip_network(f"{address}/{prefixlen}")
+
+def _hex(data):
+    return ' '.join(f"{b:02x}" for b in data)
+
+def _dump(path):
+    """Return the raw (key bytes, value bytes) entries of a pinned map."""
+    result = _bpftool(['-j', 'map', 'dump', 'pinned', str(path)])
+    if result.returncode != 0:
+        return None
+    entries = []
+    for entry in json.loads(result.stdout or '[]'):
+        key, value = entry.get('key'), entry.get('value')
+        if isinstance(key, list) and isinstance(value, list):
+            entries.append((bytes(int(b, 16) for b in key), bytes(int(b, 16) for b in value)))
+    return entries
+
+def map_prefixes(uid):
+    """Return {4: set of networks, 6: set of networks} held in the user's maps, or None if not loaded."""
+    prefixes = {}
+    for version, name in MAPS.items():
+        entries = _dump(pin_dir(uid) / name)
+        if entries is None:
+            return None
+        prefixes[version] = {decode_key(key) for key, _ in entries}
+    return prefixes
+
+def map_stats(uid):
+    """Return {'packets', 'dropped', 'blocked_v4', 'blocked_v6'} counters, or None if not loaded."""
+    counters = map_prefixes(uid)
+    entries = _dump(pin_dir(uid) / 'stats')
+    if counters is None or entries is None:
+        return None
+    stats = {MAPS[version]: len(networks) for version, networks in counters.items()}
+    for key, value in entries:
+        index = int.from_bytes(key, sys.byteorder)
+        if index < len(STATS):
+            stats[STATS[index]] = int.from_bytes(value, sys.byteorder)
+    return stats
+
+def update_maps(uid, sets, prune=True, verbose=False):
+    """
+    Write the difference between the maps and the wanted prefixes with one 'bpftool batch' call.
+    sets is {family: [addresses or networks]}. Returns {'added', 'removed', 'total'} or None on failure.
+    """
+    live = map_prefixes(uid)
+    if live is None:
+        return None
+    wanted = {4: set(), 6: set()}
+    for members in sets.values():
+        for member in members:
+            network = ipaddress.ip_network(member, strict=False)
+            wanted[network.version].add(network)
+    commands = []
+    stats = {'added': 0, 'removed': 0, 'total': sum(len(w) for w in wanted.values())}
+    for version, name in MAPS.items():
+        path = pin_dir(uid) / name
+        for network in sorted(wanted[version] - live[version]):
+            commands.append(f"map update pinned {path} key hex {_hex(encode_key(network))} value hex 01")
+            stats['added'] += 1
+        if prune:
+            for network in sorted(live[version] - wanted[version]):
+                commands.append(f"map delete pinned {path} key hex {_hex(encode_key(network))}")
+                stats['removed'] += 1
+    if commands:
+        with tempfile.NamedTemporaryFile('w', suffix='.batch', delete=False) as f:
+            f.write('\n'.join(commands) + '\n')
+        try:
+            result = _bpftool(['batch', 'file', f.name], verbose=True)
+        finally:
+            os.unlink(f.name)
+        if result.returncode != 0:
+            print(f"❌ Updating the eBPF maps for UID {uid} failed.")
+            return None
+    if verbose:
+        print(f"[bpf] {stats['added']} prefixes added, {stats['removed']} removed")
+    return stats
+
+def restore_linger(uid, verbose=False):
+    """Turn lingering off again if ensure_slice turned it on."""
+    marker = linger_marker(uid)
+    if not marker.exists():
+        return
+    try:
+        subprocess.run(['loginctl', 'disable-linger', pwd.getpwuid(uid).pw_name], capture_output=True)
+    except KeyError:
+        pass
+    marker.unlink()
+    if verbose:
+        print(f"[bpf] lingering disabled again for UID {uid}")
+
+def remove_bpf(uid, verbose=False):
+    """Detach the user's program, unpin it with its maps and undo the lingering it enabled."""
+    restore_linger(uid, verbose=verbose)
+    pins = pin_dir(uid)
+    if not pins.exists():
+        return
+    if shutil.which('bpftool') and cgroup_path(uid).exists():
+        _bpftool(['cgroup', 'detach', str(cgroup_path(uid)), 'egress', 'pinned', str(pins / 'prog')], verbose=verbose)
+    for path in pins.iterdir():
+        path.unlink()
+    pins.rmdir()
+    if verbose:
+        print(f"[bpf] program and maps for UID {uid} removed")
@@ -0,0 +1,130 @@
+"""
+Concurrent DNS resolution utilities for contest-manager
+"""
+
+import time
+import dns.resolver
+import dns.rdatatype
+import dns.exception
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_WORKERS = 64
+DEFAULT_TIMEOUT = 2.0
+PROGRESS_STEP = 10
+
+def parse_nameserver(value):
+    """Split a nameserver given as 'ip', 'ip:port' or '[ipv6]:port' into (ip, port)."""
+    value = value.strip()
+    if value.startswith('['):
+        host, _, rest = value[1:].partition(']')
+        port = rest.lstrip(':')
+        return host, int(port) if port else 53
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, 53
+
+def build_resolver(nameservers=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Build a dnspython resolver with a per-query timeout and an optional nameserver list.
+    Nameservers may carry a port (e.g. 127.0.0.1:5353) to target a local stub server.
+    """
+    resolver = dns.resolver.Resolver()
+    if nameservers:
+        resolver.nameservers = []
+        resolver.nameserver_ports = {}
+        for ns in nameservers:
+            host, port = parse_nameserver(ns)
+            resolver.nameservers.append(host)
+            resolver.nameserver_ports[host] = port
+    resolver.timeout = timeout
+    resolver.lifetime = timeout
+    return resolver
+
+def negative_ttl(responses):
+    """
+    Return the negative caching TTL (RFC 2308) from the SOA record in the authority
+    section of NXDOMAIN/NODATA responses: the smaller of the SOA TTL and its MINIMUM field.
+    """
+    ttls = []
+    for response in responses:
+        for rrset in getattr(response, 'authority', []):
+            if rrset.rdtype == dns.rdatatype.SOA and len(rrset):
+                ttls.append(min(rrset.ttl, rrset[0].minimum))
+    return min(ttls) if ttls else None
+
+def resolve_record(name, resolver=None):
+    """
+    Resolve A and AAAA records for a single name.
+    Returns a dict with the addresses, the smallest answer TTL and a status of
+    'ok', 'nxdomain', 'nodata', 'timeout' or 'error'. For 'nxdomain' and 'nodata'
+    the TTL is the SOA-derived negative TTL when the server provided one.
+    """
+    resolver = resolver or build_resolver()
+    record = {'ips': [], 'ttl': None, 'status': 'nodata'}
+    negative = []
+    for rdtype in ('A', 'AAAA'):
+        try:
+            answers = resolver.resolve(name, rdtype)
+        except dns.resolver.NXDOMAIN as e:
+            # The name does not exist, so there is no point asking for AAAA
+            record['status'] = 'nxdomain'
+            record['ttl'] = negative_ttl(e.kwargs.get('responses', {}).values())
+            return record
+        except dns.resolver.NoAnswer as e:
+            response = e.kwargs.get('response')
+            if response is not None:
+                negative.append(response)
+            continue
+        except dns.exception.Timeout:
+            record['status'] = 'timeout'
+            continue
+        except Exception:
+            record['status'] = 'error'
+            continue
+        for rdata in answers:
+            record['ips'].append(str(rdata))
+        ttl = answers.rrset.ttl
+        record['ttl'] = ttl if record['ttl'] is None else min(record['ttl'], ttl)
+    if record['ips']:
+        record['status'] = 'ok'
+    elif record['status'] == 'nodata':
+        record['ttl'] = negative_ttl(negative)
+    return record
+
+def resolve_many(names, resolver=None, workers=DEFAULT_WORKERS, verbose=False, report=True):
+    """
+    Resolve many names concurrently on a bounded thread pool.
+    Returns (results, stats) where results maps each name to its record
+    (see resolve_record) and stats holds per-status counts and the elapsed time.
+    The summary line is printed unless report is False.
+    """
+    names = list(dict.fromkeys(names))
+    resolver = resolver or build_resolver()
+    results = {}
+    stats = {'total': len(names), 'ok': 0, 'nxdomain': 0, 'nodata': 0, 'timeout': 0, 'error': 0}
+    if not names:
+        stats['elapsed'] = 0.0
+        return results, stats
+    started = time.monotonic()
+    next_report = PROGRESS_STEP
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(names)))) as pool:
+        futures = {pool.submit(resolve_record, name, resolver): name for name in names}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                record = future.result()
+            except Exception:
+                record = {'ips': [], 'ttl': None, 'status': 'error'}
+            results[name] = record
+            stats[record['status']] += 1
+            percent = done * 100 // len(names)
+            if verbose and percent >= next_report:
+                print(f"[resolve] {done}/{len(names)} names ({percent}%)")
+                next_report = (percent // PROGRESS_STEP + 1) * PROGRESS_STEP
+    stats['elapsed'] = time.monotonic() - started
+    failed = stats['timeout'] + stats['error']
+    if report:
+        print(f"🔍 Resolved {stats['total']} names in {stats['elapsed']:.2f}s "
+              f"({stats['ok']} ok, {stats['nxdomain'] + stats['nodata']} without address, {failed} failed)")
+    return results, stats
@@ -0,0 +1,314 @@
+"""
+Local filtering DNS resolver (sinkhole) for contest-manager
+
+A small asyncio forwarder listening on UDP and TCP. A restricted user's port-53 traffic is
+redirected to it by a nat OUTPUT rule matching their UID (see firewall.apply_dns_redirect),
+whatever resolver they point at. Names covered by the suffix-trie domain policy, and answers
+that alias to such names through a CNAME, get NXDOMAIN; everything else is forwarded upstream
+and cached in memory until the smallest TTL of the answer runs out.
+
+Each user gets their own port (sinkhole_port), so one daemon per restricted user can run
+next to the system resolver without sharing state. The domain policy is checked for changed
+lists in an executor, so recompiling large lists never holds up the answers.
+"""
+
+import time
+import socket
+import struct
+import asyncio
+from collections import OrderedDict
+import dns.flags
+import dns.rcode
+import dns.message
+import dns.rdatatype
+import dns.asyncquery
+from contest_manager.utils.domain_policy import check
+
+SINKHOLE_BASE_PORT = 20000
+LISTEN_ADDRESSES = ('127.0.0.1', '::1')
+DEFAULT_UPSTREAM_PORT = 53
+DEFAULT_TIMEOUT = 3.0
+CACHE_SIZE = 10000
+MAX_CACHE_TTL = 3600
+POLICY_CHECK_INTERVAL = 5
+RESOLV_CONF = '/etc/resolv.conf'
+
+def sinkhole_port(uid):
+    """Port a user's DNS traffic is redirected to. UIDs 10000 apart share one (see port_conflicts)."""
+    return SINKHOLE_BASE_PORT + uid % 10000
+
+def port_conflicts(uids):
+    """Return {port: sorted UIDs} for the sinkhole ports more than one of the UIDs would share."""
+    ports = {}
+    for uid in set(uids):
+        ports.setdefault(sinkhole_port(uid), []).append(uid)
+    return {port: sorted(owners) for port, owners in ports.items() if len(owners) > 1}
+
+def parse_upstream(value, default_port=DEFAULT_UPSTREAM_PORT):
+    """Split 'IP', 'IP:PORT', '[IPv6]:PORT' or a bare IPv6 address into (host, port)."""
+    if value.startswith('['):
+        host, _, port = value[1:].partition(']')
+        return host, int(port.lstrip(':') or default_port)
+    if value.count(':') == 1:
+        host, port = value.split(':')
+        return host, int(port)
+    return value, default_port
+
+def system_upstream(resolv_conf=RESOLV_CONF):
+    """First nameserver of resolv.conf as (host, port), defaulting to the local stub resolver."""
+    try:
+        with open(resolv_conf) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    return parts[1].split('%')[0], DEFAULT_UPSTREAM_PORT
+    except OSError:
+        pass
+    return '127.0.0.53', DEFAULT_UPSTREAM_PORT
+
+class AnswerCache:
+    """Bounded in-memory cache of upstream responses, evicted on TTL expiry or least recent use."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, now):
+        """Return (response wire, seconds left) for a live entry, or None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, wire = entry
+        if expires <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return wire, int(expires - now)
+
+    def put(self, key, wire, ttl, now):
+        if ttl <= 0:
+            return
+        self.entries[key] = (now + ttl, wire)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+def response_ttl(response):
+    """
+    How long a response may be cached: the smallest TTL of its answer records, or for
+    NXDOMAIN/NODATA the negative TTL of the SOA in the authority section (RFC 2308).
+    Other failures are not cached.
+    """
+    rcode = response.rcode()
+    if rcode not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+        return 0
+    if response.answer:
+        ttl = min(rrset.ttl for rrset in response.answer)
+    else:
+        soa = [min(rrset.ttl, rrset[0].minimum) for rrset in response.authority
+               if rrset.rdtype == dns.rdatatype.SOA and len(rrset)]
+        ttl = min(soa) if soa else 0
+    return min(ttl, MAX_CACHE_TTL)
+
+def with_ttl(wire, query_id, remaining):
+    """Rewrite a cached response for a new query: its ID, and TTLs capped at the time left."""
+    response = dns.message.from_wire(wire)
+    response.id = query_id
+    for section in (response.answer, response.authority):
+        for rrset in section:
+            rrset.ttl = min(rrset.ttl, remaining)
+    return response.to_wire()
+
+def _name(name):
+    return name.to_text(omit_final_dot=True).lower()
+
+def blocked_name(policy, query, response=None):
+    """Return the first blocked name in the question or the answer's CNAME chain, or None."""
+    names = [_name(question.name) for question in query.question]
+    if response is not None:
+        for rrset in response.answer:
+            names.append(_name(rrset.name))
+            if rrset.rdtype == dns.rdatatype.CNAME:
+                names.extend(_name(rdata.target) for rdata in rrset)
+    for name in names:
+        if check(policy, name)[0]:
+            return name
+    return None
+
+def nxdomain(query):
+    response = dns.message.make_response(query)
+    response.set_rcode(dns.rcode.NXDOMAIN)
+    response.flags |= dns.flags.RA
+    return response.to_wire()
+
+def servfail(query):
+    response = dns.message.make_response(query)
+    response.set_rcode(dns.rcode.SERVFAIL)
+    return response.to_wire()
+
+class Sinkhole:
+    """
+    Answers DNS queries: NXDOMAIN for blacklisted names, cached or forwarded answers otherwise.
+    policy_source is a domain_policy.PolicySource.
+    """
+
+    def __init__(self, policy_source, upstream, timeout=DEFAULT_TIMEOUT, cache_size=CACHE_SIZE, verbose=False):
+        self.policy_source = policy_source
+        self.upstream = upstream
+        self.timeout = timeout
+        self.cache = AnswerCache(cache_size)
+        self.verbose = verbose
+        self.stats = {'queries': 0, 'blocked': 0, 'cached': 0, 'forwarded': 0, 'failed': 0}
+
+    async def watch_policy(self, interval=POLICY_CHECK_INTERVAL):
+        """Rebuild the policy in an executor whenever its lists change; a failed rebuild keeps the old one."""
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await loop.run_in_executor(None, self.policy_source.refresh) and self.verbose:
+                    print(f"[sinkhole] policy reloaded ({self.policy_source.policy['entries']} entries)")
+            except Exception as e:
+                print(f"⚠️  Could not reload the domain policy: {e}")
+
+    async def forward(self, query):
+        host, port = self.upstream
+        response = await dns.asyncquery.udp(query, host, timeout=self.timeout, port=port)
+        if response.flags & dns.flags.TC:
+            response = await dns.asyncquery.tcp(query, host, timeout=self.timeout, port=port)
+        return response
+
+    async def answer(self, wire):
+        """Return the response wire for a query wire, or None if it cannot be parsed."""
+        try:
+            query = dns.message.from_wire(wire)
+        except Exception:
+            return None
+        if not query.question:
+            return servfail(query)
+        now = time.monotonic()
+        policy = self.policy_source.policy
+        self.stats['queries'] += 1
+        blocked = blocked_name(policy, query)
+        if blocked:
+            return self._block(query, blocked)
+        question = query.question[0]
+        key = (_name(question.name), question.rdtype, question.rdclass)
+        cached = self.cache.get(key, now)
+        if cached is not None:
+            self.stats['cached'] += 1
+            return with_ttl(cached[0], query.id, cached[1])
+        try:
+            response = await self.forward(query)
+        except Exception as e:
+            self.stats['failed'] += 1
+            if self.verbose:
+                print(f"[sinkhole] {key[0]}: upstream failed ({e.__class__.__name__})")
+            return servfail(query)
+        self.stats['forwarded'] += 1
+        blocked = blocked_name(policy, query, response)
+        if blocked:
+            return self._block(query, blocked)
+        wire = response.to_wire()
+        self.cache.put(key, wire, response_ttl(response), now)
+        return wire
+
+    def _block(self, query, name):
+        self.stats['blocked'] += 1
+        if self.verbose:
+            print(f"[sinkhole] {_name(query.question[0].name)}: NXDOMAIN ({name} is blacklisted)")
+        return nxdomain(query)
+
+class _UDPServer(asyncio.DatagramProtocol):
+    def __init__(self, sinkhole):
+        self.sinkhole = sinkhole
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.ensure_future(self._reply(data, addr))
+
+    async def _reply(self, data, addr):
+        wire = await self.sinkhole.answer(data)
+        if wire is not None:
+            self.transport.sendto(wire, addr)
+
+def _tcp_handler(sinkhole):
+    async def handle(reader, writer):
+        try:
+            while True:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+                wire = await sinkhole.answer(await reader.readexactly(length))
+                if wire is None:
+                    break
+                writer.write(struct.pack('!H', len(wire)) + wire)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+async def start_servers(sinkhole, port, addresses=LISTEN_ADDRESSES):
+    """Listen on UDP and TCP on every address that can be bound. Returns the servers/transports."""
+    loop = asyncio.get_event_loop()
+    servers = []
+    for address in addresses:
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        try:
+            transport, _ = await loop.create_datagram_endpoint(lambda: _UDPServer(sinkhole),
+                                                               local_addr=(address, port), family=family)
+            servers.append(transport)
+            servers.append(await asyncio.start_server(_tcp_handler(sinkhole), address, port, family=family))
+        except OSError as e:
+            print(f"⚠️  Cannot listen on {address} port {port}: {e.strerror}")
+    return servers
+
+async def serve(sinkhole, port, addresses=LISTEN_ADDRESSES, stop=None):
+    """
+    Serve DNS on the given port until stop (an asyncio.Event) is set, or forever without one.
+    Returns False if no address could be bound.
+    """
+    servers = await start_servers(sinkhole, port, addresses)
+    if not servers:
+        print(f"❌ The DNS sinkhole could not listen on port {port}.")
+        return False
+    upstream = sinkhole.upstream
+    print(f"🕳️  DNS sinkhole on port {port}, forwarding to {upstream[0]}:{upstream[1]} (Ctrl+C to stop)", flush=True)
+    watcher = asyncio.ensure_future(sinkhole.watch_policy())
+    try:
+        await (stop.wait() if stop is not None else asyncio.Event().wait())
+    finally:
+        watcher.cancel()
+        for server in servers:
+            server.close()
+    return True
+
+def _run(coroutine):
+    """asyncio.run, with a private event loop on Python 3.6 where it does not exist."""
+    if hasattr(asyncio, 'run'):
+        return asyncio.run(coroutine)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def run_sinkhole(port, policy_source, upstream, addresses=LISTEN_ADDRESSES, timeout=DEFAULT_TIMEOUT, verbose=False):
+    """
+    Serve DNS on the given port until interrupted. policy_source (a domain_policy.PolicySource)
+    is checked every POLICY_CHECK_INTERVAL seconds so blacklist edits take effect.
+    Returns False if no address could be bound.
+    """
+    sinkhole = Sinkhole(policy_source, upstream, timeout=timeout, verbose=verbose)
+    try:
+        if not _run(serve(sinkhole, port, addresses)):
+            return False
+    except KeyboardInterrupt:
+        pass
+    stats = sinkhole.stats
+    print(f"Answered {stats['queries']} queries: {stats['blocked']} blocked, {stats['cached']} from cache, "
+          f"{stats['forwarded']} forwarded, {stats['failed']} failed.")
+    return True
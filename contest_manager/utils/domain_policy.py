@@ -0,0 +1,144 @@
+"""
+Suffix-trie domain policy for contest-manager
+
+Blacklist entries are compiled into a trie keyed by reversed labels
+(www.example.com -> com, example, www), so deciding whether a hostname is
+covered takes one step per label, whatever the size of the list.
+
+Entry syntax (one per line):
+    example.com             block example.com and all of its subdomains
+    *.example.com           block the subdomains of example.com only
+    !allowed.example.com    exception: never block allowed.example.com or its subdomains
+    example.com @ai @chat   trailing @tags add categories to an entry
+
+Section headers such as "# --- Search Engines ---" set the category of the entries below them.
+When several entries match, the most specific one wins; at equal depth an exception beats a block.
+"""
+
+import re
+import json
+from contest_manager.utils.utils import atomic_write
+
+BLOCK = 'block'
+WILDCARD = 'wildcard'
+ALLOW = 'allow'
+POLICY_VERSION = 1
+SECTION_RE = re.compile(r'^#\s*-{2,}\s*(.+?)\s*-*\s*$')
+
+def parse_blacklist_line(line, section=None):
+    """
+    Parse one blacklist line. Returns (kind, domain, tags) or None for blank lines and comments.
+    kind is BLOCK, WILDCARD or ALLOW; domain has the '*.' or '!' marker removed.
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    parts = line.split()
+    pattern = parts[0].lower().rstrip('.')
+    tags = [p[1:] for p in parts[1:] if p.startswith('@') and len(p) > 1]
+    if section:
+        tags.insert(0, section)
+    if pattern.startswith('!'):
+        return ALLOW, pattern[1:], tags
+    if pattern.startswith('*.'):
+        return WILDCARD, pattern[2:], tags
+    return BLOCK, pattern, tags
+
+def iter_blacklist(lines):
+    """Yield (kind, domain, tags) for every entry, tracking section headers as categories."""
+    section = None
+    for line in lines:
+        match = SECTION_RE.match(line.strip())
+        if match:
+            section = match.group(1)
+            continue
+        parsed = parse_blacklist_line(line, section)
+        if parsed:
+            yield parsed
+
+def new_policy():
+    return {'version': POLICY_VERSION, 'entries': 0, 'root': {}}
+
+def add_rule(policy, kind, domain, tags=()):
+    """Insert a rule into the trie. Each node maps labels to children under 'c'; rules sit under their kind."""
+    node = policy['root']
+    for label in reversed(domain.split('.')):
+        node = node.setdefault('c', {}).setdefault(label, {})
+    rule = node.setdefault(kind, {'tags': []})
+    for tag in tags:
+        if tag not in rule['tags']:
+            rule['tags'].append(tag)
+    policy['entries'] += 1
+
+def compile_policy(entries):
+    """Compile (kind, domain, tags) tuples into a policy trie."""
+    policy = new_policy()
+    for kind, domain, tags in entries:
+        add_rule(policy, kind, domain, tags)
+    return policy
+
+def check(policy, hostname):
+    """
+    Decide whether a hostname is covered by the policy.
+    Returns (blocked, match) where match is None or a dict with the matching
+    'kind', 'domain' and 'tags'.
+    """
+    labels = hostname.lower().rstrip('.').split('.')
+    node = policy['root']
+    best = None
+    for depth, label in enumerate(reversed(labels), 1):
+        node = node.get('c', {}).get(label)
+        if node is None:
+            break
+        suffix = '.'.join(labels[len(labels) - depth:])
+        if ALLOW in node:
+            best = (ALLOW, suffix, node[ALLOW])
+        elif BLOCK in node:
+            best = (BLOCK, suffix, node[BLOCK])
+        elif WILDCARD in node and depth < len(labels):
+            best = (WILDCARD, suffix, node[WILDCARD])
+    if best is None:
+        return False, None
+    kind, domain, rule = best
+    return kind != ALLOW, {'kind': kind, 'domain': domain, 'tags': rule['tags']}
+
+def is_allowed(policy, hostname):
+    """Return True if an exception covers the hostname."""
+    _, match = check(policy, hostname)
+    return match is not None and match['kind'] == ALLOW
+
+def save_policy(policy, path):
+    with atomic_write(path) as f:
+        json.dump(policy, f, separators=(',', ':'))
+
+def load_policy(path):
+    """Load a compiled policy, or return None if it is missing or from another version."""
+    try:
+        with open(path) as f:
+            policy = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return policy if policy.get('version') == POLICY_VERSION else None
+
+class PolicySource:
+    """
+    The current policy, rebuilt only when the files it is compiled from change. load() builds
+    the policy; stamp() returns a cheap fingerprint of its source files (paths and mtimes).
+    Daemons read .policy on their hot path and call refresh() away from it.
+    """
+
+    def __init__(self, load, stamp):
+        self.load = load
+        self.stamp = stamp
+        self.version = stamp()
+        self.policy = load()
+
+    def refresh(self):
+        """Rebuild the policy if a source file changed since the last build. Returns True if it was rebuilt."""
+        version = self.stamp()
+        if version == self.version:
+            return False
+        # A file changing during the load leaves the old stamp behind, so the next call loads again
+        self.policy = self.load()
+        self.version = version
+        return True
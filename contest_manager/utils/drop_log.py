@@ -0,0 +1,300 @@
+"""
+Blocked-attempt telemetry for contest-manager
+
+With restrict --log-drops, the set match dropping a user's blocked destinations is preceded by
+a rate-limited NFLOG rule (LOG_RATE packets a second, bursts of LOG_BURST) that sends the packet
+headers to the netlink log group of the user (log_group). The aggregator reads those groups over
+one netlink socket; the kernel batches up to QUEUE_THRESHOLD messages per read, or whatever
+arrived within FLUSH_TIMEOUT. It only counts:
+
+    attempts      connection attempts (retransmissions of the same flow count once)
+    destinations  attempts per blocked address
+    domains       attempts per blacklisted name, through the reverse lookup of the user's IP index
+
+Every flush interval the counts are written to cache/drops_<user>.json, which status reads, and
+one summary line per user goes to the journal. Nothing is logged per packet. The counts are a
+lower bound: packets over the rate limit are dropped without a log message.
+"""
+
+import os
+import sys
+import time
+import json
+import socket
+import select
+import signal
+import struct
+from pathlib import Path
+from collections import OrderedDict
+from contest_manager.utils.utils import atomic_write
+from contest_manager.utils.ip_index import index_path, open_index, close_index, lookup_ip
+from contest_manager.utils.payload_inspector import parse_ip_packet
+
+CACHE_DIR = Path(__file__).parent.parent.parent / 'cache'
+LOG_RATE = 50
+LOG_BURST = 100
+COPY_RANGE = 128
+QUEUE_THRESHOLD = 64
+FLUSH_TIMEOUT = 100
+FLUSH_INTERVAL = 60
+FLOW_CACHE_SIZE = 4096
+TOP_ENTRIES = 50
+RECV_BUFFER = 1 << 20
+
+NETLINK_NETFILTER = 12
+NFNL_SUBSYS_ULOG = 4
+NFULNL_MSG_PACKET = 0
+NFULNL_MSG_CONFIG = 1
+NFULA_CFG_CMD = 1
+NFULA_CFG_MODE = 2
+NFULA_CFG_TIMEOUT = 3
+NFULA_CFG_QTHRESH = 4
+NFULNL_CFG_CMD_BIND = 1
+NFULNL_CFG_CMD_UNBIND = 2
+NFULNL_COPY_PACKET = 2
+NFULA_PAYLOAD = 9
+NFULA_PREFIX = 10
+NLM_F_REQUEST = 1
+NLM_F_ACK = 4
+NLMSG_ERROR = 2
+_NLMSG = struct.Struct('=IHHII')
+_NFGEN = struct.Struct('!BBH')
+_NLATTR = struct.Struct('=HH')
+
+def log_group(uid):
+    """NFLOG group a user's blocked packets are logged to."""
+    return uid & 0xffff
+
+def log_prefix(uid):
+    return f"contest-{uid}"
+
+def summary_path(user, cache_dir=CACHE_DIR):
+    return Path(cache_dir) / f"drops_{user}.json"
+
+def load_summary(user, cache_dir=CACHE_DIR):
+    """Return the user's last written blocked-attempt summary, or None."""
+    try:
+        with open(summary_path(user, cache_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _align(length):
+    return (length + 3) & ~3
+
+def _attr(kind, value):
+    data = _NLATTR.pack(_NLATTR.size + len(value), kind) + value
+    return data + b'\0' * (_align(len(data)) - len(data))
+
+def iter_messages(data):
+    """Yield (type, payload) for every netlink message in a buffer."""
+    offset = 0
+    while offset + _NLMSG.size <= len(data):
+        length, kind, _, _, _ = _NLMSG.unpack_from(data, offset)
+        if length < _NLMSG.size:
+            return
+        yield kind, data[offset + _NLMSG.size:offset + length]
+        offset += _align(length)
+
+def parse_attributes(data):
+    """Return {type: value} for the netlink attributes in data (nested/byte-order flags ignored)."""
+    attributes = {}
+    offset = 0
+    while offset + _NLATTR.size <= len(data):
+        length, kind = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        attributes[kind & 0x3fff] = data[offset + _NLATTR.size:offset + length]
+        offset += _align(length)
+    return attributes
+
+def parse_log_message(payload):
+    """Split an NFULNL_MSG_PACKET payload into (group, prefix, packet)."""
+    _, _, group = _NFGEN.unpack_from(payload, 0)
+    attributes = parse_attributes(payload[_NFGEN.size:])
+    prefix = attributes.get(NFULA_PREFIX, b'').split(b'\0', 1)[0].decode(errors='replace')
+    return group, prefix, attributes.get(NFULA_PAYLOAD, b'')
+
+class LogSocket:
+    """A netlink socket bound to NFLOG groups, in copy-packet mode with kernel-side batching."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_NETFILTER)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER)
+        self.sock.bind((0, 0))
+        self.seq = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _config(self, group, attributes):
+        """Send one config request and wait for its acknowledgement; raises OSError on a kernel error."""
+        self.seq += 1
+        payload = _NFGEN.pack(socket.AF_UNSPEC, 0, group) + b''.join(_attr(kind, value) for kind, value in attributes)
+        kind = (NFNL_SUBSYS_ULOG << 8) | NFULNL_MSG_CONFIG
+        self.sock.send(_NLMSG.pack(_NLMSG.size + len(payload), kind, NLM_F_REQUEST | NLM_F_ACK, self.seq, 0) + payload)
+        while True:
+            for kind, reply in iter_messages(self.sock.recv(65536)):
+                if kind == NLMSG_ERROR:
+                    error = struct.unpack_from('=i', reply)[0]
+                    if error:
+                        raise OSError(-error, os.strerror(-error))
+                    return
+
+    def bind(self, group):
+        """Receive the messages of an NFLOG group, copying COPY_RANGE bytes of each packet."""
+        self._config(group, [(NFULA_CFG_CMD, struct.pack('B', NFULNL_CFG_CMD_BIND))])
+        self._config(group, [(NFULA_CFG_MODE, struct.pack('!IBB', COPY_RANGE, NFULNL_COPY_PACKET, 0)),
+                             (NFULA_CFG_QTHRESH, struct.pack('!I', QUEUE_THRESHOLD)),
+                             (NFULA_CFG_TIMEOUT, struct.pack('!I', FLUSH_TIMEOUT))])
+
+    def unbind(self, group):
+        try:
+            self._config(group, [(NFULA_CFG_CMD, struct.pack('B', NFULNL_CFG_CMD_UNBIND))])
+        except OSError:
+            pass
+
+    def read(self):
+        """Return the (group, prefix, packet) messages queued on the socket; None if the kernel had to drop some."""
+        try:
+            data = self.sock.recv(RECV_BUFFER)
+        except BlockingIOError:
+            return []
+        except OSError:
+            # ENOBUFS: the receive buffer overflowed and messages were lost
+            return None
+        kind = (NFNL_SUBSYS_ULOG << 8) | NFULNL_MSG_PACKET
+        return [parse_log_message(payload) for message_kind, payload in iter_messages(data) if message_kind == kind]
+
+    def close(self):
+        self.sock.close()
+
+class ReverseLookup:
+    """Names an address was resolved from, read from the user's IP index and reopened when it is rewritten."""
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.index = None
+        self.version = None
+
+    def names(self, address):
+        # Shared caches are followed, so the index path can change when the user is restricted again
+        path = index_path(self.cache_path)
+        try:
+            version = (path, path.stat().st_mtime)
+        except OSError:
+            return []
+        if version != self.version:
+            self.close()
+            self.index, self.version = open_index(path), version
+        return lookup_ip(self.index, address) if self.index is not None else []
+
+    def close(self):
+        if self.index is not None:
+            close_index(self.index)
+            self.index = None
+
+class DropCounter:
+    """Blocked-attempt counts of one user, continued from the last summary written."""
+
+    def __init__(self, user, cache_dir=CACHE_DIR):
+        self.user = user
+        self.cache_dir = cache_dir
+        self.lookup = ReverseLookup(Path(cache_dir) / f"ip_cache_{user}.json")
+        previous = load_summary(user, cache_dir) or {}
+        self.since = previous.get('since', int(time.time()))
+        self.attempts = previous.get('attempts', 0)
+        self.packets = previous.get('packets', 0)
+        self.destinations = dict(previous.get('destinations', {}))
+        self.domains = dict(previous.get('domains', {}))
+        self.flows = OrderedDict()
+        self.recent = 0
+
+    def count(self, packet):
+        """Count one logged packet. Returns True if it started a new attempt."""
+        parsed = parse_ip_packet(packet)
+        if parsed is None:
+            return False
+        proto, _, sport, dst, dport, _ = parsed
+        self.packets += 1
+        flow = (proto, sport, dst, dport)
+        if flow in self.flows:
+            self.flows.move_to_end(flow)
+            return False
+        self.flows[flow] = True
+        if len(self.flows) > FLOW_CACHE_SIZE:
+            self.flows.popitem(last=False)
+        self.attempts += 1
+        self.recent += 1
+        address = str(dst)
+        self.destinations[address] = self.destinations.get(address, 0) + 1
+        for name in self.lookup.names(address):
+            self.domains[name] = self.domains.get(name, 0) + 1
+        return True
+
+    def summary(self):
+        top = lambda counts: dict(sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:TOP_ENTRIES])
+        return {'user': self.user, 'since': self.since, 'updated': int(time.time()), 'attempts': self.attempts,
+                'packets': self.packets, 'destinations': top(self.destinations), 'domains': top(self.domains)}
+
+    def flush(self):
+        """Write the summary (only the TOP_ENTRIES largest counts per table) and report the attempts since the last flush."""
+        summary = self.summary()
+        with atomic_write(summary_path(self.user, self.cache_dir)) as f:
+            json.dump(summary, f, indent=2)
+        if self.recent:
+            names = ', '.join(f"{name} {count}" for name, count in list(summary['domains'].items())[:3])
+            print(f"🚫 {self.user}: {self.recent} blocked attempts since the last summary, {self.attempts} in total"
+                  + (f" (top: {names})" if names else ''), flush=True)
+        self.recent = 0
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+def run_drop_log(users, cache_dir=CACHE_DIR, flush_interval=FLUSH_INTERVAL, verbose=False):
+    """
+    Count the blocked attempts of users ([(user, uid)]) until interrupted, writing summaries
+    every flush_interval seconds. Returns False if the log groups cannot be bound.
+    """
+    signal.signal(signal.SIGTERM, _stop)
+    counters = {}
+    try:
+        sock = LogSocket()
+        for user, uid in users:
+            sock.bind(log_group(uid))
+            counters[log_group(uid)] = (log_prefix(uid), DropCounter(user, cache_dir))
+    except (OSError, AttributeError) as e:
+        print(f"❌ Cannot read the NFLOG groups: {e} (is another drop-log running for the same user?)")
+        return False
+    print(f"📊 Counting blocked attempts of {', '.join(user for user, _ in users)}, "
+          f"summaries every {flush_interval}s (Ctrl+C to stop)", flush=True)
+    lost = 0
+    deadline = time.monotonic() + flush_interval
+    try:
+        while True:
+            if select.select([sock], [], [], max(0.0, deadline - time.monotonic()))[0]:
+                messages = sock.read()
+                if messages is None:
+                    lost += 1
+                    messages = []
+                for group, prefix, packet in messages:
+                    if group in counters and prefix == counters[group][0]:
+                        counter = counters[group][1]
+                        if counter.count(packet) and verbose:
+                            print(f"[drop-log] {counter.user}: {parse_ip_packet(packet)[3]}", flush=True)
+            if time.monotonic() >= deadline:
+                for _, counter in counters.values():
+                    counter.flush()
+                if lost and verbose:
+                    print(f"[drop-log] receive buffer overflowed {lost} times; some attempts were not counted")
+                lost = 0
+                deadline = time.monotonic() + flush_interval
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for group, (_, counter) in counters.items():
+            counter.flush()
+            counter.lookup.close()
+            sock.unbind(group)
+        sock.close()
+    return True
@@ -0,0 +1,928 @@
+"""
+Firewall rule generation and application for contest-manager
+
+A ruleset is generated in memory: token lists for the user's own chain (CONTEST-<uid>)
+and, for the ipset backend, the members of the per-user address sets, one entry per address
+family. OUTPUT only holds a single jump per user, "-m owner --uid-owner <uid> -j CONTEST-<uid>",
+so applying replaces the chain contents and removing a user never depends on the number of rules.
+Backends:
+    nft      addresses kept in interval sets of the inet table "contest", matched with
+             "meta skuid" in a per-user output chain; one 'nft -f' transaction per change
+    restore  one DROP rule per address, applied in a single iptables-restore/ip6tables-restore
+             transaction per family
+    ipset    addresses kept in hash:net sets (one per family) referenced by a single
+             set-match rule, refreshed with 'ipset restore' and an atomic 'ipset swap'
+    legacy   one DROP rule per address, one iptables call per rule (slow fallback)
+    bpf      prefixes kept in LPM-trie maps of a cgroup_skb/egress program attached to the
+             user's slice; updates are map writes (optional, see bpf_backend)
+restore is the default. 'auto' picks nft when the nft binary is available and names are blocked
+by the inspector or the sinkhole (nft and bpf have no string match for the DNS/DoH rules), and
+restore otherwise.
+In allowlist mode the user's chain is default-deny instead: loopback, established flows, DNS to
+the system nameservers and the allowed destinations are accepted and everything else is dropped.
+With the DNS sinkhole, the user's port-53 traffic is also redirected to the local resolver by
+nat OUTPUT rules (or a nat chain "dns_<uid>" with nft). With log_drops, the set backends (nft and
+ipset) log a rate-limited sample of the dropped packets to the user's NFLOG group (see drop_log).
+"""
+
+import json
+import shlex
+import bisect
+import shutil
+import ipaddress
+import subprocess
+from contest_manager.utils.payload_inspector import QUEUE_PACKETS, DNS_PORT, TLS_PORT, queue_number
+from contest_manager.utils.bpf_backend import load_and_attach, attached, update_maps
+from contest_manager.utils.drop_log import LOG_RATE, LOG_BURST, log_group, log_prefix
+
+FAMILIES = ('ipv4', 'ipv6')
+IPTABLES = {'ipv4': 'iptables', 'ipv6': 'ip6tables'}
+RESTORE = {'ipv4': 'iptables-restore', 'ipv6': 'ip6tables-restore'}
+BACKENDS = ('auto', 'nft', 'restore', 'ipset', 'legacy', 'bpf')
+DEFAULT_BACKEND = 'restore'
+SET_BACKENDS = ('nft', 'ipset', 'bpf')
+STRING_MATCH_BACKENDS = ('restore', 'ipset', 'legacy')
+LOG_BACKENDS = ('nft', 'ipset')
+IPSET_FAMILY = {'ipv4': 'inet', 'ipv6': 'inet6'}
+IPSET_SUFFIX = {'ipv4': 'v4', 'ipv6': 'v6'}
+CHAIN_PREFIX = 'CONTEST-'
+NFT_TABLE = 'contest'
+NFT_SET_PREFIX = {'ipv4': 'blocked4', 'ipv6': 'blocked6'}
+NFT_ALLOW_SET_PREFIX = {'ipv4': 'allowed4', 'ipv6': 'allowed6'}
+NFT_ADDR_TYPE = {'ipv4': 'ipv4_addr', 'ipv6': 'ipv6_addr'}
+NFT_MATCH = {'ipv4': 'ip', 'ipv6': 'ip6'}
+NFT_ELEMENTS_PER_LINE = 1000
+INSPECTED_PORTS = (('udp', DNS_PORT), ('tcp', DNS_PORT), ('tcp', TLS_PORT))
+
+def resolve_backend(backend, name_blocking=False):
+    """
+    Turn 'auto' into the concrete backend to use on this machine. nft is only picked when
+    name_blocking is set (the inspector or the sinkhole checks DNS/TLS names), since without
+    string matches it would block by address alone.
+    """
+    if backend == 'auto':
+        return 'nft' if name_blocking and shutil.which('nft') else 'restore'
+    return backend
+
+def owner_match(uid):
+    return ['-m', 'owner', '--uid-owner', str(uid)]
+
+def chain_name(uid):
+    """Name of the chain holding a user's rules."""
+    return f"{CHAIN_PREFIX}{uid}"
+
+def jump_rule(uid):
+    """The OUTPUT rule sending a user's traffic to their chain."""
+    return owner_match(uid) + ['-j', chain_name(uid)]
+
+def matches_uid(rule, uid):
+    """Return True if a rule's tokens match exactly this owner UID (so 100 never matches 1000)."""
+    return any(a == '--uid-owner' and b == str(uid) for a, b in zip(rule, rule[1:]))
+
+def queue_rules(uid):
+    """
+    The rules handing the first packets of each DNS (udp/tcp 53) and TLS (tcp 443) flow to the
+    payload inspector (fails open without it); the inspector accepts every other port unseen.
+    """
+    return [['-p', proto, '--dport', str(port), '-m', 'connbytes', '--connbytes', f"0:{QUEUE_PACKETS}",
+             '--connbytes-dir', 'original', '--connbytes-mode', 'packets', '-j', 'NFQUEUE',
+             '--queue-num', str(queue_number(uid)), '--queue-bypass'] for proto, port in INSPECTED_PORTS]
+
+def inspects_payload(rule):
+    """Return True for rules that look at packet payloads (string matches and the inspector queue)."""
+    return '--string' in rule or 'NFQUEUE' in rule
+
+def log_rule(uid, family):
+    """The rule logging a rate-limited sample of the packets dropped by the user's set match."""
+    return ['-m', 'set', '--match-set', set_name(uid, family), 'dst', '-m', 'limit', '--limit', f"{LOG_RATE}/sec",
+            '--limit-burst', str(LOG_BURST), '-j', 'NFLOG', '--nflog-group', str(log_group(uid)),
+            '--nflog-prefix', log_prefix(uid)]
+
+def set_name(uid, family):
+    """Name of the ipset holding a user's blocked addresses for one family."""
+    return f"contest-{uid}-{IPSET_SUFFIX[family]}"
+
+def build_ruleset(uid, ip_map, backend=DEFAULT_BACKEND, aggregate=None, inspector=False, sinkhole=False,
+                  log_drops=False):
+    """
+    Build the DROP rules for a user from (name, [ips]) pairs.
+    Returns {'rules': {family: [tokens, ...]}, 'sets': {family: [ips]}} where each rule is the
+    argument list following the chain name of an '-A CONTEST-<uid>' command. The owner match
+    lives on the jump rule, so the rules themselves do not repeat it. With the ipset backend
+    the addresses go into 'sets' and a single rule per family matches the set. The nft backend
+    only uses 'sets': nftables has no equivalent of the string match used for DNS/DoH payloads.
+    aggregate(family, addresses), if given, turns each family's addresses into the CIDR blocks to block.
+    With inspector, the string matches are replaced by NFQUEUE rules for the DNS and TLS ports
+    feeding the payload inspector, which every netfilter backend (nft included) supports. The bpf backend
+    only uses 'sets'. With sinkhole, DNS is answered by the local sinkhole, so the port 53
+    string matches are left out. With log_drops, the nft and ipset backends log the packets their
+    set match drops to the user's NFLOG group ('log'); the other backends ignore it.
+    """
+    backend = resolve_backend(backend)
+    use_sets = backend in SET_BACKENDS
+    log_drops = log_drops and backend in LOG_BACKENDS
+    rules = {family: [] for family in FAMILIES}
+    addresses = {family: [] for family in FAMILIES}
+    for target, ips in ip_map:
+        for ip in ips:
+            addresses['ipv6' if ':' in ip else 'ipv4'].append(ip)
+        if inspector:
+            continue
+        # Block DNS requests for the domain/subdomain
+        if not sinkhole:
+            rules['ipv4'].append(['-p', 'udp', '--dport', '53', '-m', 'string', '--string', target,
+                                  '--algo', 'bm', '-j', 'DROP'])
+        # Block DNS over HTTPS (DoH) for the domain/subdomain (TCP 443)
+        for family in FAMILIES:
+            rules[family].append(['-p', 'tcp', '--dport', '443', '-m', 'string', '--string', target,
+                                  '--algo', 'bm', '-j', 'DROP'])
+    if aggregate:
+        addresses = {family: aggregate(family, addresses[family]) for family in FAMILIES}
+    if inspector:
+        for family in FAMILIES:
+            rules[family].extend(queue_rules(uid))
+    if backend in ('nft', 'bpf'):
+        rules = {family: [] for family in FAMILIES}
+    elif use_sets:
+        for family in FAMILIES:
+            rules[family].insert(0, ['-m', 'set', '--match-set', set_name(uid, family), 'dst', '-j', 'DROP'])
+            if log_drops:
+                rules[family].insert(0, log_rule(uid, family))
+    else:
+        for family in FAMILIES:
+            rules[family][0:0] = [['-d', address, '-j', 'DROP'] for address in addresses[family]]
+    return {'rules': rules, 'sets': addresses if use_sets else {}, 'queue': queue_number(uid) if inspector else None,
+            'log': log_group(uid) if log_drops else None}
+
+def allowlist_backend(backend):
+    """
+    Backend used in allowlist mode: the rules are few, so every iptables-based backend
+    applies them as chain rules; the bpf backend has no accept path and falls back to restore.
+    """
+    backend = resolve_backend(backend)
+    if backend == 'bpf':
+        print("⚠️  The bpf backend only supports blacklist mode; using restore.")
+    if backend in ('nft', 'legacy'):
+        return backend
+    return 'restore'
+
+def build_allowlist_ruleset(uid, networks, nameservers=(), backend=DEFAULT_BACKEND):
+    """
+    Build the default-deny rules for a user: accept loopback, established flows, DNS to the
+    given nameservers and the allowed networks, drop everything else. Returns a ruleset like
+    build_ruleset with 'mode' set to 'allowlist'; with nft, the networks go into 'sets'.
+    """
+    backend = allowlist_backend(backend)
+    allowed = {family: [] for family in FAMILIES}
+    for network in networks:
+        allowed['ipv6' if ':' in network else 'ipv4'].append(network)
+    rules = {}
+    for family in FAMILIES:
+        rules[family] = [['-o', 'lo', '-j', 'ACCEPT'],
+                         ['-m', 'conntrack', '--ctstate', 'ESTABLISHED,RELATED', '-j', 'ACCEPT']]
+        for nameserver in nameservers:
+            if (':' in nameserver) == (family == 'ipv6'):
+                rules[family].extend(['-d', nameserver, '-p', proto, '--dport', '53', '-j', 'ACCEPT']
+                                     for proto in ('udp', 'tcp'))
+        rules[family].extend(['-d', network, '-j', 'ACCEPT'] for network in allowed[family])
+        rules[family].append(['-j', 'DROP'])
+    if backend == 'nft':
+        return {'rules': {family: [] for family in FAMILIES}, 'sets': allowed, 'queue': None,
+                'mode': 'allowlist', 'nameservers': list(nameservers)}
+    return {'rules': rules, 'sets': {}, 'queue': None, 'mode': 'allowlist', 'nameservers': list(nameservers)}
+
+def existing_ipsets():
+    if not shutil.which('ipset'):
+        return set()
+    result = subprocess.run(['ipset', 'list', '-n'], capture_output=True, text=True)
+    return set(result.stdout.split()) if result.returncode == 0 else set()
+
+def render_ipset_restore(uid, sets, existing=()):
+    """
+    Render an 'ipset restore' script that fills a temporary set per family and swaps
+    it with the live one, so the live set changes atomically. Live sets not in
+    `existing` are created first.
+    """
+    lines = []
+    for family in FAMILIES:
+        name = set_name(uid, family)
+        tmp = f"{name}-tmp"
+        members = sorted(set(sets.get(family, [])))
+        maxelem = max(65536, len(members) * 2)
+        if name not in existing:
+            lines.append(f"create {name} hash:net family {IPSET_FAMILY[family]} maxelem {maxelem}")
+        lines.append(f"create {tmp} hash:net family {IPSET_FAMILY[family]} maxelem {maxelem} -exist")
+        lines.append(f"flush {tmp}")
+        lines.extend(f"add {tmp} {ip} -exist" for ip in members)
+        lines.append(f"swap {tmp} {name}")
+        lines.append(f"destroy {tmp}")
+    return '\n'.join(lines) + '\n'
+
+def ipset_restore(uid, sets, verbose=False):
+    """Load the user's address sets with a single 'ipset restore' call. Returns True on success."""
+    result = subprocess.run(['ipset', 'restore'], input=render_ipset_restore(uid, sets, existing_ipsets()),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ ipset restore failed: {result.stderr.strip()}")
+        return False
+    if verbose:
+        print(f"[ipset] {', '.join(f'{len(v)} {k}' for k, v in sets.items())} addresses swapped in")
+    return True
+
+def destroy_ipsets(uid):
+    """Destroy a user's address sets (they must no longer be referenced by any rule)."""
+    if not shutil.which('ipset'):
+        return
+    for family in FAMILIES:
+        subprocess.run(['ipset', 'destroy', set_name(uid, family)], capture_output=True)
+
+def ipset_sizes(uid):
+    """Return {family: number of entries} for the user's sets that exist."""
+    sizes = {}
+    if not shutil.which('ipset'):
+        return sizes
+    for family in FAMILIES:
+        result = subprocess.run(['ipset', 'list', '-t', set_name(uid, family)], capture_output=True, text=True)
+        if result.returncode != 0:
+            continue
+        for line in result.stdout.splitlines():
+            if line.startswith('Number of entries:'):
+                sizes[family] = int(line.split(':', 1)[1])
+    return sizes
+
+def nft_chain_name(uid):
+    return f"output_{uid}"
+
+def nft_set_name(uid, family, prefix=NFT_SET_PREFIX):
+    return f"{prefix[family]}_{uid}"
+
+def _nft_declarations(uid, prefixes=(NFT_SET_PREFIX,)):
+    """Statements creating the table, the user's sets and chain (no-ops when they exist)."""
+    lines = [f"add table inet {NFT_TABLE}"]
+    for prefix in prefixes:
+        for family in FAMILIES:
+            lines.append(f"add set inet {NFT_TABLE} {nft_set_name(uid, family, prefix)} "
+                         f"{{ type {NFT_ADDR_TYPE[family]}; flags interval; auto-merge; }}")
+    lines.append(f"add chain inet {NFT_TABLE} {nft_chain_name(uid)} "
+                 f"{{ type filter hook output priority 0; policy accept; }}")
+    return lines
+
+def render_nft_apply(uid, sets, early_accept=False, queue=None, log=None):
+    """
+    Render an 'nft -f' script that replaces the user's sets and chain contents.
+    The chain is a base chain hooked on output, so no shared jump rule has to be managed.
+    With early_accept, established/related flows leave the chain before the set lookups;
+    with queue, the first packets of each DNS and TLS flow go to the payload inspector on that queue;
+    with log, a rate-limited sample of the dropped packets goes to that NFLOG group.
+    """
+    chain = nft_chain_name(uid)
+    lines = _nft_declarations(uid)
+    lines.append(f"flush chain inet {NFT_TABLE} {chain}")
+    if early_accept:
+        # With the inspector, established flows are only let through once past its packet window
+        window = f" ct original packets > {QUEUE_PACKETS}" if queue is not None else ''
+        lines.append(f"add rule inet {NFT_TABLE} {chain} ct state established,related{window} accept")
+    for family in FAMILIES:
+        name = nft_set_name(uid, family)
+        lines.append(f"flush set inet {NFT_TABLE} {name}")
+        members = sorted(set(sets.get(family, [])))
+        for i in range(0, len(members), NFT_ELEMENTS_PER_LINE):
+            lines.append(f"add element inet {NFT_TABLE} {name} {{ {', '.join(members[i:i + NFT_ELEMENTS_PER_LINE])} }}")
+        match = f"add rule inet {NFT_TABLE} {chain} meta skuid {uid} {NFT_MATCH[family]} daddr @{name}"
+        if log is not None:
+            lines.append(f'{match} limit rate {LOG_RATE}/second burst {LOG_BURST} packets '
+                         f'log prefix "{log_prefix(uid)}" group {log}')
+        lines.append(f"{match} drop")
+    if queue is not None:
+        window = f"add rule inet {NFT_TABLE} {chain} meta skuid {uid} ct original packets 0-{QUEUE_PACKETS}"
+        lines.append(f"{window} meta l4proto {{ tcp, udp }} th dport {DNS_PORT} queue num {queue} bypass")
+        lines.append(f"{window} tcp dport {TLS_PORT} queue num {queue} bypass")
+    return '\n'.join(lines) + '\n'
+
+def render_nft_allowlist(uid, sets, nameservers=()):
+    """
+    Render an 'nft -f' script that replaces the user's chain with default-deny rules: loopback,
+    established flows, DNS to the system nameservers and the addresses in the allowed sets are
+    accepted, everything else the user sends is dropped.
+    """
+    chain = nft_chain_name(uid)
+    lines = _nft_declarations(uid, (NFT_ALLOW_SET_PREFIX,))
+    lines.append(f"flush chain inet {NFT_TABLE} {chain}")
+    rule = f"add rule inet {NFT_TABLE} {chain} meta skuid {uid}"
+    lines.append(f'{rule} oifname "lo" accept')
+    lines.append(f"{rule} ct state established,related accept")
+    for nameserver in nameservers:
+        match = NFT_MATCH['ipv6' if ':' in nameserver else 'ipv4']
+        lines.append(f"{rule} {match} daddr {nameserver} meta l4proto {{ tcp, udp }} th dport 53 accept")
+    for family in FAMILIES:
+        name = nft_set_name(uid, family, NFT_ALLOW_SET_PREFIX)
+        lines.append(f"flush set inet {NFT_TABLE} {name}")
+        members = sorted(set(sets.get(family, [])))
+        for i in range(0, len(members), NFT_ELEMENTS_PER_LINE):
+            lines.append(f"add element inet {NFT_TABLE} {name} {{ {', '.join(members[i:i + NFT_ELEMENTS_PER_LINE])} }}")
+        lines.append(f"{rule} {NFT_MATCH[family]} daddr @{name} accept")
+    lines.append(f"{rule} drop")
+    return '\n'.join(lines) + '\n'
+
+def render_nft_removal(uid):
+    """Render an 'nft -f' script deleting the user's chain and sets (declared first, so it never fails)."""
+    prefixes = (NFT_SET_PREFIX, NFT_ALLOW_SET_PREFIX)
+    lines = _nft_declarations(uid, prefixes)
+    lines.append(f"flush chain inet {NFT_TABLE} {nft_chain_name(uid)}")
+    lines.append(f"delete chain inet {NFT_TABLE} {nft_chain_name(uid)}")
+    lines.extend(f"delete set inet {NFT_TABLE} {nft_set_name(uid, family, prefix)}"
+                 for prefix in prefixes for family in FAMILIES)
+    return '\n'.join(lines) + '\n'
+
+def nft_run(script, verbose=False):
+    """Run an nft script as a single transaction. Returns True on success."""
+    result = subprocess.run(['nft', '-f', '-'], input=script, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ nft failed: {result.stderr.strip()}")
+        return False
+    if verbose:
+        print("[nft] transaction committed")
+    return True
+
+def nft_remove(uid, verbose=False):
+    """Remove the user's nftables chain and sets, if nft is installed."""
+    if shutil.which('nft'):
+        nft_run(render_nft_removal(uid), verbose=verbose)
+
+def nft_set_sizes(uid):
+    """Return {family: number of elements} for the user's nftables sets that exist."""
+    sizes = {}
+    if not shutil.which('nft'):
+        return sizes
+    for family in FAMILIES:
+        result = subprocess.run(['nft', '-j', 'list', 'set', 'inet', NFT_TABLE, nft_set_name(uid, family)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            continue
+        try:
+            items = json.loads(result.stdout).get('nftables', [])
+        except ValueError:
+            continue
+        for item in items:
+            if 'set' in item:
+                sizes[family] = len(item['set'].get('elem', []))
+    return sizes
+
+def nft_chain_listing(uid):
+    """Return the 'nft list chain' output for the user's chain, or None if it does not exist."""
+    if not shutil.which('nft'):
+        return None
+    result = subprocess.run(['nft', 'list', 'chain', 'inet', NFT_TABLE, nft_chain_name(uid)],
+                            capture_output=True, text=True)
+    return result.stdout if result.returncode == 0 else None
+
+def nft_chain_active(uid):
+    """Return True if the user's nftables chain exists and holds rules."""
+    return 'meta skuid' in (nft_chain_listing(uid) or '')
+
+def rule_exists(family, rule, chain='OUTPUT', table='filter'):
+    result = subprocess.run([IPTABLES[family], '-t', table, '-C', chain] + rule, capture_output=True)
+    return result.returncode == 0
+
+def list_rules(family, chain='OUTPUT', table='filter'):
+    """
+    Return the rules of a chain as token lists (without the leading '-A <chain>'),
+    or None if the chain does not exist.
+    """
+    result = subprocess.run([IPTABLES[family], '-t', table, '-S', chain], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    rules = []
+    for line in result.stdout.splitlines():
+        tokens = shlex.split(line)
+        if tokens[:2] == ['-A', chain]:
+            rules.append(tokens[2:])
+    return rules
+
+def _quote(token):
+    return f'"{token}"' if any(c in token for c in ' "\'') else token
+
+def render_restore(rules, chain='OUTPUT', action='-A'):
+    """Render rules as an iptables-restore script for the filter table."""
+    lines = ['*filter']
+    for rule in rules:
+        lines.append(' '.join([action, chain] + [_quote(t) for t in rule]))
+    lines.append('COMMIT')
+    return '\n'.join(lines) + '\n'
+
+def render_chain_restore(uid, rules, add_jump=True, stale_output=()):
+    """
+    Render an iptables-restore script that replaces the contents of the user's chain.
+    Declaring the chain creates it, or flushes it under --noflush, so the old rules are
+    swapped for the new ones in the same transaction. The jump from OUTPUT is added when
+    add_jump is set, and stale_output rules (per-rule OUTPUT entries of older versions) are deleted.
+    """
+    chain = chain_name(uid)
+    lines = ['*filter', f":{chain} - [0:0]"]
+    lines.extend(' '.join(['-D', 'OUTPUT'] + [_quote(t) for t in rule]) for rule in stale_output)
+    lines.extend(' '.join(['-A', chain] + [_quote(t) for t in rule]) for rule in rules)
+    if add_jump:
+        lines.append(' '.join(['-A', 'OUTPUT'] + jump_rule(uid)))
+    lines.append('COMMIT')
+    return '\n'.join(lines) + '\n'
+
+def render_chain_repair(uid, desired, missing, unwanted, add_jump=False):
+    """
+    Render an iptables-restore script that repairs the user's chain in place: unwanted rules
+    (added or repeated) are deleted, then the missing ones are inserted at their position in
+    desired, so only the changed rules are touched. The jump from OUTPUT is added when add_jump is set.
+    """
+    chain = chain_name(uid)
+    lines = ['*filter']
+    lines.extend(' '.join(['-D', chain] + [_quote(t) for t in rule]) for rule in unwanted)
+    missing_keys = {rule_key(rule) for rule in missing}
+    seen = set()
+    for rule in desired:
+        key = rule_key(rule)
+        if key in seen:
+            continue
+        seen.add(key)
+        if key in missing_keys:
+            lines.append(' '.join(['-I', chain, str(len(seen))] + [_quote(t) for t in rule]))
+    if add_jump:
+        lines.append(' '.join(['-A', 'OUTPUT'] + jump_rule(uid)))
+    lines.append('COMMIT')
+    return '\n'.join(lines) + '\n'
+
+def render_chain_removal(uid, output_rules):
+    """
+    Render an iptables-restore script that deletes the given OUTPUT rules (the jump and any
+    rules left by older versions), then flushes and deletes the user's chain.
+    """
+    chain = chain_name(uid)
+    lines = ['*filter', f":{chain} - [0:0]"]
+    lines.extend(' '.join(['-D', 'OUTPUT'] + [_quote(t) for t in rule]) for rule in output_rules)
+    lines.append(f"-X {chain}")
+    lines.append('COMMIT')
+    return '\n'.join(lines) + '\n'
+
+def restore(family, script, verbose=False):
+    """
+    Feed a script to iptables-restore/ip6tables-restore --noflush.
+    The whole script is committed atomically or not at all. --wait queues behind another
+    process holding the xtables lock instead of failing. Returns True on success.
+    """
+    result = subprocess.run([RESTORE[family], '--noflush', '--wait'], input=script, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ {RESTORE[family]} failed: {result.stderr.strip()}")
+        return False
+    if verbose:
+        print(f"[{RESTORE[family]}] transaction committed")
+    return True
+
+def apply_rules_restore(uid, rules, verbose=False):
+    """
+    Replace the user's chain with one restore transaction per family.
+    If the second family fails, the chain of the first is restored to its previous
+    contents, so the ruleset is applied all-or-nothing.
+    """
+    applied = []
+    for family in FAMILIES:
+        previous = list_rules(family, chain_name(uid))
+        output_rules = [r for r in (list_rules(family) or []) if matches_uid(r, uid)]
+        add_jump = jump_rule(uid) not in output_rules
+        stale = [r for r in output_rules if r != jump_rule(uid)]
+        if not restore(family, render_chain_restore(uid, rules[family], add_jump, stale), verbose=verbose):
+            for done, done_previous in applied:
+                if done_previous is None:
+                    remove_user_chain(uid, families=(done,), verbose=verbose)
+                else:
+                    restore(done, render_chain_restore(uid, done_previous, add_jump=False), verbose=verbose)
+            return False
+        applied.append((family, previous))
+    return True
+
+def apply_rules_legacy(uid, rules, verbose=False):
+    """Fill the user's chain with one iptables/ip6tables process per rule (slow fallback)."""
+    failed = 0
+    chain = chain_name(uid)
+    for family in FAMILIES:
+        subprocess.run([IPTABLES[family], '-N', chain], capture_output=True)
+        subprocess.run([IPTABLES[family], '-F', chain], capture_output=True)
+        for rule in rules[family]:
+            try:
+                subprocess.run([IPTABLES[family], '-A', chain] + rule, check=True)
+            except Exception:
+                failed += 1
+        if not rule_exists(family, jump_rule(uid)):
+            subprocess.run([IPTABLES[family], '-A', 'OUTPUT'] + jump_rule(uid), capture_output=True)
+    if verbose and failed:
+        print(f"[legacy] {failed} rules could not be applied")
+    return True
+
+def remove_user_chain(uid, families=FAMILIES, verbose=False):
+    """
+    Remove the user's jump rule and chain, together with any OUTPUT rules for the UID left by
+    older versions, in one transaction per family. Returns the number of OUTPUT rules removed.
+    """
+    removed = 0
+    chain = chain_name(uid)
+    for family in families:
+        if not shutil.which(IPTABLES[family]):
+            continue
+        output_rules = [r for r in (list_rules(family) or []) if matches_uid(r, uid)]
+        if shutil.which(RESTORE[family]):
+            if not restore(family, render_chain_removal(uid, output_rules), verbose=verbose):
+                continue
+        else:
+            for rule in output_rules:
+                subprocess.run([IPTABLES[family], '-D', 'OUTPUT'] + rule, capture_output=True)
+            subprocess.run([IPTABLES[family], '-F', chain], capture_output=True)
+            subprocess.run([IPTABLES[family], '-X', chain], capture_output=True)
+        removed += len(output_rules)
+        if verbose:
+            print(f"[{IPTABLES[family]}] Removed chain {chain} and {len(output_rules)} OUTPUT rules for UID {uid}")
+    return removed
+
+def chain_active(uid, family):
+    """Return True if the user's chain exists, holds rules and is jumped to from OUTPUT."""
+    rules = list_rules(family, chain_name(uid))
+    return bool(rules) and rule_exists(family, jump_rule(uid))
+
+def apply_ruleset(uid, ruleset, backend=DEFAULT_BACKEND, verbose=False):
+    """Apply a ruleset built by build_ruleset with the chosen backend."""
+    backend = resolve_backend(backend)
+    rules = ruleset['rules']
+    if ruleset.get('mode') == 'allowlist':
+        backend = allowlist_backend(backend)
+        if backend == 'nft':
+            return nft_run(render_nft_allowlist(uid, ruleset['sets'], ruleset['nameservers']), verbose=verbose)
+        if backend == 'restore' and shutil.which(RESTORE['ipv4']):
+            return apply_rules_restore(uid, rules, verbose=verbose)
+        return apply_rules_legacy(uid, rules, verbose=verbose)
+    if backend == 'bpf':
+        return load_and_attach(uid, verbose=verbose) and update_maps(uid, ruleset['sets'], verbose=verbose) is not None
+    if backend == 'nft':
+        return nft_run(render_nft_apply(uid, ruleset['sets'], ruleset.get('early_accept'), ruleset.get('queue'),
+                                        ruleset.get('log')),
+                       verbose=verbose)
+    if backend == 'ipset':
+        if not ipset_restore(uid, ruleset['sets'], verbose=verbose):
+            return False
+    elif backend == 'restore' and not shutil.which(RESTORE['ipv4']):
+        print(f"⚠️  {RESTORE['ipv4']} not found, falling back to one iptables call per rule.")
+        backend = 'legacy'
+    if backend == 'legacy':
+        return apply_rules_legacy(uid, rules, verbose=verbose)
+    return apply_rules_restore(uid, rules, verbose=verbose)
+
+def nft_dns_chain_name(uid):
+    return f"dns_{uid}"
+
+def dns_redirect_rules(uid, port):
+    """The nat OUTPUT rules sending a user's DNS traffic (UDP and TCP port 53) to the local sinkhole."""
+    return [['-p', proto, '--dport', '53'] + owner_match(uid) + ['-j', 'REDIRECT', '--to-ports', str(port)]
+            for proto in ('udp', 'tcp')]
+
+def render_nft_dns_redirect(uid, port):
+    """Render an 'nft -f' script (re)creating the user's nat chain that redirects port 53 to the sinkhole."""
+    chain = nft_dns_chain_name(uid)
+    lines = [f"add table inet {NFT_TABLE}",
+             f"add chain inet {NFT_TABLE} {chain} {{ type nat hook output priority -100; policy accept; }}",
+             f"flush chain inet {NFT_TABLE} {chain}"]
+    lines.extend(f"add rule inet {NFT_TABLE} {chain} meta skuid {uid} {proto} dport 53 redirect to :{port}"
+                 for proto in ('udp', 'tcp'))
+    return '\n'.join(lines) + '\n'
+
+def render_nft_dns_removal(uid):
+    chain = nft_dns_chain_name(uid)
+    lines = [f"add table inet {NFT_TABLE}",
+             f"add chain inet {NFT_TABLE} {chain} {{ type nat hook output priority -100; policy accept; }}",
+             f"flush chain inet {NFT_TABLE} {chain}",
+             f"delete chain inet {NFT_TABLE} {chain}"]
+    return '\n'.join(lines) + '\n'
+
+def dns_redirect_rules_live(uid, family='ipv4'):
+    """Return the nat OUTPUT REDIRECT rules for the exact UID."""
+    if not shutil.which(IPTABLES[family]):
+        return []
+    return [r for r in (list_rules(family, table='nat') or []) if matches_uid(r, uid) and 'REDIRECT' in r]
+
+def nft_dns_redirect_active(uid):
+    if not shutil.which('nft'):
+        return False
+    result = subprocess.run(['nft', 'list', 'chain', 'inet', NFT_TABLE, nft_dns_chain_name(uid)],
+                            capture_output=True, text=True)
+    return result.returncode == 0 and 'redirect' in result.stdout
+
+def dns_redirect_active(uid):
+    """Return True if the user's DNS traffic is redirected, by nat OUTPUT rules or the nft nat chain."""
+    return bool(dns_redirect_rules_live(uid)) or nft_dns_redirect_active(uid)
+
+def remove_dns_redirect(uid, verbose=False):
+    """Remove the user's DNS redirect, whichever backend added it."""
+    for family in FAMILIES:
+        for rule in dns_redirect_rules_live(uid, family):
+            subprocess.run([IPTABLES[family], '-t', 'nat', '-D', 'OUTPUT'] + rule, capture_output=True)
+    if nft_dns_redirect_active(uid):
+        nft_run(render_nft_dns_removal(uid), verbose=verbose)
+
+def apply_dns_redirect(uid, port, backend=DEFAULT_BACKEND, verbose=False):
+    """
+    Redirect the user's DNS traffic to the sinkhole listening on port: an nft nat chain with
+    the nft backend, nat OUTPUT rules for every other backend. Redirects to another port
+    are replaced. Returns True on success.
+    """
+    if resolve_backend(backend) == 'nft':
+        return nft_run(render_nft_dns_redirect(uid, port), verbose=verbose)
+    wanted = dns_redirect_rules(uid, port)
+    for family in FAMILIES:
+        if not shutil.which(IPTABLES[family]):
+            continue
+        for rule in dns_redirect_rules_live(uid, family):
+            # 'iptables -S' adds implicit '-m udp/tcp' matches, so only the target port is compared
+            if rule[rule.index('--to-ports') + 1:][:1] != [str(port)]:
+                subprocess.run([IPTABLES[family], '-t', 'nat', '-D', 'OUTPUT'] + rule, capture_output=True)
+        for rule in wanted:
+            if rule_exists(family, rule, table='nat'):
+                continue
+            result = subprocess.run([IPTABLES[family], '-t', 'nat', '-A', 'OUTPUT'] + rule, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"❌ {IPTABLES[family]} could not add the DNS redirect: {result.stderr.strip()}")
+                return False
+    if verbose:
+        print(f"[sinkhole] DNS traffic of UID {uid} redirected to port {port}")
+    return True
+
+def render_boot_scripts(uid, ruleset, backend=DEFAULT_BACKEND):
+    """
+    Render the scripts recreating a ruleset with one call per tool, keyed 'nft', 'ipset',
+    'ipv4' and 'ipv6' (iptables-restore format). The jump from OUTPUT is left out of the
+    chain scripts; apply_boot_scripts adds it when missing. Returns {} for the bpf backend,
+    whose maps are not loaded from a script.
+    """
+    backend = resolve_backend(backend)
+    if ruleset.get('mode') == 'allowlist':
+        backend = allowlist_backend(backend)
+        if backend == 'nft':
+            return {'nft': render_nft_allowlist(uid, ruleset['sets'], ruleset['nameservers'])}
+    elif backend == 'bpf':
+        return {}
+    elif backend == 'nft':
+        return {'nft': render_nft_apply(uid, ruleset['sets'], ruleset.get('early_accept'), ruleset.get('queue'),
+                                        ruleset.get('log'))}
+    scripts = {family: render_chain_restore(uid, ruleset['rules'][family], add_jump=False) for family in FAMILIES}
+    if backend == 'ipset':
+        scripts['ipset'] = render_ipset_restore(uid, ruleset['sets'])
+    return scripts
+
+def add_jump(uid, script):
+    """Add the user's jump from OUTPUT to a chain script rendered without it."""
+    return script.replace('\nCOMMIT\n', '\n' + ' '.join(['-A', 'OUTPUT'] + jump_rule(uid)) + '\nCOMMIT\n')
+
+def apply_boot_scripts(uid, scripts, verbose=False):
+    """
+    Load scripts rendered by render_boot_scripts: the address sets first, then the chains, with
+    the user's jump from OUTPUT added when it is missing. Returns True on success.
+    """
+    if 'ipset' in scripts:
+        if not shutil.which('ipset'):
+            return False
+        result = subprocess.run(['ipset', '-exist', 'restore'], input=scripts['ipset'], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"❌ ipset restore failed: {result.stderr.strip()}")
+            return False
+    if 'nft' in scripts and not (shutil.which('nft') and nft_run(scripts['nft'], verbose=verbose)):
+        return False
+    for family in FAMILIES:
+        if family not in scripts:
+            continue
+        if not shutil.which(RESTORE[family]):
+            return False
+        script = scripts[family]
+        if not rule_exists(family, jump_rule(uid)):
+            script = add_jump(uid, script)
+        if not restore(family, script, verbose=verbose):
+            return False
+    return True
+
+def rule_key(rule):
+    """Identity of a rule that does not depend on how 'iptables -S' formats it (e.g. '/32' suffixes)."""
+    if '--ctstate' in rule:
+        return ('conntrack',)
+    if 'NFLOG' in rule:
+        return ('log', rule[rule.index('--match-set') + 1] if '--match-set' in rule else None)
+    if '--match-set' in rule:
+        return ('set', rule[rule.index('--match-set') + 1])
+    if '--string' in rule:
+        proto = rule[rule.index('-p') + 1] if '-p' in rule else None
+        dport = rule[rule.index('--dport') + 1] if '--dport' in rule else None
+        return ('string', proto, dport, rule[rule.index('--string') + 1])
+    if '-d' in rule:
+        i = rule.index('-d')
+        rest = rule[:i] + rule[i + 2:]
+        # Drop the implicit '-m udp'/'-m tcp' that 'iptables -S' adds to port matches
+        rest = [t for j, t in enumerate(rest) if not (t == '-m' and rest[j + 1:j + 2] in (['udp'], ['tcp']))
+                and not (j and rest[j - 1] == '-m' and t in ('udp', 'tcp'))]
+        return ('addr', str(ipaddress.ip_network(rule[i + 1], strict=False))) + tuple(rest)
+    return ('rule', tuple(rule))
+
+def diff_rules(live, desired):
+    """
+    Compare the live rules of a chain with the desired ones.
+    Returns (missing, expired, duplicates): desired rules not live, live rules no longer desired,
+    and repeated live rules.
+    """
+    live_keys = {}
+    duplicates = []
+    for rule in live:
+        key = rule_key(rule)
+        if key in live_keys:
+            duplicates.append(rule)
+        else:
+            live_keys[key] = rule
+    desired_keys = {}
+    for rule in desired:
+        desired_keys.setdefault(rule_key(rule), rule)
+    missing = [rule for key, rule in desired_keys.items() if key not in live_keys]
+    expired = [rule for key, rule in live_keys.items() if key not in desired_keys]
+    return missing, expired, duplicates
+
+def _normalize_member(member):
+    return str(ipaddress.ip_network(member, strict=False))
+
+def ipset_members(uid):
+    """Return {family: set of members} of the user's ipsets, or None if one of them is missing."""
+    if not shutil.which('ipset'):
+        return None
+    members = {}
+    for family in FAMILIES:
+        result = subprocess.run(['ipset', 'list', set_name(uid, family)], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        lines = result.stdout.splitlines()
+        start = lines.index('Members:') + 1 if 'Members:' in lines else len(lines)
+        members[family] = {_normalize_member(line.split()[0]) for line in lines[start:] if line.strip()}
+    return members
+
+def _nft_intervals(value):
+    """Turn one element of 'nft -j list set' output into (first, last) integer intervals."""
+    if isinstance(value, dict) and 'elem' in value:
+        value = value['elem'].get('val')
+    if isinstance(value, str):
+        network = ipaddress.ip_network(value, strict=False)
+    elif isinstance(value, dict) and 'prefix' in value:
+        network = ipaddress.ip_network(f"{value['prefix']['addr']}/{value['prefix']['len']}", strict=False)
+    elif isinstance(value, dict) and 'range' in value:
+        first, last = value['range']
+        return [(int(ipaddress.ip_address(first)), int(ipaddress.ip_address(last)))]
+    else:
+        return []
+    return [(int(network.network_address), int(network.broadcast_address))]
+
+def nft_set_intervals(uid):
+    """Return {family: sorted [(first, last)]} for the user's nftables sets, or None if one is missing."""
+    if not shutil.which('nft') or not nft_chain_active(uid):
+        return None
+    intervals = {}
+    for family in FAMILIES:
+        result = subprocess.run(['nft', '-j', 'list', 'set', 'inet', NFT_TABLE, nft_set_name(uid, family)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        family_intervals = []
+        for item in json.loads(result.stdout).get('nftables', []):
+            for value in item.get('set', {}).get('elem', []):
+                family_intervals.extend(_nft_intervals(value))
+        intervals[family] = sorted(family_intervals)
+    return intervals
+
+def _covered(intervals, member):
+    """Return True if a member (address or network) lies inside one of the sorted intervals."""
+    network = ipaddress.ip_network(member, strict=False)
+    first, last = int(network.network_address), int(network.broadcast_address)
+    i = bisect.bisect_right(intervals, (first, float('inf'))) - 1
+    return i >= 0 and intervals[i][0] <= first and last <= intervals[i][1]
+
+def _apply_delta_nft(uid, ruleset, prune, verbose):
+    sets, early_accept, queue, log = ruleset['sets'], ruleset.get('early_accept'), ruleset.get('queue'), ruleset.get('log')
+    live = nft_set_intervals(uid)
+    if live is None:
+        return None
+    listing = nft_chain_listing(uid) or ''
+    if bool(early_accept) != ('ct state' in listing) or (queue is not None) != (' queue ' in listing) \
+            or (log is not None) != (' log ' in listing):
+        # The chain's fixed rules changed (conntrack shortcut, inspector or drop log); replace it as a whole
+        return None
+    stats = {'added': 0, 'removed': 0, 'total': 0}
+    lines = []
+    for family in FAMILIES:
+        members = sorted(set(sets.get(family, [])))
+        missing = [m for m in members if not _covered(live[family], m)]
+        if prune:
+            # An interval has expired when no wanted member starts inside it
+            starts = sorted(int(ipaddress.ip_network(m, strict=False).network_address) for m in members)
+            for first, last in live[family]:
+                i = bisect.bisect_left(starts, first)
+                if i == len(starts) or starts[i] > last:
+                    stats['removed'] += 1
+        name = nft_set_name(uid, family)
+        for i in range(0, len(missing), NFT_ELEMENTS_PER_LINE):
+            lines.append(f"add element inet {NFT_TABLE} {name} {{ {', '.join(missing[i:i + NFT_ELEMENTS_PER_LINE])} }}")
+        stats['added'] += len(missing)
+        stats['total'] += len(members)
+    if stats['removed']:
+        # Interval sets merge adjacent entries, so expired addresses are dropped by
+        # replacing the set contents in one transaction
+        return stats if nft_run(render_nft_apply(uid, sets, early_accept, queue, log), verbose=verbose) else False
+    if lines and not nft_run('\n'.join(lines) + '\n', verbose=verbose):
+        return False
+    return stats
+
+def _apply_delta_ipset(uid, sets, prune, verbose):
+    live = ipset_members(uid)
+    if live is None:
+        return None
+    stats = {'added': 0, 'removed': 0, 'total': 0}
+    lines = []
+    for family in FAMILIES:
+        name = set_name(uid, family)
+        members = {_normalize_member(m) for m in sets.get(family, [])}
+        missing = sorted(members - live[family])
+        lines.extend(f"add {name} {m} -exist" for m in missing)
+        stats['added'] += len(missing)
+        if prune:
+            expired = sorted(live[family] - members)
+            lines.extend(f"del {name} {m} -exist" for m in expired)
+            stats['removed'] += len(expired)
+        stats['total'] += len(members)
+    if lines:
+        result = subprocess.run(['ipset', 'restore'], input='\n'.join(lines) + '\n', capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"❌ ipset restore failed: {result.stderr.strip()}")
+            return False
+    return stats
+
+def _apply_delta_chain(uid, rules, backend, prune, verbose):
+    chain = chain_name(uid)
+    plans = {}
+    for family in FAMILIES:
+        live = list_rules(family, chain)
+        if live is None or not rule_exists(family, jump_rule(uid)):
+            return None
+        missing, expired, duplicates = diff_rules(live, rules[family])
+        if any(rule_key(rule) == ('conntrack',) or 'NFQUEUE' in rule or 'NFLOG' in rule for rule in missing):
+            # The conntrack shortcut has to come first, the drop log before its set match and the
+            # inspector queue last; replace the chain
+            return None
+        # New cheap matches go to the top of the chain (after the shortcut), payload matches to the end
+        top = str(2 if live and rule_key(live[0]) == ('conntrack',) else 1)
+        plans[family] = (top, [r for r in missing if not inspects_payload(r)], [r for r in missing if inspects_payload(r)],
+                         (expired if prune else []) + duplicates)
+    stats = {'added': 0, 'removed': 0, 'total': sum(len(r) for r in rules.values())}
+    for family, (top, insert, append, remove) in plans.items():
+        if not insert and not append and not remove:
+            continue
+        if backend == 'legacy':
+            for rule in remove:
+                subprocess.run([IPTABLES[family], '-D', chain] + rule, capture_output=True)
+            for rule in insert:
+                subprocess.run([IPTABLES[family], '-I', chain, top] + rule, capture_output=True)
+            for rule in append:
+                subprocess.run([IPTABLES[family], '-A', chain] + rule, capture_output=True)
+        else:
+            lines = ['*filter']
+            lines.extend(' '.join(['-D', chain] + [_quote(t) for t in rule]) for rule in remove)
+            lines.extend(' '.join(['-I', chain, top] + [_quote(t) for t in rule]) for rule in insert)
+            lines.extend(' '.join(['-A', chain] + [_quote(t) for t in rule]) for rule in append)
+            lines.append('COMMIT')
+            if not restore(family, '\n'.join(lines) + '\n', verbose=verbose):
+                return False
+        stats['added'] += len(insert) + len(append)
+        stats['removed'] += len(remove)
+    return stats
+
+def apply_delta(uid, ruleset, backend=DEFAULT_BACKEND, prune=False, verbose=False):
+    """
+    Bring the live ruleset in line with a ruleset built by build_ruleset by adding only what is
+    missing. Expired entries are removed when prune is set; duplicate rules always are, so the
+    rule count stays flat across runs. When the user has no live ruleset yet it is applied in full.
+    Returns {'added', 'removed', 'total'} counters, or None on failure.
+    """
+    backend = resolve_backend(backend)
+    if backend == 'restore' and not shutil.which(RESTORE['ipv4']):
+        backend = 'legacy'
+    if backend == 'bpf':
+        stats = update_maps(uid, ruleset['sets'], prune=prune, verbose=verbose) if attached(uid) else None
+    elif backend == 'nft':
+        stats = _apply_delta_nft(uid, ruleset, prune, verbose)
+    elif backend == 'ipset':
+        set_stats = _apply_delta_ipset(uid, ruleset['sets'], prune, verbose)
+        stats = set_stats and _apply_delta_chain(uid, ruleset['rules'], backend, prune, verbose)
+        if stats:
+            stats = {key: stats[key] + set_stats[key] for key in stats}
+    else:
+        stats = _apply_delta_chain(uid, ruleset['rules'], backend, prune, verbose)
+    if stats is False:
+        return None
+    if stats is None:
+        if not apply_ruleset(uid, ruleset, backend=backend, verbose=verbose):
+            return None
+        total = sum(len(r) for r in ruleset['rules'].values()) + sum(len(set(m)) for m in ruleset['sets'].values())
+        stats = {'added': total, 'removed': 0, 'total': total}
+    return stats
@@ -2,119 +2,466 @@
 Internet restriction utilities for contest-manager
 """
 
+import os
 import pwd
 import json
-import shlex
-import subprocess
-import dns.resolver
+import hashlib
 from pathlib import Path
+from contest_manager.utils.dns_resolver import (
+    DEFAULT_TIMEOUT, DEFAULT_WORKERS, build_resolver, resolve_record, resolve_many
+)
+from contest_manager.utils.ip_cache import (
+    DEFAULT_EVICT_AFTER, WILDCARD_PREFIX, load_cache, save_cache, cache_lock, lock_path, refresh_cache,
+    probe_wildcards, retain_negative, cache_ip_map
+)
+from contest_manager.utils.ip_index import index_path, open_index, close_index, iter_ip_map
+from contest_manager.utils.firewall import (
+    DEFAULT_BACKEND, LOG_BACKENDS, STRING_MATCH_BACKENDS, resolve_backend, build_ruleset, apply_ruleset, apply_delta, destroy_ipsets,
+    remove_user_chain, nft_remove, apply_dns_redirect, remove_dns_redirect, dns_redirect_active, allowlist_backend,
+    build_allowlist_ruleset, render_boot_scripts, apply_boot_scripts
+)
+from contest_manager.utils.domain_policy import (
+    ALLOW, WILDCARD, PolicySource, iter_blacklist, compile_policy, save_policy, load_policy, is_allowed, check
+)
+from contest_manager.utils.aggregation import load_aggregation_config, provider_prefixes, make_aggregator
+from contest_manager.utils.rule_optimizer import optimize_ruleset
+from contest_manager.utils.bpf_backend import remove_bpf
+from contest_manager.utils.dns_sinkhole import sinkhole_port, port_conflicts
+from contest_manager.utils.boot_ruleset import save_artifact, load_artifact, remove_artifact, apply_lock
+from contest_manager.utils.status_snapshot import collect_status
+from contest_manager.utils.allowlist import (
+    load_allowlist, system_nameservers, allowed_networks, save_allowlist_cache, load_allowlist_cache
+)
 
-def get_user_cache_path(user):
-    """Return the cache path for a user."""
+DEFAULT_SUBDOMAIN_PREFIXES = ["www", "mail", "drive", "chat", "api", "blog", "m", "app", "cdn", "static", "dev", "test"]
+IMPORTED_BLACKLIST_DIR = 'blacklist.d'
+ALLOWED_FIRST_LABELS = {'static', 'cdn', 'fonts'}
+
+def get_cache_dir():
+    """Return the cache directory, creating it if needed."""
     cache_dir = Path(__file__).parent.parent.parent / 'cache'
     cache_dir.mkdir(parents=True, exist_ok=True)
-    return cache_dir / f"ip_cache_{user}.json"
+    return cache_dir
 
-def get_targets_from_blacklist(blacklist_path):
-    """Read blacklist, filter domains, and generate targets."""
+def get_config_dir():
+    """Return the configuration directory."""
+    return Path(__file__).parent.parent.parent / 'config'
+
+def get_user_cache_path(user):
+    """Return the cache path for a user."""
+    return get_cache_dir() / f"ip_cache_{user}.json"
+
+def blacklist_digest(blacklist_path):
+    """Content hash of the blacklist, its imported lists and its subdomain expansion config."""
+    digest = hashlib.sha256()
+    paths = [Path(blacklist_path), Path(blacklist_path).parent / 'subdomains.txt']
+    paths += get_imported_blacklists(blacklist_path)
+    for path in paths:
+        if path.exists():
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+def get_shared_cache_path(blacklist_path):
+    """Return the cache path shared by all users restricted with the same blacklist."""
+    return get_cache_dir() / f"ip_cache_shared_{blacklist_digest(blacklist_path)}.json"
+
+def link_user_cache(user, shared_path):
+    """Point the user's cache at a shared cache file, so updates for any user refresh it for all."""
+    cache_path = get_user_cache_path(user)
+    if cache_path.is_symlink() or cache_path.exists():
+        cache_path.unlink()
+    cache_path.symlink_to(Path(shared_path).name)
+    return cache_path
+
+def prune_shared_caches():
+    """Delete shared cache files that no user cache points at any more."""
+    cache_dir = get_cache_dir()
+    in_use = {os.readlink(p) for p in cache_dir.glob('ip_cache_*.json') if p.is_symlink()}
+    for path in cache_dir.glob('ip_cache_shared_*.json'):
+        if path.name not in in_use:
+            path.unlink()
+            for extra_path in (index_path(path), lock_path(path)):
+                if extra_path.exists():
+                    extra_path.unlink()
+
+def get_blacklist_entries(blacklist_path):
+    """
+    Read blacklist and return the filtered list of domains to resolve.
+    Wildcard entries are returned as "*.<domain>"; exceptions are left out.
+    """
     if not Path(blacklist_path).exists():
         print(f"❌ Blacklist file {blacklist_path} not found.")
         return []
     domains = []
     with open(blacklist_path) as f:
+        for kind, domain, _ in iter_blacklist(f):
+            if kind == ALLOW or domain.split('.', 1)[0] in ALLOWED_FIRST_LABELS:
+                continue
+            domains.append(WILDCARD_PREFIX + domain if kind == WILDCARD else domain)
+    return domains
+
+def iter_policy_entries(blacklist_path):
+    """Yield (kind, domain, tags) for the blacklist and every imported list."""
+    if Path(blacklist_path).exists():
+        with open(blacklist_path) as f:
+            yield from iter_blacklist(f)
+    for path in get_imported_blacklists(blacklist_path):
+        with open(path) as f:
+            for kind, domain, tags in iter_blacklist(f):
+                yield kind, domain, [f"imported:{path.stem}"] + tags
+
+def get_domain_policy(blacklist_path):
+    """
+    Return the compiled suffix-trie policy for the blacklist.
+    The trie is cached on disk under the blacklist content hash and only rebuilt when it changes.
+    """
+    policy_path = get_cache_dir() / f"domain_policy_{blacklist_digest(blacklist_path)}.json"
+    policy = load_policy(policy_path)
+    if policy is None:
+        policy = compile_policy(iter_policy_entries(blacklist_path))
+        save_policy(policy, policy_path)
+        for old_path in get_cache_dir().glob('domain_policy_*.json'):
+            if old_path != policy_path:
+                old_path.unlink()
+    return policy
+
+def policy_stamp(blacklist_path):
+    """Cheap fingerprint (paths, mtimes and sizes) of the blacklist and its imported lists."""
+    imported_dir = Path(blacklist_path).parent / IMPORTED_BLACKLIST_DIR
+    stamp = []
+    for path in [Path(blacklist_path), imported_dir] + get_imported_blacklists(blacklist_path):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        stamp.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+def get_policy_source(blacklist_path):
+    """Return a PolicySource for long-running daemons: the policy is only recompiled when the lists change."""
+    return PolicySource(lambda: get_domain_policy(blacklist_path), lambda: policy_stamp(blacklist_path))
+
+def get_imported_blacklists(blacklist_path):
+    """Return the imported list files in the blacklist.d directory next to the blacklist."""
+    imported_dir = Path(blacklist_path).parent / IMPORTED_BLACKLIST_DIR
+    return sorted(imported_dir.glob('*.txt')) if imported_dir.is_dir() else []
+
+def iter_imported_entries(blacklist_path):
+    """Stream the domains of all imported lists (one normalised domain per line)."""
+    for path in get_imported_blacklists(blacklist_path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+
+def load_subdomain_prefixes(subdomains_path):
+    """
+    Read the subdomain prefixes to try per domain.
+    Each line is "<domain|default> prefix [prefix ...]"; "-" alone disables expansion.
+    Returns (default_prefixes, {domain: prefixes}).
+    """
+    default = list(DEFAULT_SUBDOMAIN_PREFIXES)
+    overrides = {}
+    if not Path(subdomains_path).exists():
+        return default, overrides
+    with open(subdomains_path) as f:
         for line in f:
-            line = line.strip()
-            if line and not line.startswith('#'):
-                domains.append(line)
-    if not domains:
-        print("⚠️  No domains found in blacklist. Skipping IP cache.")
-        return []
-    allow_patterns = ['static.', 'cdn.', 'fonts.']
-    targets = []
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            prefixes = [] if parts[1:] == ['-'] else parts[1:]
+            if parts[0] == 'default':
+                default = prefixes
+            else:
+                overrides[parts[0]] = prefixes
+    return default, overrides
+
+def expand_entries(domains, prefix_config, wildcards=()):
+    """
+    Map each blacklist domain to the names to resolve for it: the domain itself, its
+    wildcard probe and its configured subdomains. Wildcard domains answer every
+    subdomain alike, so their probe stands in for the per-prefix names; "*.<domain>"
+    entries are resolved through their probe alone.
+    """
+    default, overrides = prefix_config
+    entry_targets = {}
     for domain in domains:
-        if any(domain.startswith(p) for p in allow_patterns):
+        if domain.startswith(WILDCARD_PREFIX):
+            entry_targets[domain] = [domain]
             continue
-        targets.append(domain)
-        targets.extend(get_subdomains(domain))
+        targets = [domain, WILDCARD_PREFIX + domain]
+        if domain not in wildcards:
+            targets.extend(get_subdomains(domain, overrides.get(domain, default)))
+        entry_targets[domain] = targets
+    return entry_targets
+
+def get_blacklist_targets(blacklist_path, wildcards=()):
+    """
+    Read blacklist, filter domains, and map each entry to the targets it generates.
+    Imported lists are not expanded: each of their domains is resolved on its own.
+    Targets covered by an exception ("!domain") are dropped.
+    """
+    subdomains_path = Path(blacklist_path).parent / 'subdomains.txt'
+    entry_targets = expand_entries(get_blacklist_entries(blacklist_path),
+                                   load_subdomain_prefixes(subdomains_path), wildcards)
+    for domain in iter_imported_entries(blacklist_path):
+        entry_targets.setdefault(domain, [domain])
+    policy = get_domain_policy(blacklist_path)
+    for entry, targets in entry_targets.items():
+        entry_targets[entry] = [t for t in targets if t.startswith(WILDCARD_PREFIX) or not is_allowed(policy, t)]
+    return entry_targets
+
+def get_targets_from_blacklist(blacklist_path):
+    """Read blacklist, filter domains, and generate targets."""
+    targets = []
+    for entry_targets in get_blacklist_targets(blacklist_path).values():
+        targets.extend(t for t in entry_targets if not t.startswith(WILDCARD_PREFIX))
     return targets
 
-def resolve_targets_to_ip_map(targets, existing_ip_map=None):
-    """Resolve IPs for each target, optionally merging with an existing map."""
-    ip_map = existing_ip_map if existing_ip_map else {}
-    for target in targets:
-        new_ips = set(resolve_ips(target))
-        old_ips = set(ip_map.get(target, []))
-        ip_map[target] = list(old_ips.union(new_ips))
-    return ip_map
+def refresh_blacklist_cache(cache, blacklist_path, resolve, force=False, **refresh_options):
+    """
+    Probe blacklisted domains for wildcard DNS, then refresh the cache for the expanded targets.
+    Returns refresh_cache statistics, or None when the blacklist is empty.
+    """
+    domains = get_blacklist_entries(blacklist_path)
+    wildcards = probe_wildcards(cache, [d for d in domains if not d.startswith(WILDCARD_PREFIX)],
+                                resolve, force=force)
+    entry_targets = get_blacklist_targets(blacklist_path, wildcards)
+    if not entry_targets:
+        print("⚠️  No domains found in blacklist. Skipping IP cache.")
+        return None
+    stats = refresh_cache(cache, entry_targets, resolve, force=force, **refresh_options)
+    stats['wildcards'] = len(wildcards)
+    return stats
+
+def make_resolve_function(nameservers=None, timeout=DEFAULT_TIMEOUT, workers=DEFAULT_WORKERS, verbose=False,
+                          report=True):
+    """
+    Return a resolve(names) callable for ip_cache.refresh_cache.
+    nameservers, timeout (per query, seconds) and workers (concurrent queries) tune the resolver;
+    report=False leaves out the summary line printed for every call.
+    """
+    resolver = build_resolver(nameservers, timeout)
+    def resolve(names):
+        results, _ = resolve_many(names, resolver, workers=workers, verbose=verbose, report=report)
+        return results
+    return resolve
 
-def get_subdomains(domain):
+def get_subdomains(domain, prefixes=None):
     """Generate common subdomain names for a domain."""
-    common_subs = ["www", "mail", "drive", "chat", "api", "blog", "m", "app", "cdn", "static", "dev", "test"]
+    common_subs = DEFAULT_SUBDOMAIN_PREFIXES if prefixes is None else prefixes
     return [f"{sub}.{domain}" for sub in common_subs]
 
-def resolve_ips(domain):
+def resolve_ips(domain, resolver=None):
     """Resolve all IPv4 and IPv6 addresses for a domain and its subdomains."""
-    ips = set()
-    try:
-        answers = dns.resolver.resolve(domain, 'A')
-        for rdata in answers:
-            ips.add(str(rdata))
-    except Exception:
-        pass
-    try:
-        answers = dns.resolver.resolve(domain, 'AAAA')
-        for rdata in answers:
-            ips.add(str(rdata))
-    except Exception:
-        pass
-    return ips
+    return set(resolve_record(domain, resolver)['ips'])
 
-def update_ip_cache(user, blacklist_path, verbose=False):
+def update_ip_cache(user, blacklist_path, verbose=False, evict_after=DEFAULT_EVICT_AFTER,
+                    force=False, **resolve_options):
     """
-    Update the stored IP cache for the user by merging new IPs for all domains and subdomains.
-    Preserves old entries and adds new ones.
+    Update the stored IP cache for the user.
+    Only names from new or edited blacklist entries and records whose TTL has expired
+    are resolved again; addresses not seen for evict_after seconds are dropped.
+    resolve_options are passed on to make_resolve_function.
     """
     cache_path = get_user_cache_path(user)
     if verbose:
         print(f"[update_ip_cache] Updating IP cache from {blacklist_path} to {cache_path}")
-    ip_map = {}
-    if cache_path.exists():
-        with open(cache_path) as f:
-            try:
-                ip_map = json.load(f)
-            except Exception:
-                ip_map = {}
-    targets = get_targets_from_blacklist(blacklist_path)
-    if not targets:
-        return False, None
-    ip_map = resolve_targets_to_ip_map(targets, ip_map)
-    with open(cache_path, 'w') as f:
-        json.dump(ip_map, f, indent=2)
+    resolve = make_resolve_function(verbose=verbose, **resolve_options)
+    with cache_lock(cache_path):
+        cache = load_cache(cache_path)
+        stats = refresh_blacklist_cache(cache, blacklist_path, resolve, force=force, evict_after=evict_after)
+        if stats is None:
+            return False, None
+        save_cache(cache, cache_path)
+    print(f"♻️  {stats['resolved']} of {stats['names']} names refreshed, {stats['skipped']} still fresh "
+          f"({stats['negative_cached']} known not to exist), {stats['evicted_ips']} stale addresses evicted")
     if verbose:
         print(f"IP cache updated and saved to {cache_path}")
     return True, str(cache_path)
 
-def create_ip_cache(user, blacklist_path, verbose=False):
+def build_ip_cache(cache_path, blacklist_path, verbose=False, **resolve_options):
     """
-    Create a fresh IP cache for the user. Overwrites any previous cache.
+    Resolve the blacklist into a fresh cache at cache_path. Overwrites any previous cache, except
+    for names already known not to exist, which are not queried again until their negative TTL expires.
+    resolve_options are passed on to make_resolve_function.
     """
-    cache_path = get_user_cache_path(user)
     if verbose:
-        print(f"[create_ip_cache] Reading blacklist from {blacklist_path}")
-    targets = get_targets_from_blacklist(blacklist_path)
-    if not targets:
-        return False, None
-    ip_map = resolve_targets_to_ip_map(targets)
-    with open(cache_path, 'w') as f:
-        json.dump(ip_map, f, indent=2)
+        print(f"[build_ip_cache] Reading blacklist from {blacklist_path}")
+    resolve = make_resolve_function(verbose=verbose, **resolve_options)
+    with cache_lock(cache_path):
+        cache = retain_negative(load_cache(cache_path))
+        stats = refresh_blacklist_cache(cache, blacklist_path, resolve)
+        if stats is None:
+            return False, None
+        save_cache(cache, cache_path)
     if verbose:
+        print(f"{stats['wildcards']} wildcard domains, {stats['negative_cached']} names skipped as non-existent")
         print(f"IP cache created at {cache_path}")
     return True, str(cache_path)
 
-def apply_restrictions_from_cache(user, verbose=False):
+def create_ip_cache(user, blacklist_path, verbose=False, **resolve_options):
+    """
+    Create a fresh IP cache for the user. Overwrites any previous cache.
+    resolve_options are passed on to make_resolve_function.
+    """
+    cache_path = get_user_cache_path(user)
+    if cache_path.is_symlink():
+        # Detach from a shared cache instead of overwriting it for every user
+        cache_path.unlink()
+    return build_ip_cache(cache_path, blacklist_path, verbose=verbose, **resolve_options)
+
+def create_shared_ip_cache(users, blacklist_path, verbose=False, **resolve_options):
+    """
+    Resolve the blacklist once into a cache keyed by its content hash and link every
+    user's cache to it. Returns (success, shared cache path).
+    """
+    shared_path = get_shared_cache_path(blacklist_path)
+    success, _ = build_ip_cache(shared_path, blacklist_path, verbose=verbose, **resolve_options)
+    if not success:
+        return False, None
+    for user in users:
+        link_user_cache(user, shared_path)
+        if verbose:
+            print(f"Linked IP cache for user {user} to {shared_path}")
+    prune_shared_caches()
+    return True, str(shared_path)
+
+def load_ip_map(cache_path):
+    """
+    Yield (name, [ips]) pairs from a cache, reading the memory-mapped index when it is
+    up to date and falling back to the JSON cache otherwise.
+    """
+    idx_path = index_path(cache_path)
+    if idx_path.exists() and idx_path.stat().st_mtime >= Path(cache_path).stat().st_mtime:
+        index = open_index(idx_path)
+        if index is not None:
+            try:
+                yield from iter_ip_map(index)
+            finally:
+                close_index(index)
+            return
+    yield from cache_ip_map(load_cache(cache_path)).items()
+
+def get_allowlist_cache_path(user):
+    """Return the path of the user's resolved allowlist."""
+    return get_cache_dir() / f"allowlist_{user}.json"
+
+def get_boot_dir():
+    """Return the directory holding the precompiled boot rulesets."""
+    return get_cache_dir() / 'boot'
+
+def get_phase_dir(phase):
+    """Return the directory holding the staged rulesets of a scheduled phase."""
+    return get_cache_dir() / 'phases' / phase
+
+def get_user_state_path(user):
+    """Return the path of the file recording how a user was restricted."""
+    return get_cache_dir() / f"state_{user}.json"
+
+def load_user_state(user):
+    """Return the recorded restriction settings for a user (empty if none)."""
+    try:
+        with open(get_user_state_path(user)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_user_state(user, **settings):
+    """Record restriction settings for a user so boot and timer runs reuse them."""
+    state = load_user_state(user)
+    state.update(settings)
+    with open(get_user_state_path(user), 'w') as f:
+        json.dump(state, f, indent=2)
+
+def save_boot_ruleset(user, uid, ruleset, backend, verbose=False, mode='blacklist'):
+    """
+    Save the applied ruleset as the user's precompiled boot ruleset (nothing for the bpf backend).
+    Scheduled phases of the same mode are staged again with it, so a phase switch hours later
+    does not load a ruleset older than the cache.
+    """
+    scripts = render_boot_scripts(uid, ruleset, backend=backend)
+    if not scripts:
+        remove_artifact(get_boot_dir(), user)
+        return
+    save_artifact(get_boot_dir(), user, scripts)
+    if verbose:
+        print(f"[boot] {', '.join(sorted(scripts))} scripts saved to {get_boot_dir()}")
+    for phase, entry in (load_user_state(user).get('schedule') or {}).items():
+        if entry.get('mode') == mode:
+            save_artifact(get_phase_dir(phase), user, scripts)
+            if verbose:
+                print(f"[boot] {phase} phase staged again")
+
+def apply_boot_ruleset(user, verbose=False):
+    """
+    Load the user's precompiled boot ruleset with one call per tool. Returns False, without
+    changing anything, when there is no ruleset or a checksum does not match.
+    """
+    scripts = load_artifact(get_boot_dir(), user)
+    if scripts is None:
+        return False
+    try:
+        uid = pwd.getpwnam(user).pw_uid
+    except KeyError:
+        return False
+    state = load_user_state(user)
+    with apply_lock(get_boot_dir(), user):
+        if not apply_boot_scripts(uid, scripts, verbose=verbose):
+            return False
+        if state.get('sinkhole'):
+            apply_dns_redirect(uid, sinkhole_port(uid), backend=state.get('backend', DEFAULT_BACKEND), verbose=verbose)
+    print("✅ Internet restrictions applied for user from the boot ruleset.")
+    return True
+
+def build_user_ruleset(uid, cache_path, backend, verbose=False, inspector=False, sinkhole=False, log_drops=False):
+    """
+    Build the ruleset for a user from their cache. Addresses are collapsed into CIDR blocks,
+    widened and extended with provider ranges as configured in config/aggregation.txt, then
+    the rules go through the optimizer (deduplication, ordering, conntrack shortcut).
+    With inspector, DNS/TLS names are checked by the payload inspector instead of string matches;
+    with sinkhole, DNS is answered by the local sinkhole and needs no string matches;
+    with log_drops, dropped packets are sampled to the drop log.
+    """
+    config_dir = get_config_dir()
+    config = load_aggregation_config(config_dir / 'aggregation.txt')
+    ip_map = list(load_ip_map(cache_path))
+    extra = []
+    if config['providers']:
+        policy = get_domain_policy(config_dir / 'blacklist.txt')
+        extra = provider_prefixes(config, ip_map, lambda domain: check(policy, domain)[0])
+    stats = {}
+    ruleset = build_ruleset(uid, ip_map, backend=backend, aggregate=make_aggregator(config, extra, stats),
+                            inspector=inspector, sinkhole=sinkhole, log_drops=log_drops)
+    saved = stats['addresses'] - stats['networks']
+    print(f"🧮 {stats['addresses']} addresses aggregated into {stats['networks']} blocks "
+          f"({saved} rules/set entries saved)")
+    if verbose:
+        print(f"[aggregate] {stats['widened']} blocks widened, {stats['provider_prefixes']} provider prefixes added")
+    ruleset, stats = optimize_ruleset(ruleset)
+    print(f"🧹 Optimizer: {stats['before']} rules reduced to {stats['after']} "
+          f"({stats['duplicates']} duplicates, {stats['subsumed']} covered by a shorter name"
+          + (", conntrack shortcut added)" if stats['conntrack'] else ")"))
+    return ruleset
+
+def apply_restrictions_from_cache(user, verbose=False, backend=None, inspector=None, sinkhole=None, log_drops=None):
     """
     Apply iptables/ip6tables rules for all cached IPs for the user.
+    The ruleset is generated in memory and applied with the given backend, or the one
+    recorded when the user was restricted: 'nft' (one nftables transaction with interval
+    sets), 'restore' (one atomic iptables-restore transaction per family), 'ipset'
+    (addresses in per-family sets behind one rule) or 'legacy' (one iptables call per rule).
+    inspector (default: as recorded) hands DNS/TLS names to the payload inspector daemon, and
+    sinkhole (default: as recorded) redirects the user's DNS traffic to the local sinkhole, and
+    log_drops (default: as recorded) samples dropped packets to the drop log.
     """
+    state = load_user_state(user)
+    if state.get('mode') == 'allowlist':
+        return apply_allowlist_from_cache(user, verbose=verbose, backend=backend)
     cache_path = get_user_cache_path(user)
     if not Path(cache_path).exists():
         print(f"❌ IP cache file {cache_path} not found.")
@@ -124,95 +471,234 @@ def apply_restrictions_from_cache(user, verbose=False):
     except Exception:
         print(f"❌ User {user} not found.")
         return False
-    with open(cache_path) as f:
-        ip_map = json.load(f)
-    for target, ips in ip_map.items():
-        for ip in ips:
-            try:
-                if ':' in ip:
-                    subprocess.run(["ip6tables", "-A", "OUTPUT", "-d", ip, "-m", "owner", "--uid-owner", str(uid), "-j", "DROP"], check=True)
-                else:
-                    subprocess.run(["iptables", "-A", "OUTPUT", "-d", ip, "-m", "owner", "--uid-owner", str(uid), "-j", "DROP"], check=True)
-            except Exception:
-                pass
-        # Block DNS requests for the domain/subdomain
-        try:
-            subprocess.run(["iptables", "-A", "OUTPUT", "-p", "udp", "--dport", "53", "-m", "string", "--string", target, "--algo", "bm", "-m", "owner", "--uid-owner", str(uid), "-j", "DROP"], check=True)
-        except Exception:
-            pass
-        # Block DNS over HTTPS (DoH) for the domain/subdomain (TCP 443)
-        try:
-            subprocess.run(["iptables", "-A", "OUTPUT", "-p", "tcp", "--dport", "443", "-m", "string", "--string", target, "--algo", "bm", "-m", "owner", "--uid-owner", str(uid), "-j", "DROP"], check=True)
-            subprocess.run(["ip6tables", "-A", "OUTPUT", "-p", "tcp", "--dport", "443", "-m", "string", "--string", target, "--algo", "bm", "-m", "owner", "--uid-owner", str(uid), "-j", "DROP"], check=True)
-        except Exception:
-            pass
+    inspector = state.get('inspector', False) if inspector is None else inspector
+    sinkhole = state.get('sinkhole', False) if sinkhole is None else sinkhole
+    backend = resolve_backend(backend or state.get('backend', DEFAULT_BACKEND), inspector or sinkhole)
+    log_drops = state.get('log_drops', False) if log_drops is None else log_drops
+    ruleset = build_user_ruleset(uid, cache_path, backend, verbose=verbose, inspector=inspector, sinkhole=sinkhole,
+                                 log_drops=log_drops)
+    with apply_lock(get_boot_dir(), user):
+        if not apply_ruleset(uid, ruleset, backend=backend, verbose=verbose):
+            print(f"❌ Failed to apply internet restrictions for user {user}; no rules were changed.")
+            return False
+        if sinkhole and not apply_dns_redirect(uid, sinkhole_port(uid), backend=backend, verbose=verbose):
+            print(f"❌ Failed to redirect DNS traffic of user {user} to the sinkhole.")
+            return False
+        save_boot_ruleset(user, uid, ruleset, backend, verbose=verbose)
     if verbose:
-        print(f"Applied restrictions for user {user} from cache {cache_path}")
+        print(f"Applied {sum(len(r) for r in ruleset['rules'].values())} rules for user {user} from cache {cache_path}")
     print("✅ Internet restrictions applied for user from cache.")
     return True
 
-def restrict_internet(user, blacklist_path, verbose=False):
+def update_restrictions_from_cache(user, verbose=False, backend=None, prune=False, inspector=None, sinkhole=None,
+                                   log_drops=None):
+    """
+    Bring the live rules for the user in line with the cache without re-applying everything:
+    only addresses missing from the live ruleset are added, and addresses no longer cached are
+    removed when prune is set. Returns the add/remove counters, or None on failure.
+    """
+    cache_path = get_user_cache_path(user)
+    if not Path(cache_path).exists():
+        print(f"❌ IP cache file {cache_path} not found.")
+        return None
+    try:
+        uid = pwd.getpwnam(user).pw_uid
+    except Exception:
+        print(f"❌ User {user} not found.")
+        return None
+    state = load_user_state(user)
+    inspector = state.get('inspector', False) if inspector is None else inspector
+    sinkhole = state.get('sinkhole', False) if sinkhole is None else sinkhole
+    backend = resolve_backend(backend or state.get('backend', DEFAULT_BACKEND), inspector or sinkhole)
+    log_drops = state.get('log_drops', False) if log_drops is None else log_drops
+    ruleset = build_user_ruleset(uid, cache_path, backend, verbose=verbose, inspector=inspector, sinkhole=sinkhole,
+                                 log_drops=log_drops)
+    with apply_lock(get_boot_dir(), user):
+        # Saved before the delta, so the boot ruleset (and the tamper watcher) already expect it
+        save_boot_ruleset(user, uid, ruleset, backend, verbose=verbose)
+        stats = apply_delta(uid, ruleset, backend=backend, prune=prune, verbose=verbose)
+        if stats is not None and sinkhole and not dns_redirect_active(uid):
+            apply_dns_redirect(uid, sinkhole_port(uid), backend=backend, verbose=verbose)
+    if stats is None:
+        print(f"❌ Failed to update internet restrictions for user {user}.")
+        return None
+    print(f"➕ {stats['added']} added, ➖ {stats['removed']} removed, {stats['total']} rules and set entries in place")
+    return stats
+
+def warn_name_blocking(backend, inspector=False, sinkhole=False):
+    """Warn when neither the backend's string matches nor the inspector or sinkhole block names."""
+    if backend not in STRING_MATCH_BACKENDS and not (inspector or sinkhole):
+        print(f"⚠️  The {backend} backend has no string match: DNS/DoH name blocking is off, only addresses "
+              f"are blocked. Add --inspector or --sinkhole, or use --backend restore.")
+
+def drop_log_supported(backend, log_drops):
+    """Return log_drops, or False with a warning when the backend has no set match to log from."""
+    if log_drops and resolve_backend(backend) not in LOG_BACKENDS:
+        print(f"⚠️  --log-drops needs the {' or '.join(LOG_BACKENDS)} backend; blocked attempts will not be logged.")
+        return False
+    return log_drops
+
+def sinkhole_ports_free(users):
+    """
+    Return True if the users can have a sinkhole each: no two of them, or one of them and a user
+    already recorded with a sinkhole, would get the same port. Conflicts are printed.
+    """
+    owners = {}
+    for path in sorted(get_cache_dir().glob('state_*.json')):
+        other = path.stem[len('state_'):]
+        if other not in users and load_user_state(other).get('sinkhole'):
+            owners[other] = None
+    owners.update((user, None) for user in users)
+    for user in list(owners):
+        try:
+            owners[user] = pwd.getpwnam(user).pw_uid
+        except KeyError:
+            del owners[user]
+    conflicts = port_conflicts(owners.values())
+    for port, uids in sorted(conflicts.items()):
+        names = ', '.join(user for user, uid in sorted(owners.items()) if uid in uids)
+        print(f"❌ Users {names} would share sinkhole port {port} (UIDs {', '.join(map(str, uids))}); "
+              f"restrict only one of them with --sinkhole.")
+    return not conflicts
+
+def restrict_internet(user, blacklist_path, verbose=False, backend=DEFAULT_BACKEND, inspector=False, sinkhole=False,
+                      log_drops=False, **resolve_options):
     """
     Restrict internet access for the given user based on blacklist file.
     Uses create_ip_cache and apply_restrictions_from_cache.
     """
-    success, _ = create_ip_cache(user, blacklist_path, verbose=verbose)
+    if sinkhole and not sinkhole_ports_free([user]):
+        return False
+    success, _ = create_ip_cache(user, blacklist_path, verbose=verbose, **resolve_options)
+    if not success:
+        print("Failed to create IP cache. No restrictions applied.")
+        return False
+    backend = resolve_backend(backend, inspector or sinkhole)
+    warn_name_blocking(backend, inspector, sinkhole)
+    log_drops = drop_log_supported(backend, log_drops)
+    save_user_state(user, mode='blacklist', backend=backend, inspector=inspector, sinkhole=sinkhole, log_drops=log_drops)
+    return apply_restrictions_from_cache(user, verbose=verbose, backend=backend, inspector=inspector, sinkhole=sinkhole,
+                                         log_drops=log_drops)
+
+def restrict_internet_for_users(users, blacklist_path, verbose=False, backend=DEFAULT_BACKEND, inspector=False,
+                                sinkhole=False, log_drops=False, **resolve_options):
+    """
+    Restrict internet access for several users with a single resolution pass.
+    The blacklist is resolved once into a shared cache, then rules are applied per UID.
+    Returns True if restrictions were applied for every user.
+    """
+    if sinkhole and not sinkhole_ports_free(users):
+        return False
+    success, _ = create_shared_ip_cache(users, blacklist_path, verbose=verbose, **resolve_options)
     if not success:
         print("Failed to create IP cache. No restrictions applied.")
         return False
-    return apply_restrictions_from_cache(user, verbose=verbose)
+    backend = resolve_backend(backend, inspector or sinkhole)
+    warn_name_blocking(backend, inspector, sinkhole)
+    log_drops = drop_log_supported(backend, log_drops)
+    results = []
+    for user in users:
+        save_user_state(user, mode='blacklist', backend=backend, inspector=inspector, sinkhole=sinkhole,
+                        log_drops=log_drops)
+        results.append(apply_restrictions_from_cache(user, verbose=verbose, backend=backend, inspector=inspector,
+                                                     sinkhole=sinkhole, log_drops=log_drops))
+    return all(results)
+
+def update_allowlist_cache(user, allowlist_path, verbose=False, **resolve_options):
+    """
+    Resolve the hosts of the allowlist into the user's allowlist cache. A host that fails to
+    resolve keeps the addresses it had before. resolve_options are passed on to make_resolve_function.
+    Returns the number of allowed networks.
+    """
+    hosts, networks = load_allowlist(allowlist_path)
+    if not hosts and not networks:
+        print(f"⚠️  No entries found in {allowlist_path}; only loopback and DNS will be reachable.")
+    cache_path = get_allowlist_cache_path(user)
+    previous, _ = load_allowlist_cache(cache_path) or ({}, [])
+    resolved = {}
+    if hosts:
+        results = make_resolve_function(verbose=verbose, **resolve_options)(hosts)
+        for host in hosts:
+            resolved[host] = results.get(host, {}).get('ips') or previous.get(host, [])
+            if not resolved[host]:
+                print(f"⚠️  Allowlisted host {host} did not resolve; it stays unreachable.")
+    save_allowlist_cache(cache_path, resolved, networks)
+    allowed = allowed_networks(resolved, networks)
+    if verbose:
+        print(f"[allowlist] {len(hosts)} hosts and {len(networks)} networks give {len(allowed)} allowed blocks")
+    return len(allowed)
+
+def apply_allowlist_from_cache(user, verbose=False, backend=None):
+    """
+    Apply the default-deny rules for the user from their allowlist cache: loopback, established
+    flows, DNS to the system nameservers and the allowed destinations are accepted, the rest dropped.
+    """
+    cache = load_allowlist_cache(get_allowlist_cache_path(user))
+    if cache is None:
+        print(f"❌ Allowlist cache {get_allowlist_cache_path(user)} not found.")
+        return False
+    try:
+        uid = pwd.getpwnam(user).pw_uid
+    except Exception:
+        print(f"❌ User {user} not found.")
+        return False
+    backend = allowlist_backend(backend or load_user_state(user).get('backend', DEFAULT_BACKEND))
+    ruleset = build_allowlist_ruleset(uid, allowed_networks(*cache), system_nameservers(), backend=backend)
+    with apply_lock(get_boot_dir(), user):
+        if not apply_ruleset(uid, ruleset, backend=backend, verbose=verbose):
+            print(f"❌ Failed to apply the allowlist for user {user}; no rules were changed.")
+            return False
+        save_boot_ruleset(user, uid, ruleset, backend, verbose=verbose, mode='allowlist')
+    print("✅ Allowlist restrictions applied for user from cache.")
+    return True
+
+def restrict_internet_allowlist(user, allowlist_path, verbose=False, backend=DEFAULT_BACKEND, **resolve_options):
+    """
+    Restrict the user to the destinations in the allowlist (default-deny). Only the few listed
+    hosts are resolved, so this takes a fraction of the time of blacklist mode.
+    """
+    update_allowlist_cache(user, allowlist_path, verbose=verbose, **resolve_options)
+    backend = allowlist_backend(backend)
+    save_user_state(user, mode='allowlist', backend=backend, inspector=False, sinkhole=False, log_drops=False)
+    return apply_allowlist_from_cache(user, verbose=verbose, backend=backend)
+
+def get_restriction_mode(user):
+    """Return 'allowlist' or 'blacklist' as recorded for the user."""
+    return load_user_state(user).get('mode', 'blacklist')
 
 def unrestrict_internet(user, blacklist_path, verbose=False):
     """
-    Remove all iptables/ip6tables OUTPUT rules for the given user UID.
-    This flushes any network restrictions for the user, regardless of origin or type.
+    Remove all firewall rules for the given user UID, whichever backend applied them.
+    The jump from OUTPUT and the user's CONTEST-<uid> chain are removed in one transaction per
+    family, along with any OUTPUT rules for the exact UID left by older versions; the user's
+    nftables chain and sets go in a single nft transaction. The DNS redirect to the sinkhole goes as well.
     """
-    print(f"🔓 Flushing all iptables/ip6tables OUTPUT rules for user: {user}")
+    print(f"🔓 Removing firewall rules for user: {user}")
     try:
         uid = pwd.getpwnam(user).pw_uid
     except Exception:
         print(f"❌ User {user} not found.")
         return
-    tables = ["iptables", "ip6tables"]
-    for table in tables:
-        # List all rules in OUTPUT chain
-        result = subprocess.run([table, "-L", "OUTPUT", "--line-numbers", "-n", "-v"], capture_output=True, text=True)
-        lines = result.stdout.splitlines()
-        # Find line numbers for rules with --uid-owner <uid>
-        rule_lines = []
-        for line in lines:
-            if f"--uid-owner {uid}" in line:
-                parts = line.strip().split()
-                if parts and parts[0].isdigit():
-                    rule_lines.append(int(parts[0]))
-        # Delete rules from bottom to top
-        for line_num in sorted(rule_lines, reverse=True):
-            del_cmd = [table, "-D", "OUTPUT", str(line_num)]
-            del_result = subprocess.run(del_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if del_result.returncode == 0:
-                print(f"[{table}] Deleted OUTPUT rule at line {line_num} for UID {uid}")
-        if not rule_lines:
-            print(f"[{table}] No OUTPUT rules for UID {uid} found.")
-    print(f"✅ All iptables/ip6tables OUTPUT rules for user UID {uid} fully removed.")
+    remove_user_chain(uid, verbose=verbose)
+    # The set match rules are gone, so the user's address sets can be destroyed
+    destroy_ipsets(uid)
+    nft_remove(uid, verbose=verbose)
+    remove_bpf(uid, verbose=verbose)
+    remove_dns_redirect(uid, verbose=verbose)
+    remove_artifact(get_boot_dir(), user)
+    print(f"✅ All firewall rules for user UID {uid} fully removed.")
 
 
 def internet_restriction_check(user):
     """
-    Check if internet restriction is applied for the given user (any iptables/ip6tables OUTPUT DROP rules for UID).
-    Returns True if any such rule exists, False otherwise.
+    Check if internet restriction is applied for the given user, from a single firewall snapshot
+    (see status_snapshot): the user's CONTEST-<uid> chain holds rules and OUTPUT jumps to it, the
+    user's nftables chain holds rules, the eBPF program is attached, or (for rules applied by older
+    versions) OUTPUT holds a DROP rule for the UID.
     """
     try:
         uid = pwd.getpwnam(user).pw_uid
     except Exception:
         print(f"❌ User {user} not found.")
         return False
-    for table in ["iptables", "ip6tables"]:
-        try:
-            result = subprocess.run([table, "-S", "OUTPUT"], capture_output=True, text=True)
-            rules = result.stdout.splitlines()
-            for rule in rules:
-                if f"-m owner --uid-owner {uid}" in rule and "-j DROP" in rule:
-                    return True
-        except Exception:
-            pass
-    return False
\ No newline at end of file
+    return collect_status([(user, uid)])[0]['active']
@@ -0,0 +1,248 @@
+"""
+TTL-aware IP cache for contest-manager
+
+Cache layout (version 2):
+    {
+      "version": 2,
+      "entries": {"<blacklist entry>": "<content hash>"},
+      "records": {
+        "<name>": {"status": "ok", "ttl": 300, "resolved_at": 1700000000,
+                   "ips": {"<address>": <last seen timestamp>}}
+      }
+    }
+
+A record named "*.<domain>" holds the answer to a wildcard probe of <domain>
+(a query for a random label under it).
+"""
+
+import json
+import time
+import secrets
+import hashlib
+from pathlib import Path
+from contest_manager.utils.utils import file_lock, atomic_write
+from contest_manager.utils.ip_index import index_path, write_index
+
+CACHE_VERSION = 2
+MIN_TTL = 60
+DEFAULT_NEGATIVE_TTL = 3600
+DEFAULT_EVICT_AFTER = 24 * 3600
+WILDCARD_PREFIX = '*.'
+NEGATIVE_STATUSES = ('nxdomain', 'nodata')
+
+def new_cache():
+    """Return an empty cache in the current format."""
+    return {'version': CACHE_VERSION, 'entries': {}, 'records': {}}
+
+def load_cache(cache_path):
+    """
+    Load a cache file, migrating the legacy plain domain -> IP list format.
+    Migrated records are marked as never resolved so they are refreshed on the next run.
+    """
+    if not Path(cache_path).exists():
+        return new_cache()
+    try:
+        with open(cache_path) as f:
+            data = json.load(f)
+    except Exception:
+        return new_cache()
+    if isinstance(data, dict) and data.get('version') == CACHE_VERSION:
+        return data
+    cache = new_cache()
+    now = int(time.time())
+    if isinstance(data, dict):
+        for name, ips in data.items():
+            if isinstance(ips, list):
+                cache['records'][name] = {
+                    'status': 'ok' if ips else 'nodata', 'ttl': None, 'resolved_at': 0,
+                    'ips': {ip: now for ip in ips},
+                }
+    return cache
+
+def lock_path(cache_path):
+    """Return the lock file guarding a cache file (shared caches are followed)."""
+    cache_path = Path(cache_path).resolve()
+    return cache_path.with_name(cache_path.name + '.lock')
+
+def cache_lock(cache_path):
+    """
+    Exclusive lock on a cache file. Hold it around load -> modify -> save, so users and
+    daemons sharing a cache never lose each other's updates.
+    """
+    return file_lock(lock_path(cache_path))
+
+def save_cache(cache, cache_path):
+    """
+    Write the cache atomically so a crash never leaves a truncated file behind.
+    A symlinked (shared) cache is written through to its target, and the compact
+    IP index next to it is rebuilt.
+    """
+    cache_path = Path(cache_path).resolve()
+    with atomic_write(cache_path) as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    write_index(cache_ip_map(cache), index_path(cache_path))
+
+def merge_cache(cache, other):
+    """
+    Fold the answers of other into cache and return cache. cache decides which names and
+    entries are kept; a record other resolved more recently replaces cache's, and addresses
+    seen by either keep their latest timestamp.
+    """
+    records = cache['records']
+    for name, record in other['records'].items():
+        if name not in records:
+            continue
+        ips = dict(records[name]['ips'])
+        for ip, seen in record['ips'].items():
+            ips[ip] = max(seen, ips.get(ip, 0))
+        if record.get('resolved_at', 0) > records[name].get('resolved_at', 0):
+            records[name] = dict(record)
+        records[name]['ips'] = ips
+    return cache
+
+def entry_hash(entry, targets):
+    """Content hash of a blacklist entry together with the names it expands to."""
+    digest = hashlib.sha256()
+    digest.update(entry.encode())
+    for target in sorted(targets):
+        digest.update(b'\0' + target.encode())
+    return digest.hexdigest()[:16]
+
+def record_expiry(record):
+    """Return the time at which a record has to be resolved again (0 if it never was)."""
+    if not record.get('resolved_at'):
+        return 0
+    ttl = record.get('ttl')
+    if ttl is None:
+        ttl = DEFAULT_NEGATIVE_TTL if record.get('status') in NEGATIVE_STATUSES else MIN_TTL
+    return record['resolved_at'] + max(ttl, MIN_TTL)
+
+def record_expired(record, now):
+    """Return True when a record is older than its TTL (or was never resolved)."""
+    return record_expiry(record) <= now
+
+def resolve_into_cache(cache, names, resolve, now):
+    """
+    Resolve names and store the answers in the cache.
+    Wildcard names ("*.<domain>") are queried through a random label under <domain>.
+    Failed lookups keep the previous answer so they are retried on the next run.
+    """
+    records = cache['records']
+    queries = {}
+    for name in names:
+        if name.startswith(WILDCARD_PREFIX):
+            queries[f"{secrets.token_hex(8)}.{name[len(WILDCARD_PREFIX):]}"] = name
+        else:
+            queries[name] = name
+    results = resolve(sorted(queries)) if queries else {}
+    for query, result in results.items():
+        record = records.setdefault(queries[query], {'status': None, 'ttl': None, 'resolved_at': 0, 'ips': {}})
+        if result['status'] in ('timeout', 'error'):
+            continue
+        record['status'] = result['status']
+        record['ttl'] = result.get('ttl')
+        record['resolved_at'] = now
+        for ip in result['ips']:
+            record['ips'][ip] = now
+
+def probe_wildcards(cache, domains, resolve, force=False, now=None):
+    """
+    Find the domains that answer for any subdomain (wildcard DNS).
+    Probe answers are cached as "*.<domain>" records and only re-probed once expired.
+    Returns the set of wildcard domains.
+    """
+    now = int(now if now is not None else time.time())
+    records = cache['records']
+    due = []
+    for domain in domains:
+        name = WILDCARD_PREFIX + domain
+        if force or name not in records or record_expired(records[name], now):
+            due.append(name)
+    resolve_into_cache(cache, due, resolve, now)
+    return {domain for domain in domains
+            if records.get(WILDCARD_PREFIX + domain, {}).get('status') == 'ok'}
+
+def retain_negative(cache):
+    """
+    Return a new cache keeping only the negative (NXDOMAIN/NODATA) records of an old one.
+    Entry hashes are kept as well, so unchanged entries do not force those names to be re-resolved.
+    """
+    fresh = new_cache()
+    fresh['entries'] = dict(cache.get('entries', {}))
+    for name, record in cache['records'].items():
+        if record.get('status') in NEGATIVE_STATUSES and not record['ips']:
+            fresh['records'][name] = record
+    return fresh
+
+def refresh_cache(cache, entry_targets, resolve, evict_after=DEFAULT_EVICT_AFTER, force=False, now=None):
+    """
+    Bring the cache up to date with the blacklist.
+
+    entry_targets maps each blacklist entry to the names it expands to, and
+    resolve(names) must return {name: record} as produced by dns_resolver.resolve_many.
+    Only names from new or edited entries and expired records are resolved; records
+    of removed entries are dropped and addresses unseen for evict_after seconds are evicted.
+    Returns a dict of counters describing the work done.
+    """
+    now = int(now if now is not None else time.time())
+    records = cache['records']
+    old_entries = cache.get('entries', {})
+    new_entries = {entry: entry_hash(entry, targets) for entry, targets in entry_targets.items()}
+    changed = [entry for entry, digest in new_entries.items() if old_entries.get(entry) != digest]
+    wanted = set()
+    for targets in entry_targets.values():
+        wanted.update(targets)
+
+    due = set()
+    for entry in changed:
+        due.update(entry_targets[entry])
+    for name in wanted:
+        if force or name not in records or record_expired(records[name], now):
+            due.add(name)
+
+    skipped = wanted - due
+    stats = {
+        'names': len(wanted), 'resolved': len(due), 'skipped': len(skipped),
+        'negative_cached': sum(1 for name in skipped if records[name].get('status') in NEGATIVE_STATUSES),
+        'changed_entries': len(changed), 'removed_entries': len(set(old_entries) - set(new_entries)),
+        'removed_names': 0, 'evicted_ips': 0,
+    }
+    for name in list(records):
+        if name not in wanted:
+            del records[name]
+            stats['removed_names'] += 1
+
+    resolve_into_cache(cache, due, resolve, now)
+
+    stats['evicted_ips'] = evict_stale(cache, evict_after, now)
+
+    cache['version'] = CACHE_VERSION
+    cache['entries'] = new_entries
+    return stats
+
+def evict_stale(cache, evict_after=DEFAULT_EVICT_AFTER, now=None):
+    """Drop addresses not seen in an answer for evict_after seconds. Returns how many were dropped."""
+    now = int(now if now is not None else time.time())
+    evicted = 0
+    for record in cache['records'].values():
+        stale = [ip for ip, seen in record['ips'].items() if now - seen > evict_after]
+        for ip in stale:
+            del record['ips'][ip]
+        evicted += len(stale)
+    return evicted
+
+def cache_ip_map(cache):
+    """
+    Return the cache as a plain {name: [ips]} map for rule generation.
+    Wildcard probe answers are folded into their domain and names that do not exist are left out.
+    """
+    ip_map = {}
+    for name, record in cache['records'].items():
+        if name.startswith(WILDCARD_PREFIX):
+            if record['ips']:
+                ip_map.setdefault(name[len(WILDCARD_PREFIX):], set()).update(record['ips'])
+            continue
+        if record.get('status') == 'nxdomain' and not record['ips']:
+            continue
+        ip_map.setdefault(name, set()).update(record['ips'])
+    return {name: sorted(ips) for name, ips in ip_map.items()}
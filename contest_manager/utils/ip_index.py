@@ -0,0 +1,170 @@
+"""
+Compact, memory-mappable IP index for contest-manager
+
+The index is written next to each IP cache and answers "which names resolve to this
+address?" and "which addresses does this name have?" without loading the cache.
+
+File layout (little-endian):
+    header   MAGIC, version, counts and section offsets (HEADER)
+    names    one NAME_ENTRY per name, sorted by name:
+             string offset, string length, first link, link count
+    strings  UTF-8 names, concatenated
+    ipv4     one V4_ENTRY per (address, name) pair, sorted: address (big-endian), name id
+    ipv6     one V6_ENTRY per (address, name) pair, sorted: address (16 bytes), name id
+    links    one LINK_ENTRY per (name, address) pair, grouped by name: family (4/6), array position
+"""
+
+import mmap
+import struct
+import ipaddress
+from pathlib import Path
+from collections import namedtuple
+from contest_manager.utils.utils import atomic_write
+
+MAGIC = b'CMIX'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIIIIIIII')
+NAME_ENTRY = struct.Struct('<IIII')
+V4_ENTRY = struct.Struct('>4sI')
+V6_ENTRY = struct.Struct('>16sI')
+LINK_ENTRY = struct.Struct('<II')
+
+Index = namedtuple('Index', 'mm n_names n_v4 n_v6 names_off strings_off v4_off v6_off links_off')
+
+def index_path(cache_path):
+    """Return the index path belonging to a cache file (shared caches are followed)."""
+    return Path(cache_path).resolve().with_suffix('.idx')
+
+def write_index(ip_map, path):
+    """Build the index for an {name: [ips]} map and write it atomically to path."""
+    names = sorted(ip_map)
+    name_ids = {name: i for i, name in enumerate(names)}
+    v4, v6 = [], []
+    for name in names:
+        for ip in ip_map[name]:
+            addr = ipaddress.ip_address(ip)
+            (v4 if addr.version == 4 else v6).append((addr.packed, name_ids[name]))
+    v4.sort()
+    v6.sort()
+    links = [[] for _ in names]
+    for family, entries in ((4, v4), (6, v6)):
+        for pos, (_, name_id) in enumerate(entries):
+            links[name_id].append((family, pos))
+
+    strings = bytearray()
+    name_table = bytearray()
+    link_table = bytearray()
+    n_links = 0
+    for name_id, name in enumerate(names):
+        encoded = name.encode()
+        name_table += NAME_ENTRY.pack(len(strings), len(encoded), n_links, len(links[name_id]))
+        strings += encoded
+        for family, pos in links[name_id]:
+            link_table += LINK_ENTRY.pack(family, pos)
+        n_links += len(links[name_id])
+
+    names_off = HEADER.size
+    strings_off = names_off + len(name_table)
+    v4_off = strings_off + len(strings)
+    v6_off = v4_off + len(v4) * V4_ENTRY.size
+    links_off = v6_off + len(v6) * V6_ENTRY.size
+    with atomic_write(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(names), len(v4), len(v6), n_links,
+                            names_off, strings_off, v4_off, v6_off, links_off))
+        f.write(name_table)
+        f.write(strings)
+        for packed, name_id in v4:
+            f.write(V4_ENTRY.pack(packed, name_id))
+        for packed, name_id in v6:
+            f.write(V6_ENTRY.pack(packed, name_id))
+        f.write(link_table)
+
+def open_index(path):
+    """Memory-map an index file. Returns None if it is missing or not a valid index."""
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mm) < HEADER.size:
+        mm.close()
+        return None
+    magic, version, n_names, n_v4, n_v6, _, names_off, strings_off, v4_off, v6_off, links_off = \
+        HEADER.unpack_from(mm, 0)
+    if magic != MAGIC or version != VERSION:
+        mm.close()
+        return None
+    return Index(mm, n_names, n_v4, n_v6, names_off, strings_off, v4_off, v6_off, links_off)
+
+def close_index(index):
+    index.mm.close()
+
+def _name(index, name_id):
+    str_off, str_len, _, _ = NAME_ENTRY.unpack_from(index.mm, index.names_off + name_id * NAME_ENTRY.size)
+    start = index.strings_off + str_off
+    return index.mm[start:start + str_len].decode()
+
+def _address(index, family, pos):
+    if family == 4:
+        packed, _ = V4_ENTRY.unpack_from(index.mm, index.v4_off + pos * V4_ENTRY.size)
+    else:
+        packed, _ = V6_ENTRY.unpack_from(index.mm, index.v6_off + pos * V6_ENTRY.size)
+    return str(ipaddress.ip_address(packed))
+
+def _find_name(index, name):
+    """Binary search the sorted name table. Returns the name id or None."""
+    lo, hi = 0, index.n_names
+    while lo < hi:
+        mid = (lo + hi) // 2
+        current = _name(index, mid)
+        if current < name:
+            lo = mid + 1
+        elif current > name:
+            hi = mid
+        else:
+            return mid
+    return None
+
+def lookup_ip(index, ip):
+    """Return the sorted names an address was resolved from."""
+    addr = ipaddress.ip_address(ip)
+    if addr.version == 4:
+        entry, base, count = V4_ENTRY, index.v4_off, index.n_v4
+    else:
+        entry, base, count = V6_ENTRY, index.v6_off, index.n_v6
+    key = addr.packed
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if entry.unpack_from(index.mm, base + mid * entry.size)[0] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    names = []
+    while lo < count:
+        packed, name_id = entry.unpack_from(index.mm, base + lo * entry.size)
+        if packed != key:
+            break
+        names.append(_name(index, name_id))
+        lo += 1
+    return sorted(names)
+
+def _addresses(index, name_id):
+    _, _, first, count = NAME_ENTRY.unpack_from(index.mm, index.names_off + name_id * NAME_ENTRY.size)
+    addresses = []
+    for i in range(first, first + count):
+        family, pos = LINK_ENTRY.unpack_from(index.mm, index.links_off + i * LINK_ENTRY.size)
+        addresses.append(_address(index, family, pos))
+    return addresses
+
+def lookup_name(index, name):
+    """Return the addresses of a name, or None if the name is not in the index."""
+    name_id = _find_name(index, name)
+    if name_id is None:
+        return None
+    return _addresses(index, name_id)
+
+def iter_ip_map(index):
+    """Yield (name, [ips]) for every name in the index, in name order."""
+    for name_id in range(index.n_names):
+        yield _name(index, name_id), _addresses(index, name_id)
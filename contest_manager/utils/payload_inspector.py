@@ -0,0 +1,239 @@
+"""
+NFQUEUE payload inspector for contest-manager
+
+Replaces the per-domain '-m string' rules with a single NFQUEUE rule per family that hands the
+first QUEUE_PACKETS packets of every flow of a restricted user to this daemon. The daemon reads
+the DNS query name (UDP or TCP port 53) or the TLS ClientHello server name (TCP port 443),
+checks it against the suffix-trie domain policy and decides once per flow: later packets of a
+decided flow reuse the verdict, and packets after the window never leave the kernel.
+
+The netfilterqueue Python package is needed to run the daemon; the parsers below are plain
+Python and work on raw IP packets.
+"""
+
+import struct
+import threading
+import ipaddress
+from collections import OrderedDict
+from contest_manager.utils.domain_policy import check
+
+# Packets of a flow that go through the payload checks (queue window, and the conntrack shortcut after it)
+QUEUE_PACKETS = 10
+FLOW_CACHE_SIZE = 65536
+MAX_HELLO_BYTES = 16384
+POLICY_CHECK_INTERVAL = 5
+DNS_PORT = 53
+TLS_PORT = 443
+PROTO_TCP = 6
+PROTO_UDP = 17
+ACCEPT = 'accept'
+DROP = 'drop'
+
+def queue_number(uid):
+    """NFQUEUE number used for a user's flows."""
+    return uid & 0xffff
+
+def parse_ip_packet(packet):
+    """
+    Split a raw IPv4/IPv6 packet into (proto, src, sport, dst, dport, payload).
+    Returns None for packets that are not TCP/UDP or are truncated. IPv6 extension headers are not followed.
+    """
+    if not packet:
+        return None
+    version = packet[0] >> 4
+    if version == 4:
+        if len(packet) < 20:
+            return None
+        header_len = (packet[0] & 0x0f) * 4
+        proto = packet[9]
+        src, dst = packet[12:16], packet[16:20]
+    elif version == 6:
+        if len(packet) < 40:
+            return None
+        header_len = 40
+        proto = packet[6]
+        src, dst = packet[8:24], packet[24:40]
+    else:
+        return None
+    segment = packet[header_len:]
+    if proto == PROTO_UDP and len(segment) >= 8:
+        sport, dport = struct.unpack('!HH', segment[:4])
+        payload = segment[8:]
+    elif proto == PROTO_TCP and len(segment) >= 20:
+        sport, dport = struct.unpack('!HH', segment[:4])
+        payload = segment[(segment[12] >> 4) * 4:]
+    else:
+        return None
+    return proto, ipaddress.ip_address(bytes(src)), sport, ipaddress.ip_address(bytes(dst)), dport, bytes(payload)
+
+def parse_dns_qname(payload):
+    """Return the query name of a DNS request, or None if the payload is not one."""
+    if len(payload) < 12 or payload[2] & 0x80 or struct.unpack('!H', payload[4:6])[0] == 0:
+        return None
+    labels = []
+    pos = 12
+    while pos < len(payload):
+        length = payload[pos]
+        if length == 0:
+            return '.'.join(labels).lower() if labels else None
+        if length & 0xc0 or pos + 1 + length > len(payload):
+            return None
+        labels.append(payload[pos + 1:pos + 1 + length].decode('ascii', 'replace'))
+        pos += 1 + length
+    return None
+
+def parse_tls_sni(data):
+    """
+    Return (complete, server_name) for the start of a TLS stream. complete is False while
+    the ClientHello is still cut short, so the caller should wait for more data.
+    """
+    if len(data) < 5:
+        return False, None
+    if data[0] != 0x16:
+        return True, None
+    record_len = struct.unpack('!H', data[3:5])[0]
+    hello = data[5:5 + record_len]
+    if len(hello) < 4:
+        return len(data) >= 5 + record_len, None
+    if hello[0] != 0x01:
+        return True, None
+    # Skip handshake header (4), client version (2) and random (32)
+    pos = 4 + 2 + 32
+    try:
+        pos += 1 + hello[pos]
+        pos += 2 + struct.unpack('!H', hello[pos:pos + 2])[0]
+        pos += 1 + hello[pos]
+        end = pos + 2 + struct.unpack('!H', hello[pos:pos + 2])[0]
+        pos += 2
+        while pos + 4 <= min(end, len(hello)):
+            ext_type, ext_len = struct.unpack('!HH', hello[pos:pos + 4])
+            pos += 4
+            if ext_type == 0:
+                if pos + ext_len > len(hello):
+                    break
+                # server_name_list length (2), name type (1), name length (2), name
+                name_len = struct.unpack('!H', hello[pos + 3:pos + 5])[0]
+                return True, hello[pos + 5:pos + 5 + name_len].decode('ascii', 'replace').lower()
+            pos += ext_len
+    except (IndexError, struct.error):
+        pass
+    # No server name yet: complete only once the whole record has arrived
+    return len(data) >= 5 + record_len, None
+
+class FlowTable:
+    """Bounded table of per-flow verdicts and partial TLS ClientHellos."""
+
+    def __init__(self, size=FLOW_CACHE_SIZE):
+        self.size = size
+        self.verdicts = OrderedDict()
+        self.buffers = {}
+
+    def get(self, flow):
+        verdict = self.verdicts.get(flow)
+        if verdict is not None:
+            self.verdicts.move_to_end(flow)
+        return verdict
+
+    def set(self, flow, verdict):
+        self.buffers.pop(flow, None)
+        self.verdicts[flow] = verdict
+        self.verdicts.move_to_end(flow)
+        while len(self.verdicts) > self.size:
+            self.verdicts.popitem(last=False)
+
+    def append(self, flow, payload):
+        data = self.buffers.get(flow, b'') + payload
+        if len(self.buffers) >= self.size:
+            self.buffers.clear()
+        self.buffers[flow] = data[:MAX_HELLO_BYTES]
+        return self.buffers[flow]
+
+def inspect_packet(packet, policy, flows):
+    """
+    Decide the verdict for one queued packet. Returns (verdict, hostname or None).
+    Packets without a hostname to check are accepted; the verdict of a flow is decided
+    by its first DNS query or TLS server name and reused for the rest of the flow.
+    """
+    parsed = parse_ip_packet(packet)
+    if parsed is None:
+        return ACCEPT, None
+    proto, src, sport, dst, dport, payload = parsed
+    flow = (proto, src, sport, dst, dport)
+    verdict = flows.get(flow)
+    if verdict is not None:
+        return verdict, None
+    if not payload:
+        return ACCEPT, None
+    hostname = None
+    if dport == DNS_PORT:
+        hostname = parse_dns_qname(payload[2:] if proto == PROTO_TCP else payload)
+    elif dport == TLS_PORT and proto == PROTO_TCP:
+        complete, hostname = parse_tls_sni(flows.append(flow, payload))
+        if not complete:
+            return ACCEPT, None
+    if hostname is None:
+        flows.set(flow, ACCEPT)
+        return ACCEPT, None
+    blocked, _ = check(policy, hostname)
+    verdict = DROP if blocked else ACCEPT
+    # DNS queries share the flow of the resolver's socket; decide them one by one
+    if dport != DNS_PORT:
+        flows.set(flow, verdict)
+    return verdict, hostname
+
+def watch_policy(source, stop, interval=POLICY_CHECK_INTERVAL, verbose=False):
+    """
+    Refresh a PolicySource every interval seconds in a background thread until stop is set,
+    so recompiling large lists never holds up queued packets. A failed rebuild keeps the old policy.
+    """
+    def watch():
+        while not stop.wait(interval):
+            try:
+                if source.refresh() and verbose:
+                    print(f"[inspector] policy reloaded ({source.policy['entries']} entries)")
+            except Exception as e:
+                print(f"⚠️  Could not reload the domain policy: {e}")
+    thread = threading.Thread(target=watch, name='policy-watch', daemon=True)
+    thread.start()
+    return thread
+
+def run_inspector(queue_num, policy_source, verbose=False):
+    """
+    Serve an NFQUEUE until interrupted. policy_source (a domain_policy.PolicySource) holds the
+    domain policy; a background thread checks every POLICY_CHECK_INTERVAL seconds whether the
+    lists changed and swaps in the rebuilt policy, so blacklist edits take effect.
+    Returns False if the netfilterqueue package is missing.
+    """
+    try:
+        from netfilterqueue import NetfilterQueue
+    except ImportError:
+        print("❌ The netfilterqueue Python package is required: pip install NetfilterQueue")
+        return False
+    flows = FlowTable()
+    state = {'dropped': 0, 'seen': 0}
+    stop = threading.Event()
+    watch_policy(policy_source, stop, verbose=verbose)
+
+    def handle(pkt):
+        verdict, hostname = inspect_packet(pkt.get_payload(), policy_source.policy, flows)
+        state['seen'] += 1
+        if verdict == DROP:
+            state['dropped'] += 1
+            pkt.drop()
+        else:
+            pkt.accept()
+        if verbose and hostname:
+            print(f"[inspector] {hostname}: {verdict}")
+
+    queue = NetfilterQueue()
+    queue.bind(queue_num, handle)
+    print(f"🔍 Inspecting queue {queue_num} (Ctrl+C to stop)")
+    try:
+        queue.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        queue.unbind()
+        print(f"Inspected {state['seen']} packets, dropped {state['dropped']}.")
+    return True
@@ -1,20 +1,28 @@
 import subprocess
 from pathlib import Path
 
-def start_persistence(user):
+DAEMON_SERVICE = 'contest-daemon.service'
+
+def start_persistence(user, inspector=False, sinkhole=False, log_drops=False):
     """
-    Set up systemd service and timer to persist contest restrictions for the given user.
-    Uses global contest-manager CLI commands for start-restriction and update-restriction.
+    Set up systemd services to persist contest restrictions for the given user.
+    Uses global contest-manager CLI commands for start-restriction, daemon and watch. The
+    enforcement daemon is a single service serving every persisted user (see install_daemon).
+    With inspector, a service running the payload inspector for the user is added as well,
+    with sinkhole one running the user's DNS sinkhole, and with log_drops one counting the
+    user's blocked attempts.
     """
     systemd_dir = Path('/etc/systemd/system')
     cli_cmd = 'contest-manager'
 
-    # Service to run start-restriction at boot
+    # Service to run start-restriction at boot, before any network interface is configured
     start_service = f"""
 [Unit]
 Description=Contest Start Restriction for user {user}
 DefaultDependencies=no
-After=basic.target
+After=local-fs.target
+Wants=network-pre.target
+Before=network-pre.target
 
 [Service]
 Type=oneshot
@@ -28,77 +36,275 @@ WantedBy=multi-user.target
     with open(start_service_path, 'w') as f:
         f.write(start_service)
 
-    # Service to run update-restriction
-    update_service = f"""
+    # The daemon replaces the update-restriction timer and the per-user daemon of earlier versions
+    remove_update_timer(user)
+
+    # Service putting back rules, the USB rule or the boot ruleset as soon as they are removed
+    watch_service = f"""
 [Unit]
-Description=Contest Update Restriction for user {user}
-DefaultDependencies=no
-After=basic.target
+Description=Contest Tamper Watcher for user {user}
+After=contest-start-restriction-{user}.service
 
 [Service]
-Type=oneshot
-ExecStart=contest-manager update-restriction {user}
+ExecStart=contest-manager watch {user}
+Restart=always
+RestartSec=1
+
+[Install]
+WantedBy=multi-user.target
 """
-    update_service_path = systemd_dir / f"contest-update-restriction-{user}.service"
-    with open(update_service_path, 'w') as f:
-        f.write(update_service)
+    watch_service_path = systemd_dir / f"contest-watch-{user}.service"
+    with open(watch_service_path, 'w') as f:
+        f.write(watch_service)
 
-    # Timer to run update-restriction every 30 minutes
-    update_timer = f"""
+    if inspector:
+        # Service running the payload inspector; its queue rule fails open while it is down
+        inspector_service = f"""
 [Unit]
-Description=Contest Update Restriction Timer for user {user}
+Description=Contest Payload Inspector for user {user}
 
-[Timer]
-OnBootSec=5min
-OnUnitActiveSec=30min
-Unit=contest-update-restriction-{user}.service
+[Service]
+ExecStart=contest-manager inspector {user}
+Restart=always
+RestartSec=1
 
 [Install]
-WantedBy=timers.target
+WantedBy=multi-user.target
+"""
+        inspector_service_path = systemd_dir / f"contest-inspector-{user}.service"
+        with open(inspector_service_path, 'w') as f:
+            f.write(inspector_service)
+
+    if sinkhole:
+        # Service running the DNS sinkhole the user's port-53 traffic is redirected to
+        sinkhole_service = f"""
+[Unit]
+Description=Contest DNS Sinkhole for user {user}
+After=network.target
+
+[Service]
+ExecStart=contest-manager sinkhole {user}
+Restart=always
+RestartSec=1
+
+[Install]
+WantedBy=multi-user.target
 """
-    update_timer_path = systemd_dir / f"contest-update-restriction-{user}.timer"
-    with open(update_timer_path, 'w') as f:
-        f.write(update_timer)
+        sinkhole_service_path = systemd_dir / f"contest-sinkhole-{user}.service"
+        with open(sinkhole_service_path, 'w') as f:
+            f.write(sinkhole_service)
+
+    if log_drops:
+        # Service counting the blocked attempts logged by the user's NFLOG rules
+        drop_log_service = f"""
+[Unit]
+Description=Contest Blocked-Attempt Log for user {user}
+
+[Service]
+ExecStart=contest-manager drop-log {user}
+Restart=always
+RestartSec=1
+Nice=10
+
+[Install]
+WantedBy=multi-user.target
+"""
+        drop_log_service_path = systemd_dir / f"contest-drop-log-{user}.service"
+        with open(drop_log_service_path, 'w') as f:
+            f.write(drop_log_service)
 
     # Reload systemd and enable/start units
     subprocess.run(['systemctl', 'daemon-reload'], check=True)
+    if inspector:
+        subprocess.run(['systemctl', 'enable', '--now', f'contest-inspector-{user}.service'], check=True)
+    if sinkhole:
+        subprocess.run(['systemctl', 'enable', '--now', f'contest-sinkhole-{user}.service'], check=True)
+    if log_drops:
+        subprocess.run(['systemctl', 'enable', '--now', f'contest-drop-log-{user}.service'], check=True)
     subprocess.run(['systemctl', 'enable', f'contest-start-restriction-{user}.service'], check=True)
     subprocess.run(['systemctl', 'start', f'contest-start-restriction-{user}.service'], check=True)
-    subprocess.run(['systemctl', 'enable', f'contest-update-restriction-{user}.timer'], check=True)
-    subprocess.run(['systemctl', 'start', f'contest-update-restriction-{user}.timer'], check=True)
+    subprocess.run(['systemctl', 'enable', '--now', f'contest-watch-{user}.service'], check=True)
+    install_daemon()
     # Disable ufw to prevent interference with iptables rules
     try:
         subprocess.run(['systemctl', 'disable', '--now', 'ufw'], check=True)
         print("✅ ufw disabled to ensure contest restrictions are enforced.")
     except Exception as e:
         print(f"⚠️  Could not disable ufw automatically: {e}\nPlease run: sudo systemctl disable --now ufw")
-    print(f"✅ Persistence enabled: start-restriction at boot, update-restriction every 30 min for user {user}")
+    print(f"✅ Persistence enabled: start-restriction at boot, enforcement daemon and tamper watcher for user {user}")
 
 
 def remove_persistence(user):
     """
-    Remove systemd service and timer for contest restrictions for the given user.
+    Remove the systemd services for contest restrictions for the given user.
     """
     systemd_dir = Path('/etc/systemd/system')
     start_service_path = systemd_dir / f"contest-start-restriction-{user}.service"
-    update_service_path = systemd_dir / f"contest-update-restriction-{user}.service"
-    update_timer_path = systemd_dir / f"contest-update-restriction-{user}.timer"
-
-    # Stop and disable units
-    subprocess.run(['systemctl', 'stop', f'contest-update-restriction-{user}.timer'], check=False)
-    subprocess.run(['systemctl', 'disable', f'contest-update-restriction-{user}.timer'], check=False)
-    subprocess.run(['systemctl', 'stop', f'contest-update-restriction-{user}.service'], check=False)
-    subprocess.run(['systemctl', 'disable', f'contest-update-restriction-{user}.service'], check=False)
+    inspector_service_path = systemd_dir / f"contest-inspector-{user}.service"
+    sinkhole_service_path = systemd_dir / f"contest-sinkhole-{user}.service"
+    watch_service_path = systemd_dir / f"contest-watch-{user}.service"
+    drop_log_service_path = systemd_dir / f"contest-drop-log-{user}.service"
+
+    # Stop and disable units; the watcher first, so it does not put back what is being removed
+    subprocess.run(['systemctl', 'disable', '--now', f'contest-watch-{user}.service'], check=False)
+    subprocess.run(['systemctl', 'disable', '--now', f'contest-inspector-{user}.service'], check=False)
+    subprocess.run(['systemctl', 'disable', '--now', f'contest-sinkhole-{user}.service'], check=False)
+    subprocess.run(['systemctl', 'disable', '--now', f'contest-drop-log-{user}.service'], check=False)
+    remove_update_timer(user)
     subprocess.run(['systemctl', 'stop', f'contest-start-restriction-{user}.service'], check=False)
     subprocess.run(['systemctl', 'disable', f'contest-start-restriction-{user}.service'], check=False)
 
     # Remove unit files
-    for path in [start_service_path, update_service_path, update_timer_path]:
+    for path in [start_service_path, inspector_service_path, sinkhole_service_path,
+                 watch_service_path, drop_log_service_path]:
         try:
             path.unlink()
         except FileNotFoundError:
             pass
 
-    # Reload systemd
+    # Reload systemd; the daemon goes on serving the remaining users
     subprocess.run(['systemctl', 'daemon-reload'], check=True)
-    print(f"✅ Persistence removed for user {user}")
\ No newline at end of file
+    install_daemon()
+    print(f"✅ Persistence removed for user {user}")
+
+def stop_services(user):
+    """
+    Stop the user's tamper watcher and the enforcement daemon before restrictions are replaced
+    on purpose, so neither puts back or overwrites what is being changed (start_persistence restarts them).
+    """
+    for unit in (f'contest-watch-{user}.service', DAEMON_SERVICE):
+        subprocess.run(['systemctl', 'stop', unit], check=False, capture_output=True)
+
+def persisted_users():
+    """Return the users whose boot service is installed, in name order."""
+    prefix, suffix = 'contest-start-restriction-', '.service'
+    return sorted(path.name[len(prefix):-len(suffix)]
+                  for path in Path('/etc/systemd/system').glob(f'{prefix}*{suffix}'))
+
+def install_daemon():
+    """
+    Install the single enforcement daemon serving every persisted user, or remove it when
+    there is none left. One process shares each cache's queue between the users built from it,
+    instead of one daemon per user resolving the same names and overwriting each other's saves.
+    The service is restarted only when its user list changed, and started otherwise.
+    """
+    systemd_dir = Path('/etc/systemd/system')
+    service_path = systemd_dir / DAEMON_SERVICE
+    # Per-user daemons of earlier versions
+    for path in sorted(systemd_dir.glob('contest-daemon-*.service')):
+        subprocess.run(['systemctl', 'disable', '--now', path.name], check=False, capture_output=True)
+        path.unlink()
+    users = persisted_users()
+    if not users:
+        if service_path.exists():
+            subprocess.run(['systemctl', 'disable', '--now', DAEMON_SERVICE], check=False)
+            service_path.unlink()
+            subprocess.run(['systemctl', 'daemon-reload'], check=True)
+        return
+
+    # Enforcement daemon: keeps the IP caches in memory and refreshes names as their TTLs expire
+    daemon_service = f"""
+[Unit]
+Description=Contest Enforcement Daemon for {', '.join(users)}
+After={' '.join(f'contest-start-restriction-{user}.service' for user in users)} network-online.target
+Wants=network-online.target
+
+[Service]
+ExecStart=contest-manager daemon {' '.join(users)}
+Restart=always
+RestartSec=5
+Nice=10
+
+[Install]
+WantedBy=multi-user.target
+"""
+    try:
+        changed = service_path.read_text() != daemon_service
+    except OSError:
+        changed = True
+    if changed:
+        with open(service_path, 'w') as f:
+            f.write(daemon_service)
+        subprocess.run(['systemctl', 'daemon-reload'], check=True)
+    subprocess.run(['systemctl', 'enable', DAEMON_SERVICE], check=True)
+    subprocess.run(['systemctl', 'restart' if changed else 'start', DAEMON_SERVICE], check=True)
+
+def remove_update_timer(user):
+    """Remove the update-restriction timer and service installed by earlier versions, if present."""
+    systemd_dir = Path('/etc/systemd/system')
+    for unit in (f'contest-update-restriction-{user}.timer', f'contest-update-restriction-{user}.service'):
+        if (systemd_dir / unit).exists():
+            subprocess.run(['systemctl', 'disable', '--now', unit], check=False, capture_output=True)
+            (systemd_dir / unit).unlink()
+
+def persistence_enabled(user):
+    """Return True if the boot service for the user's restrictions is installed."""
+    return (Path('/etc/systemd/system') / f"contest-start-restriction-{user}.service").exists()
+
+
+def phase_unit_name(phase, at):
+    """Name of the timer/service pair switching to a phase at a time ('YYYY-MM-DD HH:MM:SS')."""
+    return f"contest-phase-{phase}-{at.replace('-', '').replace(':', '').replace(' ', 'T')}"
+
+def schedule_phase_timers(groups):
+    """
+    Install the contest phase timers, replacing all earlier ones. groups maps (phase,
+    'YYYY-MM-DD HH:MM:SS') to the users switching then; each pair gets one timer running
+    'schedule --apply-phase' for all of them, so the users are switched one after the other
+    by a single process instead of by concurrent ones racing for the xtables lock.
+    Timers are persistent, so a machine that was off at a boundary catches up at boot.
+    """
+    systemd_dir = Path('/etc/systemd/system')
+    remove_phase_timers(reload=False)
+    for (phase, at), users in sorted(groups.items()):
+        name = phase_unit_name(phase, at)
+        phase_service = f"""
+[Unit]
+Description=Contest {phase} phase for {', '.join(users)}
+DefaultDependencies=no
+After=local-fs.target
+
+[Service]
+Type=oneshot
+ExecStart=contest-manager schedule --apply-phase {phase} {' '.join(users)}
+"""
+        with open(systemd_dir / f"{name}.service", 'w') as f:
+            f.write(phase_service)
+
+        # AccuracySec=1s: the default accuracy of one minute would spread the switch over the lab
+        phase_timer = f"""
+[Unit]
+Description=Contest {phase} phase timer
+
+[Timer]
+OnCalendar={at}
+AccuracySec=1s
+Persistent=true
+Unit={name}.service
+
+[Install]
+WantedBy=timers.target
+"""
+        with open(systemd_dir / f"{name}.timer", 'w') as f:
+            f.write(phase_timer)
+
+    subprocess.run(['systemctl', 'daemon-reload'], check=True)
+    for phase, at in sorted(groups):
+        subprocess.run(['systemctl', 'enable', '--now', f'{phase_unit_name(phase, at)}.timer'], check=True)
+    print(f"✅ {len(groups)} phase timers installed")
+
+
+def remove_phase_timers(reload=True):
+    """Remove every contest phase timer and service (including the per-user ones of earlier versions)."""
+    systemd_dir = Path('/etc/systemd/system')
+    units = sorted(systemd_dir.glob('contest-phase-*'))
+    for path in units:
+        if path.suffix == '.timer':
+            subprocess.run(['systemctl', 'disable', '--now', path.name], check=False)
+    for path in units:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+    if reload:
+        subprocess.run(['systemctl', 'daemon-reload'], check=True)
@@ -0,0 +1,309 @@
+"""
+Enforcement daemon for contest-manager
+
+One long-running process keeps the restricted users' IP caches fresh instead of a timer
+starting update-restriction every 30 minutes. The cache is loaded once and kept in memory,
+and every cached name is queued by the time its answer expires (its TTL, or the negative
+TTL for names that do not exist) plus some jitter, so the lab does not query in lockstep:
+
+    name       re-resolve the names that are due (and those due within COALESCE seconds) in one
+               batch, at most max_queries at a time; failures are retried with a growing delay
+    apply      bring the kernel in line with the cache (apply_delta), only queued when an answer
+               brought a new address
+    blacklist  re-read the blacklist when its content hash changes; only new or edited entries
+               are resolved
+    evict      drop addresses unseen for evict_after seconds (removed from the kernel with prune)
+    save       write the cache back to disk, so boot and status see the refreshed answers
+    allowlist  re-resolve an allowlist-mode user's hosts every ALLOWLIST_INTERVAL
+
+Users sharing a cache (restrict --all) share its queue, so persistence runs one daemon for
+all users. When another command rewrites a cache, answers not saved yet are merged into it. Modes are read from the user state at
+every step, so a scheduled phase switch between blacklist and allowlist is followed.
+"""
+
+import sys
+import time
+import heapq
+import random
+import signal
+import itertools
+from contest_manager.utils.ip_cache import (
+    DEFAULT_EVICT_AFTER, MIN_TTL, load_cache, save_cache, cache_lock, merge_cache, record_expiry, resolve_into_cache,
+    evict_stale
+)
+from contest_manager.utils.allowlist import load_allowlist_cache, allowed_networks
+from contest_manager.utils.internet_handler import (
+    get_user_cache_path, get_allowlist_cache_path, get_restriction_mode, blacklist_digest, refresh_blacklist_cache,
+    make_resolve_function, update_restrictions_from_cache, update_allowlist_cache, apply_allowlist_from_cache
+)
+
+DEFAULT_MAX_QUERIES = 16
+DEFAULT_JITTER = 0.1
+COALESCE = 5
+APPLY_DELAY = 2
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 900
+BLACKLIST_CHECK_INTERVAL = 30
+ALLOWLIST_INTERVAL = 1800
+EVICT_INTERVAL = 3600
+SAVE_INTERVAL = 300
+
+class Scheduler:
+    """Priority queue of tasks keyed by due time. Pushing a task again replaces its earlier due time."""
+
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.counter = itertools.count()
+
+    def push(self, task, due):
+        self.due[task] = due
+        heapq.heappush(self.heap, (due, next(self.counter), task))
+
+    def push_once(self, task, due):
+        """Queue a task unless it is already queued to run earlier."""
+        if task not in self.due or self.due[task] > due:
+            self.push(task, due)
+
+    def next_due(self):
+        # Entries whose task was pushed again since are skipped here
+        while self.heap and self.due.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """Remove and return the tasks due at or before now, earliest first."""
+        tasks = []
+        while True:
+            due = self.next_due()
+            if due is None or due > now:
+                return tasks
+            task = heapq.heappop(self.heap)[2]
+            del self.due[task]
+            tasks.append(task)
+
+    def __len__(self):
+        return len(self.due)
+
+class CacheGroup:
+    """A cache file held in memory and the users whose rules are built from it."""
+
+    def __init__(self, cache_path, users):
+        self.cache_path = cache_path
+        self.users = users
+        self.cache = None
+        self.mtime = None
+        self.digest = None
+        self.failures = {}
+        self.dirty = False
+
+    def reload(self):
+        """
+        Load the cache file; returns False if there is none (yet). Answers resolved here and not
+        saved yet are merged into it rather than dropped, and stay to be saved.
+        """
+        try:
+            self.mtime = self.cache_path.stat().st_mtime
+        except OSError:
+            return False
+        cache = load_cache(self.cache_path)
+        if self.dirty and self.cache is not None:
+            cache = merge_cache(cache, self.cache)
+        self.cache = cache
+        self.digest = None
+        return True
+
+    def changed_on_disk(self):
+        """Return True if another command (restrict, update-restriction) rewrote the cache file."""
+        try:
+            return self.cache_path.stat().st_mtime != self.mtime
+        except OSError:
+            return False
+
+    def save(self):
+        """
+        Write the cache under its lock. When another command rewrote the file since it was
+        loaded, its names are kept and the answers resolved here since are merged in.
+        """
+        if not self.dirty:
+            return
+        with cache_lock(self.cache_path):
+            if self.changed_on_disk():
+                self.cache = merge_cache(load_cache(self.cache_path), self.cache)
+                # The blacklist is checked again, so names the other command added get queued
+                self.digest = None
+            save_cache(self.cache, self.cache_path)
+            self.mtime = self.cache_path.stat().st_mtime
+        self.dirty = False
+
+class RefreshDaemon:
+    def __init__(self, users, blacklist_path, allowlist_path, max_queries=DEFAULT_MAX_QUERIES, jitter=DEFAULT_JITTER,
+                 evict_after=DEFAULT_EVICT_AFTER, prune=False, verbose=False, **resolve_options):
+        self.blacklist_path = blacklist_path
+        self.allowlist_path = allowlist_path
+        self.jitter = jitter
+        self.evict_after = evict_after
+        self.prune = prune
+        self.verbose = verbose
+        self.resolve_options = dict(resolve_options, workers=max_queries)
+        self.resolve = make_resolve_function(verbose=verbose, report=verbose, **self.resolve_options)
+        self.scheduler = Scheduler()
+        self.users = [user for user, _ in users]
+        groups = {}
+        for user in self.users:
+            groups.setdefault(get_user_cache_path(user).resolve(), []).append(user)
+        self.groups = [CacheGroup(path, group_users) for path, group_users in groups.items()]
+
+    def _spread(self, seconds):
+        return random.uniform(0, self.jitter * seconds)
+
+    def schedule_name(self, index, name, now):
+        record = self.groups[index].cache['records'][name]
+        expiry = record_expiry(record)
+        lifetime = max(MIN_TTL, expiry - record.get('resolved_at', 0)) if expiry else MIN_TTL
+        self.scheduler.push(('name', index, name), max(expiry, now) + self._spread(lifetime))
+
+    def schedule_all(self, index, now):
+        for name in self.groups[index].cache['records']:
+            self.schedule_name(index, name, now)
+
+    def start(self):
+        """Catch up with the blacklist and queue every cached name and periodic task."""
+        now = time.time()
+        for index in range(len(self.groups)):
+            self.check_blacklist(index, now)
+            self.scheduler.push(('evict', index), now + EVICT_INTERVAL)
+            self.scheduler.push(('save', index), now + SAVE_INTERVAL)
+        for user in self.users:
+            self.scheduler.push(('allowlist', user), now + self._spread(ALLOWLIST_INTERVAL))
+
+    def check_blacklist(self, index, now):
+        """
+        Refresh the cache for new or edited blacklist entries, and for every expired name the
+        first time. The cache is (re)loaded first when it appeared or was rewritten by another command.
+        """
+        group = self.groups[index]
+        self.scheduler.push(('blacklist', index), now + BLACKLIST_CHECK_INTERVAL)
+        if (group.cache is None or group.changed_on_disk()) and not group.reload():
+            return
+        digest = blacklist_digest(self.blacklist_path)
+        if digest == group.digest:
+            return
+        first = group.digest is None
+        group.digest = digest
+        before = _address_count(group.cache)
+        stats = refresh_blacklist_cache(group.cache, self.blacklist_path, self.resolve, evict_after=self.evict_after)
+        if stats is None:
+            return
+        if not first:
+            print(f"📝 Blacklist changed: {stats['changed_entries']} entries added or edited, "
+                  f"{stats['removed_entries']} removed, {stats['resolved']} names resolved", flush=True)
+        group.dirty = True
+        self.schedule_all(index, now)
+        if stats['removed_names'] or stats['evicted_ips'] or _address_count(group.cache) != before:
+            self.queue_apply(index, now, prune=bool(stats['removed_names']))
+
+    def queue_apply(self, index, now, prune=False):
+        self.scheduler.push_once(('apply', index, prune and self.prune), now + APPLY_DELAY)
+
+    def refresh_names(self, index, names, now):
+        """Re-resolve due names in one batch; queue a kernel update if an answer brought a new address."""
+        group = self.groups[index]
+        records = group.cache['records']
+        names = [name for name in names if name in records]
+        if not names:
+            return
+        known = {name: set(records[name]['ips']) for name in names}
+        resolve_into_cache(group.cache, names, self.resolve, int(now))
+        group.dirty = True
+        changed = 0
+        for name in names:
+            record = records[name]
+            if record.get('resolved_at') != int(now):
+                # Failed lookups keep their answer and are retried later, backing off
+                failures = group.failures.get(name, 0) + 1
+                group.failures[name] = failures
+                self.scheduler.push(('name', index, name), now + min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY))
+                continue
+            group.failures.pop(name, None)
+            changed += bool(set(record['ips']) - known[name])
+            self.schedule_name(index, name, now)
+        if self.verbose:
+            print(f"[daemon] {len(names)} names refreshed, {changed} with new addresses", flush=True)
+        if changed:
+            self.queue_apply(index, now)
+
+    def apply(self, index, prune):
+        """Write the cache and bring the kernel in line with it for the blacklist-mode users."""
+        group = self.groups[index]
+        group.save()
+        for user in group.users:
+            if get_restriction_mode(user) == 'blacklist':
+                update_restrictions_from_cache(user, verbose=self.verbose, prune=prune)
+
+    def refresh_allowlist(self, user, now):
+        """Re-resolve an allowlist-mode user's hosts; the rules are only reloaded when the allowed blocks change."""
+        if get_restriction_mode(user) == 'allowlist':
+            before = load_allowlist_cache(get_allowlist_cache_path(user))
+            update_allowlist_cache(user, self.allowlist_path, verbose=self.verbose, **self.resolve_options)
+            after = load_allowlist_cache(get_allowlist_cache_path(user))
+            if before is None or allowed_networks(*before) != allowed_networks(*after):
+                apply_allowlist_from_cache(user, verbose=self.verbose)
+        self.scheduler.push(('allowlist', user), now + ALLOWLIST_INTERVAL)
+
+    def run_due(self, now):
+        """Run every task due now, resolving names due within COALESCE seconds in the same batch."""
+        batches = {}
+        for task in self.scheduler.pop_due(now + COALESCE):
+            kind = task[0]
+            if kind == 'name':
+                batches.setdefault(task[1], []).append(task[2])
+            elif kind == 'apply':
+                self.apply(task[1], task[2])
+            elif kind == 'blacklist':
+                self.check_blacklist(task[1], now)
+            elif kind == 'evict':
+                if self.groups[task[1]].cache is not None and evict_stale(self.groups[task[1]].cache, self.evict_after):
+                    self.groups[task[1]].dirty = True
+                    if self.prune:
+                        self.queue_apply(task[1], now, prune=True)
+                self.scheduler.push(task, now + EVICT_INTERVAL)
+            elif kind == 'save':
+                self.groups[task[1]].save()
+                self.scheduler.push(task, now + SAVE_INTERVAL)
+            elif kind == 'allowlist':
+                self.refresh_allowlist(task[1], now)
+        for index, names in batches.items():
+            self.refresh_names(index, names, now)
+
+    def run(self):
+        self.start()
+        try:
+            while True:
+                due = self.scheduler.next_due()
+                time.sleep(max(0.0, due - time.time()))
+                self.run_due(time.time())
+        finally:
+            for group in self.groups:
+                group.save()
+
+def _address_count(cache):
+    return sum(len(record['ips']) for record in cache['records'].values())
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+def run_daemon(users, blacklist_path, allowlist_path, verbose=False, **options):
+    """
+    Keep the users' ([(user, uid)]) caches and rules fresh until stopped. options are passed
+    on to RefreshDaemon (max_queries, jitter, evict_after, prune and the resolver options).
+    """
+    signal.signal(signal.SIGTERM, _stop)
+    daemon = RefreshDaemon(users, blacklist_path, allowlist_path, verbose=verbose, **options)
+    print(f"⏱️  Refreshing the restrictions of {', '.join(daemon.users)} as answers expire (Ctrl+C to stop)", flush=True)
+    try:
+        daemon.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    print(f"Daemon stopped; {sum(len(group.cache['records']) for group in daemon.groups if group.cache)} cached names saved.")
+    return True
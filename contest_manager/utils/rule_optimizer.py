@@ -0,0 +1,86 @@
+"""
+Ruleset optimizer for contest-manager
+
+Runs between build_ruleset and the backend:
+    dedupe      identical matches are emitted once
+    subsume     a string match for www.example.com is dropped when example.com is matched on
+                the same protocol and port, since every payload containing the longer name
+                contains the shorter one
+    order       cheap matches (set, address, port) run before payload string matches
+    conntrack   established/related flows leave the user's chain early, so only new flows
+                pay for the whole chain; while payload matches (strings or the inspector queue)
+                are present the shortcut only applies after the first QUEUE_PACKETS packets,
+                which still carry the DNS query or TLS ClientHello they look for (the same
+                window the inspector queue uses)
+"""
+
+from contest_manager.utils.firewall import FAMILIES, rule_key, inspects_payload
+from contest_manager.utils.payload_inspector import QUEUE_PACKETS
+
+def conntrack_rule(inspect_payload):
+    """The early return rule for established flows."""
+    rule = ['-m', 'conntrack', '--ctstate', 'ESTABLISHED,RELATED']
+    if inspect_payload:
+        rule += ['-m', 'connbytes', '--connbytes', f"{QUEUE_PACKETS + 1}:",
+                 '--connbytes-dir', 'original', '--connbytes-mode', 'packets']
+    return rule + ['-j', 'RETURN']
+
+def match_cost(rule):
+    """Rough per-packet cost class of a rule: lower runs first."""
+    if '--ctstate' in rule:
+        return 0
+    if '--match-set' in rule:
+        return 1
+    if 'NFQUEUE' in rule:
+        # Accepted packets leave the hook, so the inspector queue must come last
+        return 5
+    if '--string' in rule:
+        return 4
+    if '--dport' in rule or '--sport' in rule:
+        return 3
+    return 2
+
+def _subsumed(rule, strings):
+    """Return True if a shorter, label-wise suffix of the rule's string is matched on the same protocol and port."""
+    key = rule_key(rule)
+    labels = key[3].split('.')
+    return any(key[:3] + ('.'.join(labels[i:]),) in strings for i in range(1, len(labels) - 1))
+
+def optimize_rules(rules):
+    """Optimize one family's rules. Returns (rules, counters); 'conntrack' is 1 if the shortcut was inserted."""
+    stats = {'duplicates': 0, 'subsumed': 0, 'conntrack': 0}
+    unique = {}
+    for rule in rules:
+        key = rule_key(rule)
+        if key in unique:
+            stats['duplicates'] += 1
+        else:
+            unique[key] = rule
+    strings = {key for key in unique if key[0] == 'string'}
+    kept = []
+    for key, rule in unique.items():
+        if key[0] == 'string' and _subsumed(rule, strings):
+            stats['subsumed'] += 1
+        else:
+            kept.append(rule)
+    kept.sort(key=match_cost)
+    if kept:
+        kept.insert(0, conntrack_rule(any(inspects_payload(rule) for rule in kept)))
+        stats['conntrack'] = 1
+    return kept, stats
+
+def optimize_ruleset(ruleset):
+    """
+    Optimize a ruleset built by firewall.build_ruleset.
+    Returns (ruleset, stats) with the rule counts before and after, what was removed and the
+    number of chains the conntrack shortcut was inserted into.
+    """
+    stats = {'before': 0, 'after': 0, 'duplicates': 0, 'subsumed': 0, 'conntrack': 0}
+    rules = {}
+    for family in FAMILIES:
+        stats['before'] += len(ruleset['rules'][family])
+        rules[family], family_stats = optimize_rules(ruleset['rules'][family])
+        stats['after'] += len(rules[family])
+        for counter, value in family_stats.items():
+            stats[counter] += value
+    return dict(ruleset, rules=rules, early_accept=True), stats
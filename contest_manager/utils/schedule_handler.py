@@ -0,0 +1,215 @@
+"""
+Scheduled contest phases for contest-manager
+
+'schedule' compiles the ruleset of every phase (practice, contest, freeze, end) ahead of time
+into cache/phases/<phase>/, in the boot ruleset format (see boot_ruleset), and installs one
+systemd calendar timer per phase. At a boundary the timer runs 'schedule --apply-phase', which
+only loads the staged scripts: one iptables-restore transaction per family or one nft
+transaction, so the switch takes milliseconds and every machine changes at the same moment.
+
+The restriction mode of each phase comes from config/phases.txt. Users switching at the same
+time share one timer, so they are switched by one process. Timers are persistent, so a
+machine booted after a boundary catches up; a phase that has already been superseded by a
+later one is skipped, whatever order the timers fire in. Staged rulesets are refreshed every
+time the boot ruleset is saved (restrict, update-restriction, daemon), and a switch to a
+blacklist phase is followed by a delta when the cache changed after staging.
+"""
+
+import pwd
+import datetime
+from pathlib import Path
+from contest_manager.utils.firewall import resolve_backend, allowlist_backend, build_allowlist_ruleset, render_boot_scripts
+from contest_manager.utils.boot_ruleset import save_artifact, load_artifact, remove_artifact, checksum_path
+from contest_manager.utils.allowlist import system_nameservers, allowed_networks, load_allowlist_cache
+from contest_manager.utils.internet_handler import (
+    get_cache_dir, get_boot_dir, get_phase_dir, get_user_cache_path, get_allowlist_cache_path, load_user_state,
+    save_user_state, build_user_ruleset, create_ip_cache, create_shared_ip_cache, update_allowlist_cache,
+    apply_boot_ruleset, apply_restrictions_from_cache, update_restrictions_from_cache, unrestrict_internet,
+    warn_name_blocking
+)
+from contest_manager.utils.persistence_handler import (
+    start_persistence, remove_persistence, schedule_phase_timers, remove_phase_timers, persistence_enabled
+)
+
+PHASES = ('practice', 'contest', 'freeze', 'end')
+MODES = ('blacklist', 'allowlist', 'none')
+DEFAULT_MODES = {'practice': 'blacklist', 'contest': 'blacklist', 'freeze': 'blacklist', 'end': 'none'}
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+INPUT_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M')
+
+def parse_phase_time(value, today=None):
+    """
+    Parse 'YYYY-MM-DD HH:MM[:SS]' (or with a 'T') or 'HH:MM[:SS]' for today, in local time.
+    Returns the time as 'YYYY-MM-DD HH:MM:SS', which systemd's OnCalendar accepts as is.
+    """
+    for fmt in INPUT_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).strftime(TIME_FORMAT)
+        except ValueError:
+            pass
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            clock = datetime.datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+        return datetime.datetime.combine(today or datetime.date.today(), clock).strftime(TIME_FORMAT)
+    raise ValueError(f"invalid phase time '{value}' (expected 'YYYY-MM-DD HH:MM' or 'HH:MM')")
+
+def load_phase_modes(phases_path):
+    """Read phases.txt. Returns {phase: mode}, with the defaults for phases not listed."""
+    modes = dict(DEFAULT_MODES)
+    if not Path(phases_path).exists():
+        return modes
+    with open(phases_path) as f:
+        for line in f:
+            parts = line.split('#', 1)[0].split()
+            if len(parts) == 2 and parts[0] in PHASES and parts[1] in MODES:
+                modes[parts[0]] = parts[1]
+    return modes
+
+def scheduled_users():
+    """Return {user: schedule} for every user with scheduled phases."""
+    schedules = {}
+    for path in sorted(get_cache_dir().glob('state_*.json')):
+        user = path.stem[len('state_'):]
+        schedule = load_user_state(user).get('schedule')
+        if schedule:
+            schedules[user] = schedule
+    return schedules
+
+def install_phase_timers():
+    """Install one timer per phase and start time for all scheduled users (none left: remove them)."""
+    groups = {}
+    for user, schedule in scheduled_users().items():
+        for phase, entry in schedule.items():
+            groups.setdefault((phase, entry['at']), []).append(user)
+    if groups:
+        schedule_phase_timers(groups)
+    else:
+        remove_phase_timers()
+
+def current_phase(schedule, now=None):
+    """Return the latest scheduled phase whose start has passed, or None."""
+    now = (now or datetime.datetime.now()).strftime(TIME_FORMAT)
+    started = [(entry['at'], phase) for phase, entry in schedule.items() if entry['at'] <= now]
+    return max(started)[1] if started else None
+
+def stage_phase(user, uid, mode, backend, verbose=False):
+    """Compile the user's ruleset for a mode into boot scripts. Returns the scripts, or None."""
+    if mode == 'allowlist':
+        cache = load_allowlist_cache(get_allowlist_cache_path(user))
+        if cache is None:
+            return None
+        ruleset = build_allowlist_ruleset(uid, allowed_networks(*cache), system_nameservers(),
+                                          backend=allowlist_backend(backend))
+    else:
+        state = load_user_state(user)
+        ruleset = build_user_ruleset(uid, get_user_cache_path(user), backend, verbose=verbose,
+                                     inspector=state.get('inspector', False), sinkhole=state.get('sinkhole', False),
+                                     log_drops=state.get('log_drops', False))
+    return render_boot_scripts(uid, ruleset, backend=backend) or None
+
+def stage_schedule(users, times, blacklist_path, allowlist_path, phases_path, backend, verbose=False,
+                   **resolve_options):
+    """
+    Resolve what the scheduled phases need, stage every phase's ruleset for every user and
+    install the phase timers. times is {phase: 'YYYY-MM-DD HH:MM:SS'}. Returns True on success.
+    """
+    states = [load_user_state(user) for user in users]
+    name_blocking = all(state.get('inspector') or state.get('sinkhole') for state in states)
+    backend = resolve_backend(backend, name_blocking)
+    if backend == 'bpf':
+        print("❌ The bpf backend has no ruleset to stage; use nft, restore, ipset or legacy.")
+        return False
+    modes = load_phase_modes(phases_path)
+    needed = {modes[phase] for phase in times}
+    if 'blacklist' in needed:
+        warn_name_blocking(backend, inspector=name_blocking, sinkhole=False)
+        if len(users) == 1:
+            success, _ = create_ip_cache(users[0], blacklist_path, verbose=verbose, **resolve_options)
+        else:
+            success, _ = create_shared_ip_cache(users, blacklist_path, verbose=verbose, **resolve_options)
+        if not success:
+            print("❌ Failed to create IP cache. Nothing was scheduled.")
+            return False
+    if 'allowlist' in needed:
+        for user in users:
+            update_allowlist_cache(user, allowlist_path, verbose=verbose, **resolve_options)
+    for user in users:
+        try:
+            uid = pwd.getpwnam(user).pw_uid
+        except KeyError:
+            print(f"❌ User {user} not found.")
+            return False
+        schedule = {}
+        for phase, at in times.items():
+            if modes[phase] != 'none':
+                scripts = stage_phase(user, uid, modes[phase], backend, verbose=verbose)
+                if scripts is None:
+                    print(f"❌ Could not stage the {phase} ruleset for user {user}.")
+                    return False
+                save_artifact(get_phase_dir(phase), user, scripts)
+            schedule[phase] = {'at': at, 'mode': modes[phase]}
+            print(f"📦 {phase:<8} {at}  {modes[phase]:<9} staged for user {user}")
+        save_user_state(user, backend=backend, schedule=schedule)
+    install_phase_timers()
+    return True
+
+def apply_phase(user, phase, verbose=False):
+    """
+    Switch the user to a scheduled phase by loading its staged ruleset; only compiles from the
+    cache when the staged scripts are missing or fail their checksum. The phase ruleset also
+    becomes the boot ruleset. Skipped when a later phase has already started.
+    """
+    state = load_user_state(user)
+    schedule = state.get('schedule', {})
+    if phase not in schedule:
+        print(f"❌ No {phase} phase scheduled for user {user}.")
+        return False
+    latest = current_phase(schedule)
+    if latest is not None and latest != phase:
+        print(f"⏭️  The {latest} phase has already started; {phase} skipped.")
+        return True
+    mode = schedule[phase]['mode']
+    if mode == 'none':
+        # Persistence (with the tamper watcher) goes first, so the rules are not put back
+        remove_persistence(user)
+        unrestrict_internet(user, None, verbose=verbose)
+        save_user_state(user, phase=phase)
+        print(f"✅ {phase} phase: network restrictions lifted for user {user}")
+        return True
+    save_user_state(user, mode=mode, phase=phase)
+    scripts = load_artifact(get_phase_dir(phase), user)
+    if scripts is not None:
+        save_artifact(get_boot_dir(), user, scripts)
+    else:
+        remove_artifact(get_boot_dir(), user)
+    if scripts is None or not apply_boot_ruleset(user, verbose=verbose):
+        print(f"⚠️  No valid staged {phase} ruleset for user {user}, compiling it from the cache.")
+        if not apply_restrictions_from_cache(user, verbose=verbose):
+            return False
+    elif mode == 'blacklist' and _newer(get_user_cache_path(user), checksum_path(get_phase_dir(phase), user)):
+        # The cache was refreshed after staging (e.g. while an allowlist phase was in place)
+        update_restrictions_from_cache(user, verbose=verbose)
+    if not persistence_enabled(user):
+        # From the first restricted phase on, restrictions survive reboots and are refreshed
+        start_persistence(user, inspector=state.get('inspector', False) and mode == 'blacklist',
+                          sinkhole=state.get('sinkhole', False) and mode == 'blacklist',
+                          log_drops=state.get('log_drops', False) and mode == 'blacklist')
+    print(f"✅ {phase} phase ({mode}) in place for user {user}")
+    return True
+
+def _newer(path, other):
+    """Return True if path was modified after other (False if either is missing)."""
+    try:
+        return Path(path).stat().st_mtime > Path(other).stat().st_mtime
+    except OSError:
+        return False
+
+def clear_schedule(user):
+    """Remove the user's staged rulesets and take them off the phase timers."""
+    for phase in PHASES:
+        remove_artifact(get_phase_dir(phase), user)
+    save_user_state(user, schedule={})
+    install_phase_timers()
+    print(f"✅ Schedule cleared for user {user}")
@@ -0,0 +1,260 @@
+"""
+Single-snapshot status engine for contest-manager
+
+The firewall state is read once per status run: one 'iptables-save' and one 'ip6tables-save'
+call, plus one 'nft -j list table inet contest' and one 'ipset save' when those tools are
+installed. The snapshot is parsed once and every user's status is read from it:
+
+    active      the user's chain (or nft chain, or eBPF program) is in place
+    rules       rules in the user's chain per family, and whether OUTPUT jumps to it
+    sets        entries of the user's ipsets / nftables sets
+    cache_age   seconds since the user's IP cache (or allowlist cache) was written
+    usb         whether the polkit rule blocking USB storage is present
+    drift       rules or set entries missing from / extra to the live ruleset, compared with
+                the compiled ruleset saved by the last restrict or update (the boot ruleset)
+    drops       the blocked-attempt summary last written by the drop log (restrict --log-drops)
+
+This module deliberately avoids the resolver and daemon imports, so a status run stays fast.
+"""
+
+import time
+import json
+import shlex
+import bisect
+import shutil
+import subprocess
+from pathlib import Path
+from contest_manager.utils.firewall import (
+    FAMILIES, NFT_TABLE, chain_name, jump_rule, matches_uid, nft_chain_name, set_name, diff_rules,
+    _nft_intervals, _covered
+)
+from contest_manager.utils.boot_ruleset import load_artifact
+from contest_manager.utils.bpf_backend import MAPS, attached, map_stats
+from contest_manager.utils.usb_handler import usb_restriction_check
+from contest_manager.utils.drop_log import load_summary
+
+SAVE = {'ipv4': 'iptables-save', 'ipv6': 'ip6tables-save'}
+CACHE_DIR = Path(__file__).parent.parent.parent / 'cache'
+
+def _tokens(line):
+    # shlex is only needed for quoted arguments, and is slow on large rulesets
+    return shlex.split(line) if '"' in line or "'" in line else line.split()
+
+def parse_save(text):
+    """Parse iptables-save output into {table: {chain: [rule tokens after '-A <chain>']}}."""
+    tables = {}
+    table = None
+    for line in text.splitlines():
+        if line.startswith('*'):
+            table = tables.setdefault(line[1:].strip(), {})
+        elif table is None:
+            continue
+        elif line.startswith(':'):
+            table.setdefault(line[1:].split()[0], [])
+        elif line.startswith('-A '):
+            tokens = _tokens(line)
+            table.setdefault(tokens[1], []).append(tokens[2:])
+    return tables
+
+def parse_nft_table(text):
+    """Parse 'nft -j list table' output into ({set: [elements]}, {chain: rule count})."""
+    sets, chains = {}, {}
+    try:
+        items = json.loads(text).get('nftables', [])
+    except ValueError:
+        return sets, chains
+    for item in items:
+        if 'set' in item:
+            sets[item['set']['name']] = item['set'].get('elem', [])
+        elif 'chain' in item:
+            chains.setdefault(item['chain']['name'], 0)
+        elif 'rule' in item:
+            chains[item['rule']['chain']] = chains.get(item['rule']['chain'], 0) + 1
+    return sets, chains
+
+def parse_ipset_save(text):
+    """Parse 'ipset save' output into {set name: [members]} for contest sets."""
+    sets = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[1].startswith('contest-'):
+            if parts[0] == 'create':
+                sets.setdefault(parts[1], [])
+            elif parts[0] == 'add' and len(parts) >= 3:
+                sets.setdefault(parts[1], []).append(parts[2])
+    return sets
+
+def _run(args):
+    if not shutil.which(args[0]):
+        return None
+    result = subprocess.run(args, capture_output=True, text=True)
+    return result.stdout if result.returncode == 0 else None
+
+def take_snapshot():
+    """Read the whole firewall state once. Tools that are missing leave their part as None."""
+    snapshot = {'iptables': {}, 'nft': None, 'ipset': None, 'taken': time.time()}
+    for family in FAMILIES:
+        text = _run([SAVE[family]])
+        snapshot['iptables'][family] = parse_save(text) if text is not None else None
+    if shutil.which('nft'):
+        # Listing fails when the table does not exist, which is an empty table as far as users go
+        text = _run(['nft', '-j', 'list', 'table', 'inet', NFT_TABLE])
+        snapshot['nft'] = parse_nft_table(text) if text is not None else ({}, {})
+    text = _run(['ipset', 'save'])
+    if text is not None:
+        snapshot['ipset'] = parse_ipset_save(text)
+    return snapshot
+
+def _host(member):
+    """Spell host members the way 'ipset save' does (no /32 or /128 suffix)."""
+    for suffix in ('/32', '/128'):
+        if member.endswith(suffix):
+            return member[:-len(suffix)]
+    return member
+
+def _script_rules(script, chain):
+    prefix = f"-A {chain} "
+    return [_tokens(line)[2:] for line in script.splitlines() if line.startswith(prefix)]
+
+def _script_elements(script):
+    """{set name: [members]} from the 'add element' lines of an nft script."""
+    elements = {}
+    for line in script.splitlines():
+        if line.startswith('add element ') and '{' in line:
+            name = line.split()[4]
+            members = line[line.index('{') + 1:line.rindex('}')]
+            elements.setdefault(name, []).extend(m.strip() for m in members.split(',') if m.strip())
+    return elements
+
+def _script_ipset_members(script):
+    """{set name: [members]} from the 'add <set>-tmp' lines of an ipset restore script."""
+    members = {}
+    for line in script.splitlines():
+        parts = line.split()
+        if parts[:1] == ['add'] and len(parts) >= 3:
+            members.setdefault(parts[1][:-len('-tmp')] if parts[1].endswith('-tmp') else parts[1], []).append(parts[2])
+    return members
+
+def measure_drift(uid, snapshot, scripts):
+    """
+    Compare the live ruleset with the compiled one. Returns {'missing', 'extra', 'duplicates'}
+    counts of rules and set entries, or None when a part of the snapshot is unavailable.
+    """
+    drift = {'missing': 0, 'extra': 0, 'duplicates': 0}
+    chain = chain_name(uid)
+    for family in FAMILIES:
+        if family not in scripts:
+            continue
+        tables = snapshot['iptables'].get(family)
+        if tables is None:
+            return None
+        live = tables.get('filter', {}).get(chain, [])
+        missing, expired, duplicates = diff_rules(live, _script_rules(scripts[family], chain))
+        # The jump is not part of the compiled chain script, but the chain is useless without it
+        drift['missing'] += len(missing) + (jump_rule(uid) not in tables.get('filter', {}).get('OUTPUT', []))
+        drift['extra'] += len(expired)
+        drift['duplicates'] += len(duplicates)
+    if 'ipset' in scripts:
+        if snapshot['ipset'] is None:
+            return None
+        for name, wanted in _script_ipset_members(scripts['ipset']).items():
+            wanted = {_host(m) for m in wanted}
+            live = {_host(m) for m in snapshot['ipset'].get(name, [])}
+            drift['missing'] += len(wanted - live)
+            drift['extra'] += len(live - wanted)
+    if 'nft' in scripts:
+        if snapshot['nft'] is None:
+            return None
+        live_sets, chains = snapshot['nft']
+        wanted_rules = sum(1 for line in scripts['nft'].splitlines()
+                           if line.startswith(f"add rule inet {NFT_TABLE} {nft_chain_name(uid)} "))
+        drift['missing'] += max(0, wanted_rules - chains.get(nft_chain_name(uid), 0))
+        drift['extra'] += max(0, chains.get(nft_chain_name(uid), 0) - wanted_rules)
+        for name, wanted in _script_elements(scripts['nft']).items():
+            intervals = sorted(i for value in live_sets.get(name, []) for i in _nft_intervals(value))
+            drift['missing'] += sum(1 for member in wanted if not _covered(intervals, member))
+            # Interval sets merge adjacent entries: a live interval is extra when no wanted member starts in it
+            starts = sorted(first for member in wanted for first, _ in _nft_intervals(member))
+            for first, last in intervals:
+                i = bisect.bisect_left(starts, first)
+                if i == len(starts) or starts[i] > last:
+                    drift['extra'] += 1
+    return drift
+
+def load_state(user, cache_dir=CACHE_DIR):
+    try:
+        with open(Path(cache_dir) / f"state_{user}.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def cache_age(user, mode, cache_dir=CACHE_DIR, now=None):
+    """Seconds since the user's IP cache (allowlist cache in allowlist mode) was written, or None."""
+    name = f"allowlist_{user}.json" if mode == 'allowlist' else f"ip_cache_{user}.json"
+    try:
+        mtime = (Path(cache_dir) / name).stat().st_mtime
+    except OSError:
+        return None
+    return max(0, int((now or time.time()) - mtime))
+
+def dns_redirected(uid, snapshot):
+    """Return True if the snapshot holds the nat rules (or nft chain) redirecting the user's DNS traffic."""
+    for tables in snapshot['iptables'].values():
+        if tables and any(matches_uid(rule, uid) and 'REDIRECT' in rule for rule in tables.get('nat', {}).get('OUTPUT', [])):
+            return True
+    return snapshot['nft'] is not None and snapshot['nft'][1].get(f"dns_{uid}", 0) > 0
+
+def user_status(user, uid, snapshot, cache_dir=CACHE_DIR):
+    """Build one user's status from the snapshot (see the module docstring for the fields)."""
+    state = load_state(user, cache_dir)
+    mode = state.get('mode', 'blacklist')
+    backend = state.get('backend')
+    status = {'user': user, 'uid': uid, 'mode': mode, 'backend': backend, 'active': False,
+              'rules': {}, 'jump': {}, 'sets': {}, 'legacy_rules': 0, 'dns_redirect': False,
+              'cache_age': cache_age(user, mode, cache_dir, snapshot['taken']), 'usb': usb_restriction_check(user),
+              'phase': state.get('phase'), 'sinkhole': state.get('sinkhole', False), 'drift': None,
+              'drops': load_summary(user, cache_dir) if state.get('log_drops') else None}
+    chain = chain_name(uid)
+    for family in FAMILIES:
+        tables = snapshot['iptables'].get(family)
+        if tables is None:
+            continue
+        filter_table = tables.get('filter', {})
+        status['rules'][family] = len(filter_table.get(chain, []))
+        output = filter_table.get('OUTPUT', [])
+        status['jump'][family] = jump_rule(uid) in output
+        status['legacy_rules'] += sum(1 for rule in output if matches_uid(rule, uid) and rule[-2:] == ['-j', 'DROP'])
+        if status['rules'][family] and status['jump'][family]:
+            status['active'] = True
+    if snapshot['ipset'] is not None:
+        for family in FAMILIES:
+            if set_name(uid, family) in snapshot['ipset']:
+                status['sets'][set_name(uid, family)] = len(snapshot['ipset'][set_name(uid, family)])
+    if snapshot['nft'] is not None:
+        sets, chains = snapshot['nft']
+        for name, elements in sets.items():
+            if name.endswith(f"_{uid}"):
+                status['sets'][name] = len(elements)
+        status['rules']['nft'] = chains.get(nft_chain_name(uid), 0)
+        if status['rules']['nft']:
+            status['active'] = True
+    status['dns_redirect'] = dns_redirected(uid, snapshot)
+    if backend == 'bpf':
+        stats = map_stats(uid)
+        if stats:
+            status['sets'].update({name: stats[name] for name in MAPS.values()})
+            status['bpf'] = {'packets': stats.get('packets', 0), 'dropped': stats.get('dropped', 0)}
+            status['active'] = attached(uid)
+    if mode == 'blacklist' and backend in ('ipset', 'nft') and not status['sets']:
+        # The chain is in place but matches against sets that are gone
+        status['active'] = False
+    status['active'] = status['active'] or status['legacy_rules'] > 0
+    scripts = load_artifact(Path(cache_dir) / 'boot', user)
+    if scripts is not None:
+        status['drift'] = measure_drift(uid, snapshot, scripts)
+    return status
+
+def collect_status(users):
+    """Take one snapshot and return the status of every (user, uid) pair."""
+    snapshot = take_snapshot()
+    return [user_status(user, uid, snapshot) for user, uid in users]
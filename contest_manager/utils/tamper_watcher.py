@@ -0,0 +1,349 @@
+"""
+Tamper watcher for contest-manager
+
+A long-running process per restricted user that puts back what is removed from under the
+restrictions, instead of waiting for the next update-restriction run:
+
+    ruleset    nftables change notifications (a netlink socket subscribed to the nftables
+               multicast group, which iptables-nft changes go through as well) trigger a check
+    polkit     inotify on /etc/polkit-1/rules.d: the user's USB rule is rewritten when it is
+               deleted or altered
+    cache      inotify on the cache directory: the boot ruleset and state file are kept in
+               memory and written back when they are deleted or fail their checksum
+
+Changes are debounced (DEBOUNCE of quiet, at most MAX_DELAY) and checked against one status
+snapshot. Only the missing pieces are loaded again: set entries with 'add element'/'ipset add',
+the jump from OUTPUT with one insert, rules removed from or added to a chain with one restore
+inserting or deleting just those rules, a deleted chain with one restore of that chain. Checks
+wait for the users' apply locks, so a restrict or update in progress is never taken for tampering.
+Every tamper event is logged to cache/tamper.log and the journal.
+
+Legacy iptables and ipset changes send no notifications; the ruleset is also checked every
+poll interval to catch those. The bpf backend is not watched.
+"""
+
+import os
+import time
+import json
+import select
+import socket
+import struct
+import ctypes
+import ctypes.util
+import subprocess
+from pathlib import Path
+from contextlib import ExitStack
+from contest_manager.utils.firewall import (
+    DEFAULT_BACKEND, FAMILIES, NFT_TABLE, NFT_ELEMENTS_PER_LINE, chain_name, jump_rule, nft_chain_name, diff_rules,
+    render_restore, render_chain_repair, restore, add_jump, nft_run, apply_dns_redirect, _nft_intervals, _covered
+)
+from contest_manager.utils.status_snapshot import (
+    CACHE_DIR, take_snapshot, load_state, dns_redirected, _script_rules, _script_elements, _script_ipset_members, _host
+)
+from contest_manager.utils.boot_ruleset import load_artifact, save_artifact, apply_lock
+from contest_manager.utils.dns_sinkhole import sinkhole_port
+from contest_manager.utils.usb_handler import restrict_usb_storage_device
+
+POLKIT_DIR = Path('/etc/polkit-1/rules.d')
+BOOT_DIR = CACHE_DIR / 'boot'
+TAMPER_LOG = CACHE_DIR / 'tamper.log'
+DEBOUNCE = 0.2
+MAX_DELAY = 0.8
+POLL_INTERVAL = 10
+
+NETLINK_NETFILTER = 12
+NFNLGRP_NFTABLES = 7
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT = struct.Struct('iIII')
+
+class Inotify:
+    """Minimal inotify binding (ctypes, no third-party module)."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}
+
+    def add(self, path, mask=WATCH_MASK):
+        """Watch a directory. Returns False if it cannot be watched (e.g. it does not exist)."""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            return False
+        self.paths[wd] = Path(path)
+        return True
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """Return the queued events as (directory, file name, mask)."""
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0').decode(errors='replace')
+            offset += _EVENT.size + length
+            events.append((self.paths.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def netfilter_socket():
+    """Return a netlink socket receiving nftables change notifications, or None if unavailable."""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_NETFILTER)
+        sock.bind((0, 1 << (NFNLGRP_NFTABLES - 1)))
+    except (OSError, AttributeError):
+        return None
+    sock.setblocking(False)
+    return sock
+
+def _drain(sock):
+    try:
+        while sock.recv(65536):
+            pass
+    except (BlockingIOError, OSError):
+        pass
+
+def log_event(user, what, action, log_path=TAMPER_LOG):
+    """Record a tamper event in the tamper log and on stdout (the journal, under systemd)."""
+    line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')} {user}: {what}; {action}"
+    print(f"🚨 [tamper] {line}", flush=True)
+    try:
+        with open(log_path, 'a') as f:
+            f.write(line + '\n')
+    except OSError:
+        pass
+
+def usb_rule_path(user):
+    return POLKIT_DIR / f"99-block-usb-storage-{user}.rules"
+
+def usb_rule_intact(user):
+    """Return True if the user's polkit rule exists and still denies mounting for the user."""
+    try:
+        text = usb_rule_path(user).read_text()
+    except OSError:
+        return False
+    return f'subject.user == "{user}"' in text and 'polkit.Result.NO' in text
+
+def missing_pieces(uid, snapshot, scripts):
+    """
+    Compare the snapshot with the user's boot scripts. Returns (description, tool, script)
+    for every missing or altered piece, sets first since the chains reference them; tool is
+    'ipset', 'nft' or a family, and script loads only that piece.
+    """
+    pieces = []
+    if 'ipset' in scripts and snapshot['ipset'] is not None:
+        wanted = _script_ipset_members(scripts['ipset'])
+        gone = sorted(name for name in wanted if name not in snapshot['ipset'])
+        if gone:
+            pieces.append((f"ipset {', '.join(gone)} deleted", 'ipset', scripts['ipset']))
+        else:
+            lines = [f"add {name} {member} -exist" for name, members in sorted(wanted.items())
+                     for member in sorted({_host(m) for m in members} - {_host(m) for m in snapshot['ipset'][name]})]
+            if lines:
+                pieces.append((f"{len(lines)} ipset entries removed", 'ipset', '\n'.join(lines) + '\n'))
+    if 'nft' in scripts and snapshot['nft'] is not None:
+        live_sets, chains = snapshot['nft']
+        chain = nft_chain_name(uid)
+        wanted_rules = sum(1 for line in scripts['nft'].splitlines() if line.startswith(f"add rule inet {NFT_TABLE} {chain} "))
+        elements = _script_elements(scripts['nft'])
+        gone = sorted(name for name in elements if name not in live_sets)
+        if chain not in chains:
+            pieces.append((f"nft chain {chain} deleted", 'nft', scripts['nft']))
+        elif gone:
+            pieces.append((f"nft set {', '.join(gone)} deleted", 'nft', scripts['nft']))
+        elif chains[chain] != wanted_rules:
+            pieces.append((f"nft chain {chain} altered ({chains[chain]} rules, {wanted_rules} expected)", 'nft', scripts['nft']))
+        else:
+            lines = []
+            for name, members in sorted(elements.items()):
+                intervals = sorted(i for value in live_sets[name] for i in _nft_intervals(value))
+                missing = [m for m in members if not _covered(intervals, m)]
+                for i in range(0, len(missing), NFT_ELEMENTS_PER_LINE):
+                    lines.append(f"add element inet {NFT_TABLE} {name} {{ {', '.join(missing[i:i + NFT_ELEMENTS_PER_LINE])} }}")
+            if lines:
+                count = sum(line.count(',') + 1 for line in lines)
+                pieces.append((f"{count} nft set elements removed", 'nft', '\n'.join(lines) + '\n'))
+    chain = chain_name(uid)
+    for family in FAMILIES:
+        if family not in scripts or snapshot['iptables'].get(family) is None:
+            continue
+        filter_table = snapshot['iptables'][family].get('filter', {})
+        jumped = jump_rule(uid) in filter_table.get('OUTPUT', [])
+        script = scripts[family] if jumped else add_jump(uid, scripts[family])
+        if chain not in filter_table:
+            pieces.append((f"{family} chain {chain} deleted", family, script))
+            continue
+        desired = _script_rules(scripts[family], chain)
+        missing, extra, duplicates = diff_rules(filter_table[chain], desired)
+        if missing or extra or duplicates:
+            pieces.append((f"{family} chain {chain} altered ({len(missing)} rules removed, "
+                           f"{len(extra) + len(duplicates)} added)", family,
+                           render_chain_repair(uid, desired, missing, extra + duplicates, add_jump=not jumped)))
+        elif not jumped:
+            pieces.append((f"{family} jump to {chain} removed from OUTPUT", family,
+                           render_restore([jump_rule(uid)], action='-I')))
+    return pieces
+
+def apply_piece(tool, script, verbose=False):
+    """Load one piece returned by missing_pieces. Returns True on success."""
+    if tool == 'ipset':
+        result = subprocess.run(['ipset', '-exist', 'restore'], input=script, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"❌ ipset restore failed: {result.stderr.strip()}")
+        return result.returncode == 0
+    if tool == 'nft':
+        return nft_run(script, verbose=verbose)
+    return restore(tool, script, verbose=verbose)
+
+class Watcher:
+    """Keeps the last valid boot ruleset, state and USB rule of each user, and repairs from them."""
+
+    def __init__(self, users, cache_dir=CACHE_DIR, verbose=False):
+        self.users = users
+        self.cache_dir = Path(cache_dir)
+        self.boot_dir = self.cache_dir / 'boot'
+        self.log_path = self.cache_dir / 'tamper.log'
+        self.verbose = verbose
+        self.scripts = {user: load_artifact(self.boot_dir, user) for user, _ in users}
+        self.states = {user: load_state(user, self.cache_dir) for user, _ in users}
+        self.usb = {user: usb_rule_intact(user) for user, _ in users}
+
+    def relevant(self, directory, name, mask):
+        """Return True if an inotify event concerns a watched file (or a watched directory went away)."""
+        if mask & (IN_DELETE_SELF | IN_IGNORED):
+            return True
+        for user, _ in self.users:
+            if directory == POLKIT_DIR and name == usb_rule_path(user).name:
+                return True
+            if directory == self.cache_dir and name == f"state_{user}.json":
+                return True
+            if directory == self.boot_dir and name.startswith(f"{user}.") and not name.endswith('.lock'):
+                return True
+        return False
+
+    def _reload(self, load, previous):
+        value = load()
+        if not value and previous:
+            # restrict and update-restriction rewrite these files; give a write in progress time to finish
+            time.sleep(DEBOUNCE)
+            value = load()
+        return value
+
+    def refresh_files(self):
+        """Adopt boot rulesets and state saved since the last check; write back deleted or altered ones."""
+        for user, _ in self.users:
+            scripts = self._reload(lambda: load_artifact(self.boot_dir, user), self.scripts[user])
+            if scripts:
+                self.scripts[user] = scripts
+            elif self.scripts[user]:
+                save_artifact(self.boot_dir, user, self.scripts[user])
+                log_event(user, "boot ruleset deleted or altered", "last valid copy restored", self.log_path)
+            state = self._reload(lambda: load_state(user, self.cache_dir), self.states[user])
+            if state:
+                self.states[user] = state
+            elif self.states[user]:
+                with open(self.cache_dir / f"state_{user}.json", 'w') as f:
+                    json.dump(self.states[user], f, indent=2)
+                log_event(user, "restriction state deleted or altered", "last copy restored", self.log_path)
+
+    def check(self):
+        """Take one snapshot and put back whatever is missing for every user."""
+        with ExitStack() as locks:
+            for user, _ in self.users:
+                locks.enter_context(apply_lock(self.boot_dir, user))
+            self._check()
+
+    def _check(self):
+        self.refresh_files()
+        snapshot = take_snapshot()
+        for user, uid in self.users:
+            for description, tool, script in missing_pieces(uid, snapshot, self.scripts[user] or {}):
+                started = time.monotonic()
+                ok = apply_piece(tool, script, verbose=self.verbose)
+                log_event(user, description, f"re-applied in {int((time.monotonic() - started) * 1000)} ms"
+                          if ok else "re-apply failed", self.log_path)
+            state = self.states[user]
+            if state.get('sinkhole') and state.get('mode', 'blacklist') == 'blacklist' and not dns_redirected(uid, snapshot):
+                ok = apply_dns_redirect(uid, sinkhole_port(uid), backend=state.get('backend', DEFAULT_BACKEND),
+                                        verbose=self.verbose)
+                log_event(user, "DNS redirect to the sinkhole removed", "re-applied" if ok else "re-apply failed",
+                          self.log_path)
+            if usb_rule_intact(user):
+                self.usb[user] = True
+            elif self.usb[user]:
+                ok = restrict_usb_storage_device(user)
+                log_event(user, "USB polkit rule deleted or altered", "rewritten" if ok else "rewrite failed",
+                          self.log_path)
+
+def run_watcher(users, cache_dir=CACHE_DIR, poll_interval=POLL_INTERVAL, verbose=False):
+    """
+    Watch the restrictions of users ([(user, uid)]) until interrupted. Every burst of events
+    is followed by one check within about a second; the ruleset is also checked every
+    poll_interval seconds for changes that send no notification.
+    """
+    watcher = Watcher(users, cache_dir, verbose=verbose)
+    sources = []
+    sock = netfilter_socket()
+    if sock is not None:
+        sources.append(sock)
+    else:
+        print(f"⚠️  Netfilter notifications unavailable; the ruleset is checked every {poll_interval}s.")
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError) as e:
+        inotify = None
+        print(f"⚠️  inotify unavailable ({e}); files are checked every {poll_interval}s.")
+    if inotify is not None:
+        for directory in (POLKIT_DIR, watcher.cache_dir, watcher.boot_dir):
+            if not inotify.add(directory):
+                print(f"⚠️  Cannot watch {directory}.")
+        sources.append(inotify)
+    print(f"👁️  Watching the restrictions of {', '.join(user for user, _ in users)} (Ctrl+C to stop)", flush=True)
+    watcher.check()
+    try:
+        while True:
+            if not select.select(sources, [], [], poll_interval)[0]:
+                watcher.check()
+                continue
+            # Debounce: wait for DEBOUNCE of quiet, but check no later than MAX_DELAY after the first event
+            deadline = time.monotonic() + MAX_DELAY
+            triggered = False
+            while True:
+                for source in select.select(sources, [], [], 0)[0]:
+                    if source is inotify:
+                        triggered |= any(watcher.relevant(*event) for event in inotify.read())
+                    else:
+                        _drain(source)
+                        triggered = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select(sources, [], [], min(DEBOUNCE, remaining))[0]:
+                    break
+            if triggered:
+                watcher.check()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if sock is not None:
+            sock.close()
+        if inotify is not None:
+            inotify.close()
+    return True
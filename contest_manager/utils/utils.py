@@ -1,7 +1,11 @@
 import os
 import sys
+import fcntl
 import shutil
+import tempfile
 import subprocess
+from pathlib import Path
+from contextlib import contextmanager
 
 def run_command(cmd, shell=False, check=True, capture_output=False):
     """Run a command and handle errors."""
@@ -25,6 +29,40 @@ def check_root():
         print("❌ Error: This command must be run as root")
         sys.exit(1)
 
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive flock on path (created if missing) while the block runs."""
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """
+    Open a uniquely named temporary file next to path and rename it over path once the block
+    completes, so concurrent writers never share a temporary file and readers never see a
+    partial one. On an exception the temporary file is removed and path is left untouched.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file private to root; keep the permissions a plain open() would give
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, str(path))
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def disable_system_updates():
     print("→ Disabling automatic system updates...")
     services = ["apt-daily.service", "apt-daily-upgrade.service"]
@@ -75,6 +75,7 @@ setup(
             'data/*.json',
             'templates/*.txt',
             'templates/*.service',
+            'bpf/*.c',
         ],
     },
     zip_safe=False,
@@ -0,0 +1,65 @@
+"""Address aggregation and its config file."""
+
+import ipaddress
+
+from contest_manager.utils.aggregation import aggregate, widen, load_aggregation_config, make_aggregator
+
+
+def test_aggregate_collapses_adjacent_addresses():
+    networks, widened = aggregate(['192.0.2.0', '192.0.2.1', '192.0.2.2', '192.0.2.3', '198.51.100.7'])
+    assert networks == ['192.0.2.0/30', '198.51.100.7']
+    assert widened == 0
+
+
+def test_aggregate_keeps_host_addresses_plain():
+    assert aggregate(['2001:db8::1', '2001:db8::1'])[0] == ['2001:db8::1']
+
+
+def test_aggregate_adds_extra_networks():
+    networks, _ = aggregate(['192.0.2.5'], extra=[ipaddress.ip_network('192.0.2.0/24')])
+    assert networks == ['192.0.2.0/24']
+
+
+def test_widening_needs_enough_addresses():
+    addresses = ['192.0.2.1', '192.0.2.9', '192.0.2.77', '198.51.100.1']
+    networks, widened = aggregate(addresses, widen_rules=[(24, 3)])
+    assert networks == ['192.0.2.0/24', '198.51.100.1']
+    assert widened == 1
+    assert aggregate(addresses, widen_rules=[(24, 4)]) == (addresses, 0)
+
+
+def test_widen_leaves_networks_already_as_wide():
+    networks = [ipaddress.ip_network('10.0.0.0/16')]
+    assert widen(networks, [(24, 1)]) == (networks, 0)
+
+
+def test_load_aggregation_config(tmp_path, capsys):
+    path = tmp_path / 'aggregation.txt'
+    path.write_text("""
+widen ipv4 24 4   # comment
+widen ipv6 48 2
+widen ipv4 33 2
+widen ipv4 x 2
+widen ipv6 64 0
+prefixes pfx2as.txt
+provider Example.com AS64500 64501
+provider other.test auto
+bogus line
+""")
+    config = load_aggregation_config(path)
+    assert config['widen'] == {'ipv4': [(24, 4)], 'ipv6': [(48, 2)]}
+    assert config['prefixes'] == tmp_path / 'pfx2as.txt'
+    assert config['providers'] == {'example.com': [64500, 64501], 'other.test': ['auto']}
+    assert capsys.readouterr().out.count('Ignoring invalid aggregation setting') == 4
+
+
+def test_missing_config_is_empty(tmp_path):
+    config = load_aggregation_config(tmp_path / 'missing.txt')
+    assert config == {'widen': {'ipv4': [], 'ipv6': []}, 'prefixes': None, 'providers': {}}
+
+
+def test_make_aggregator_counts():
+    stats = {}
+    aggregate_family = make_aggregator({'widen': {'ipv4': [], 'ipv6': []}}, stats=stats)
+    assert aggregate_family('ipv4', ['192.0.2.0', '192.0.2.1', '192.0.2.1']) == ['192.0.2.0/31']
+    assert stats['addresses'] == 2 and stats['networks'] == 1
@@ -0,0 +1,33 @@
+"""LPM-trie keys and attachment detection of the eBPF backend."""
+
+import sys
+import json
+import types
+import ipaddress
+
+from contest_manager.utils import bpf_backend
+from contest_manager.utils.bpf_backend import encode_key, decode_key
+
+
+def test_key_prefix_length_is_host_endian():
+    network = ipaddress.ip_network('192.0.2.0/24')
+    key = encode_key(network)
+    assert key[:4] == (24).to_bytes(4, sys.byteorder)
+    assert key[4:] == bytes([192, 0, 2, 0])
+    assert decode_key(key) == network
+    assert decode_key(encode_key(ipaddress.ip_network('2001:db8::/32'))) == ipaddress.ip_network('2001:db8::/32')
+
+
+def test_attached_matches_the_pinned_program_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(bpf_backend, 'cgroup_path', lambda uid: tmp_path)
+    shown = [{'id': 7, 'attach_type': 'egress', 'name': 'other'}]
+
+    def bpftool(args, verbose=False, **kwargs):
+        if args[1:3] == ['cgroup', 'show']:
+            return types.SimpleNamespace(returncode=0, stdout=json.dumps(shown))
+        return types.SimpleNamespace(returncode=0, stdout=json.dumps({'id': 42, 'name': 'contest_egress'}))
+    monkeypatch.setattr(bpf_backend, '_bpftool', bpftool)
+    assert not bpf_backend.attached(1000)
+    # Older bpftool versions spell the attach type 'egress', newer ones 'cgroup_inet_egress'
+    shown.append({'id': 42, 'attach_type': 'egress', 'name': 'contest_egress'})
+    assert bpf_backend.attached(1000)
@@ -0,0 +1,115 @@
+"""Concurrent resolution against a local stub nameserver."""
+
+import socket
+import threading
+
+import pytest
+
+dns = pytest.importorskip('dns')
+import dns.rcode
+import dns.rrset
+import dns.message
+import dns.rdatatype
+
+from contest_manager.utils.dns_resolver import parse_nameserver, build_resolver, resolve_many
+
+SOA = 'ns.test. admin.test. 1 3600 600 86400 {minimum}'
+
+# name -> {rdtype: (ttl, [addresses])}; names missing here get NXDOMAIN
+ZONE = {
+    'dual.test': {'A': (300, ['192.0.2.1']), 'AAAA': (120, ['2001:db8::1'])},
+    'v4.test': {'A': (200, ['192.0.2.2', '192.0.2.3'])},
+    'empty.test': {},
+}
+
+
+class StubNameserver(threading.Thread):
+    """Answers from ZONE, with an SOA (negative TTL 30) in the authority section of negative answers."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.1)
+        self.port = self.sock.getsockname()[1]
+        self.queries = []
+        self.stopped = threading.Event()
+
+    def answer(self, query):
+        question = query.question[0]
+        name = question.name.to_text(omit_final_dot=True)
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        self.queries.append((name, rdtype))
+        response = dns.message.make_response(query)
+        if name not in ZONE:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif rdtype in ZONE[name]:
+            ttl, addresses = ZONE[name][rdtype]
+            response.answer.append(dns.rrset.from_text(name + '.', ttl, 'IN', rdtype, *addresses))
+        if not response.answer:
+            response.authority.append(dns.rrset.from_text('test.', 600, 'IN', 'SOA', SOA.format(minimum=30)))
+        return response
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            self.sock.sendto(self.answer(dns.message.from_wire(data)).to_wire(), addr)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def nameserver():
+    server = StubNameserver()
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_parse_nameserver():
+    assert parse_nameserver('192.0.2.53') == ('192.0.2.53', 53)
+    assert parse_nameserver('127.0.0.1:5353') == ('127.0.0.1', 5353)
+    assert parse_nameserver('[::1]:5353') == ('::1', 5353)
+    assert parse_nameserver('[::1]') == ('::1', 53)
+
+
+def test_resolve_many_collects_addresses_and_ttls(nameserver):
+    resolver = build_resolver([f'127.0.0.1:{nameserver.port}'], timeout=2)
+    results, stats = resolve_many(['dual.test', 'v4.test', 'dual.test'], resolver=resolver, report=False)
+    assert sorted(results['dual.test']['ips']) == ['192.0.2.1', '2001:db8::1']
+    assert results['dual.test']['ttl'] == 120
+    assert results['dual.test']['status'] == 'ok'
+    assert sorted(results['v4.test']['ips']) == ['192.0.2.2', '192.0.2.3']
+    assert results['v4.test']['ttl'] == 200
+    assert stats['total'] == 2 and stats['ok'] == 2
+
+
+def test_negative_answers_carry_the_soa_ttl(nameserver):
+    resolver = build_resolver([f'127.0.0.1:{nameserver.port}'], timeout=2)
+    results, stats = resolve_many(['missing.test', 'empty.test'], resolver=resolver, report=False)
+    assert results['missing.test'] == {'ips': [], 'ttl': 30, 'status': 'nxdomain'}
+    assert results['empty.test'] == {'ips': [], 'ttl': 30, 'status': 'nodata'}
+    # NXDOMAIN covers every type, so AAAA is not asked for
+    assert ('missing.test', 'AAAA') not in nameserver.queries
+    assert stats['nxdomain'] == 1 and stats['nodata'] == 1
+
+
+def test_unreachable_nameserver_counts_as_timeout():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        resolver = build_resolver([f'127.0.0.1:{port}'], timeout=0.2)
+        results, stats = resolve_many(['dual.test'], resolver=resolver, report=False)
+    assert results['dual.test']['status'] == 'timeout'
+    assert stats['timeout'] == 1
+
+
+def test_no_names_resolves_nothing():
+    results, stats = resolve_many([], resolver=object(), report=False)
+    assert results == {} and stats['total'] == 0 and stats['elapsed'] == 0.0
@@ -0,0 +1,186 @@
+"""DNS sinkhole against a local stub upstream resolver."""
+
+import socket
+import asyncio
+
+import pytest
+
+dns = pytest.importorskip('dns')
+import dns.rcode
+import dns.message
+import dns.rrset
+import dns.asyncquery
+
+from contest_manager.utils.domain_policy import PolicySource, compile_policy, iter_blacklist
+from contest_manager.utils.dns_sinkhole import AnswerCache, Sinkhole, blocked_name, port_conflicts, serve
+
+BLACKLIST = ['openai.com', '!help.openai.com', '*.cdn.example']
+
+
+class StubUpstream(asyncio.DatagramProtocol):
+    """Answers A queries with 192.0.2.1; alias.test is a CNAME to chat.openai.com."""
+
+    def __init__(self):
+        self.queries = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        query = dns.message.from_wire(data)
+        name = query.question[0].name.to_text(omit_final_dot=True)
+        self.queries.append(name)
+        response = dns.message.make_response(query)
+        if name == 'alias.test':
+            response.answer.append(dns.rrset.from_text('alias.test.', 300, 'IN', 'CNAME', 'chat.openai.com.'))
+            response.answer.append(dns.rrset.from_text('chat.openai.com.', 300, 'IN', 'A', '192.0.2.9'))
+        else:
+            response.answer.append(dns.rrset.from_text(name + '.', 300, 'IN', 'A', '192.0.2.1'))
+        self.transport.sendto(response.to_wire(), addr)
+
+
+def policy_source():
+    return PolicySource(lambda: compile_policy(iter_blacklist(BLACKLIST)), lambda: None)
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def with_upstream(test):
+    loop = asyncio.get_event_loop()
+    transport, upstream = await loop.create_datagram_endpoint(StubUpstream, local_addr=('127.0.0.1', 0))
+    try:
+        sinkhole = Sinkhole(policy_source(), transport.get_extra_info('sockname')[:2], timeout=2)
+        return await test(sinkhole, upstream)
+    finally:
+        transport.close()
+
+
+async def ask(sinkhole, name):
+    wire = await sinkhole.answer(dns.message.make_query(name, 'A').to_wire())
+    return dns.message.from_wire(wire)
+
+
+def test_blacklisted_names_get_nxdomain_without_upstream_query():
+    async def test(sinkhole, upstream):
+        response = await ask(sinkhole, 'chat.openai.com')
+        assert response.rcode() == dns.rcode.NXDOMAIN
+        assert upstream.queries == []
+        assert sinkhole.stats['blocked'] == 1
+    asyncio.run(with_upstream(test))
+
+
+def test_exceptions_and_wildcards_follow_the_policy():
+    async def test(sinkhole, upstream):
+        assert (await ask(sinkhole, 'help.openai.com')).rcode() == dns.rcode.NOERROR
+        assert (await ask(sinkhole, 'cdn.example')).rcode() == dns.rcode.NOERROR
+        assert (await ask(sinkhole, 'img.cdn.example')).rcode() == dns.rcode.NXDOMAIN
+        assert upstream.queries == ['help.openai.com', 'cdn.example']
+    asyncio.run(with_upstream(test))
+
+
+def test_allowed_answers_are_forwarded_then_cached():
+    async def test(sinkhole, upstream):
+        first = await ask(sinkhole, 'example.org')
+        second = await ask(sinkhole, 'example.org')
+        assert first.rcode() == second.rcode() == dns.rcode.NOERROR
+        assert [rdata.address for rdata in second.answer[0]] == ['192.0.2.1']
+        assert 0 < second.answer[0].ttl <= 300
+        assert upstream.queries == ['example.org']
+        assert sinkhole.stats['forwarded'] == 1 and sinkhole.stats['cached'] == 1
+    asyncio.run(with_upstream(test))
+
+
+def test_cname_to_a_blacklisted_name_is_blocked():
+    async def test(sinkhole, upstream):
+        response = await ask(sinkhole, 'alias.test')
+        assert response.rcode() == dns.rcode.NXDOMAIN
+        assert upstream.queries == ['alias.test']
+    asyncio.run(with_upstream(test))
+
+
+def test_upstream_failure_gives_servfail():
+    async def test(sinkhole, upstream):
+        sinkhole.upstream = ('127.0.0.1', free_port())
+        sinkhole.timeout = 0.2
+        response = await ask(sinkhole, 'example.org')
+        assert response.rcode() == dns.rcode.SERVFAIL
+        assert sinkhole.stats['failed'] == 1
+    asyncio.run(with_upstream(test))
+
+
+def test_serve_answers_over_udp_and_tcp():
+    async def test(sinkhole, upstream):
+        port = free_port()
+        stop = asyncio.Event()
+        server = asyncio.ensure_future(serve(sinkhole, port, addresses=('127.0.0.1',), stop=stop))
+        await asyncio.sleep(0.1)
+        try:
+            query = dns.message.make_query('chat.openai.com', 'A')
+            udp = await dns.asyncquery.udp(query, '127.0.0.1', port=port, timeout=2)
+            tcp = await dns.asyncquery.tcp(dns.message.make_query('example.org', 'A'), '127.0.0.1', port=port,
+                                           timeout=2)
+        finally:
+            stop.set()
+        assert await server is True
+        assert udp.rcode() == dns.rcode.NXDOMAIN
+        assert tcp.rcode() == dns.rcode.NOERROR
+    asyncio.run(with_upstream(test))
+
+
+def test_policy_is_rebuilt_only_when_its_sources_change():
+    entries = ['openai.com']
+    stamp = ['v1']
+    loads = []
+
+    def load():
+        loads.append(1)
+        return compile_policy(iter_blacklist(entries))
+
+    source = PolicySource(load, lambda: stamp[0])
+    assert source.refresh() is False
+    entries.append('example.org')
+    stamp[0] = 'v2'
+    assert source.refresh() is True
+    assert len(loads) == 2 and source.policy['entries'] == 2
+
+
+def test_answer_cache_expires_entries():
+    cache = AnswerCache()
+    cache.put('a', b'wire', 30, now=100)
+    assert cache.get('a', now=110) == (b'wire', 20)
+    assert cache.get('a', now=130) is None
+    assert 'a' not in cache.entries
+    cache.put('b', b'wire', 0, now=100)
+    assert cache.get('b', now=100) is None
+
+
+def test_answer_cache_evicts_the_least_recently_used():
+    cache = AnswerCache(size=2)
+    cache.put('a', b'a', 60, now=0)
+    cache.put('b', b'b', 60, now=0)
+    assert cache.get('a', now=1)
+    cache.put('c', b'c', 60, now=1)
+    assert cache.get('b', now=1) is None
+    assert cache.get('a', now=1) and cache.get('c', now=1)
+
+
+def test_blocked_name_checks_the_question_and_cname_chain():
+    policy = compile_policy(iter_blacklist(BLACKLIST))
+    assert blocked_name(policy, dns.message.make_query('Chat.OpenAI.com.', 'A')) == 'chat.openai.com'
+    query = dns.message.make_query('alias.test', 'A')
+    assert blocked_name(policy, query) is None
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text('alias.test.', 300, 'IN', 'CNAME', 'edge.cdn.example.'))
+    response.answer.append(dns.rrset.from_text('edge.cdn.example.', 300, 'IN', 'A', '192.0.2.9'))
+    assert blocked_name(policy, query, response) == 'edge.cdn.example'
+    allowed = dns.message.make_query('help.openai.com', 'A')
+    assert blocked_name(policy, allowed, dns.message.make_response(allowed)) is None
+
+
+def test_port_conflicts():
+    assert port_conflicts([1000, 1001, 1000]) == {}
+    assert port_conflicts([1000, 11000, 1001, 21001]) == {20000 + 1000: [1000, 11000], 20000 + 1001: [1001, 21001]}
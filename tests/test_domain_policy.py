@@ -0,0 +1,61 @@
+"""Suffix-trie domain policy."""
+
+from contest_manager.utils.domain_policy import (
+    ALLOW, BLOCK, WILDCARD, parse_blacklist_line, iter_blacklist, compile_policy, check, is_allowed
+)
+
+BLACKLIST = """
+# --- AI Assistants ---
+openai.com @chat
+!help.openai.com
+*.cdn.example
+# --- Search Engines ---
+google.com
+"""
+
+
+def policy():
+    return compile_policy(iter_blacklist(BLACKLIST.splitlines()))
+
+
+def test_parse_blacklist_line():
+    assert parse_blacklist_line('  # comment') is None
+    assert parse_blacklist_line('') is None
+    assert parse_blacklist_line('Example.COM. @ai', section='AI') == (BLOCK, 'example.com', ['AI', 'ai'])
+    assert parse_blacklist_line('*.example.com') == (WILDCARD, 'example.com', [])
+    assert parse_blacklist_line('!docs.example.com') == (ALLOW, 'docs.example.com', [])
+
+
+def test_blocks_a_domain_and_its_subdomains():
+    blocked, match = check(policy(), 'chat.OpenAI.com.')
+    assert blocked
+    assert match == {'kind': BLOCK, 'domain': 'openai.com', 'tags': ['AI Assistants', 'chat']}
+    assert check(policy(), 'openai.com')[0]
+    assert check(policy(), 'www.google.com')[1]['tags'] == ['Search Engines']
+
+
+def test_unrelated_names_are_not_matched():
+    assert check(policy(), 'example.org') == (False, None)
+    # Suffixes only match on label boundaries
+    assert check(policy(), 'notopenai.com') == (False, None)
+
+
+def test_exceptions_win_over_broader_blocks():
+    assert check(policy(), 'help.openai.com') == (False, {'kind': ALLOW, 'domain': 'help.openai.com',
+                                                          'tags': ['AI Assistants']})
+    assert not check(policy(), 'eu.help.openai.com')[0]
+    assert is_allowed(policy(), 'help.openai.com')
+    assert not is_allowed(policy(), 'openai.com')
+
+
+def test_wildcards_cover_subdomains_only():
+    assert not check(policy(), 'cdn.example')[0]
+    assert check(policy(), 'img.cdn.example')[0]
+    assert check(policy(), 'a.b.cdn.example')[1]['kind'] == WILDCARD
+
+
+def test_more_specific_block_under_an_exception():
+    rules = compile_policy(iter_blacklist(['!example.com', 'ads.example.com']))
+    assert not check(rules, 'www.example.com')[0]
+    assert check(rules, 'x.ads.example.com')[0]
+    assert rules['entries'] == 2
@@ -0,0 +1,71 @@
+"""Rule identity, rule diffs, chain repair scripts and the inspector queue rules."""
+
+from contest_manager.utils.firewall import (
+    chain_name, jump_rule, rule_key, diff_rules, render_chain_repair, build_ruleset, render_nft_apply
+)
+
+UID = 1000
+CONNTRACK = ['-m', 'conntrack', '--ctstate', 'ESTABLISHED,RELATED', '-m', 'connbytes', '--connbytes', '11:',
+             '--connbytes-dir', 'original', '--connbytes-mode', 'packets', '-j', 'RETURN']
+
+
+def drop(address, *extra):
+    return list(extra) + ['-d', address, '-j', 'DROP']
+
+
+def test_rule_key_ignores_save_formatting():
+    assert rule_key(drop('192.0.2.1')) == rule_key(drop('192.0.2.1/32'))
+    assert rule_key(drop('2001:db8::1')) == rule_key(drop('2001:db8::1/128'))
+    assert rule_key(drop('192.0.2.1', '-p', 'tcp', '--dport', '443')) == \
+        rule_key(drop('192.0.2.1/32', '-p', 'tcp', '-m', 'tcp', '--dport', '443'))
+    assert rule_key(drop('192.0.2.1')) != rule_key(drop('192.0.2.2'))
+
+
+def test_rule_key_of_special_rules():
+    assert rule_key(CONNTRACK) == ('conntrack',)
+    assert rule_key(['-m', 'set', '--match-set', 'contest-1000-v4', 'dst', '-j', 'DROP']) == \
+        ('set', 'contest-1000-v4')
+    string_rule = ['-p', 'udp', '--dport', '53', '-m', 'string', '--string', 'openai', '--algo', 'bm', '-j', 'DROP']
+    assert rule_key(string_rule) == ('string', 'udp', '53', 'openai')
+    assert rule_key(['-j', 'RETURN']) == ('rule', ('-j', 'RETURN'))
+
+
+def test_diff_rules():
+    live = [CONNTRACK, drop('192.0.2.1/32'), drop('192.0.2.9/32'), drop('192.0.2.1/32')]
+    desired = [CONNTRACK, drop('192.0.2.1'), drop('192.0.2.2')]
+    missing, expired, duplicates = diff_rules(live, desired)
+    assert missing == [drop('192.0.2.2')]
+    assert expired == [drop('192.0.2.9/32')]
+    assert duplicates == [drop('192.0.2.1/32')]
+    assert diff_rules(desired, desired) == ([], [], [])
+
+
+def test_chain_repair_touches_only_the_changed_rules():
+    desired = [CONNTRACK, drop('192.0.2.1'), drop('192.0.2.2'), drop('192.0.2.3')]
+    live = [drop('192.0.2.2/32'), drop('198.51.100.1/32'), drop('192.0.2.3/32')]
+    missing, extra, duplicates = diff_rules(live, desired)
+    script = render_chain_repair(UID, desired, missing, extra + duplicates).splitlines()
+    chain = chain_name(UID)
+    assert script == [
+        '*filter',
+        f'-D {chain} -d 198.51.100.1/32 -j DROP',
+        f'-I {chain} 1 ' + ' '.join(CONNTRACK),
+        f'-I {chain} 2 -d 192.0.2.1 -j DROP',
+        'COMMIT',
+    ]
+
+
+def test_chain_repair_adds_the_jump():
+    script = render_chain_repair(UID, [drop('192.0.2.1')], [], [], add_jump=True)
+    assert ' '.join(['-A', 'OUTPUT'] + jump_rule(UID)) in script.splitlines()
+
+
+def test_inspector_queues_only_dns_and_tls():
+    ruleset = build_ruleset(UID, [('example.com', ['192.0.2.1'])], backend='restore', inspector=True)
+    for family in ('ipv4', 'ipv6'):
+        queued = [rule for rule in ruleset['rules'][family] if 'NFQUEUE' in rule]
+        assert [(rule[rule.index('-p') + 1], rule[rule.index('--dport') + 1]) for rule in queued] == \
+            [('udp', '53'), ('tcp', '53'), ('tcp', '443')]
+    script = render_nft_apply(UID, ruleset['sets'], queue=ruleset['queue'])
+    assert [line.split(' queue ')[0].split('packets 0-10 ')[1] for line in script.splitlines() if ' queue ' in line] \
+        == ['meta l4proto { tcp, udp } th dport 53', 'tcp dport 443']
@@ -0,0 +1,78 @@
+"""Applying restrictions with the DNS sinkhole, with the firewall calls stubbed out, and sinkhole ports."""
+
+import json
+import types
+
+import pytest
+
+pytest.importorskip('dns')
+
+from contest_manager.utils import internet_handler
+from contest_manager.utils.dns_sinkhole import sinkhole_port
+
+USER = 'participant'
+UID = 1000
+RULESET = {'rules': {'ipv4': [['-d', '192.0.2.1', '-j', 'DROP']], 'ipv6': []}, 'sets': {}}
+
+
+@pytest.fixture
+def firewall(tmp_path, monkeypatch):
+    """Point the cache at tmp_path and record the firewall calls instead of making them."""
+    calls = []
+    monkeypatch.setattr(internet_handler, 'get_cache_dir', lambda: tmp_path)
+    monkeypatch.setattr(internet_handler.pwd, 'getpwnam', lambda user: types.SimpleNamespace(pw_uid=UID))
+    monkeypatch.setattr(internet_handler, 'build_user_ruleset', lambda uid, *args, **kwargs: RULESET)
+    monkeypatch.setattr(internet_handler, 'render_boot_scripts',
+                        lambda uid, ruleset, backend: {'ipv4': '*filter\nCOMMIT\n'})
+
+    def record(name, result):
+        def call(*args, **kwargs):
+            calls.append((name,) + args)
+            return result
+        return call
+    monkeypatch.setattr(internet_handler, 'apply_ruleset', record('apply_ruleset', True))
+    monkeypatch.setattr(internet_handler, 'apply_delta', record('apply_delta', {'added': 1, 'removed': 0, 'total': 1}))
+    monkeypatch.setattr(internet_handler, 'apply_boot_scripts', record('apply_boot_scripts', True))
+    monkeypatch.setattr(internet_handler, 'apply_dns_redirect', record('apply_dns_redirect', True))
+    monkeypatch.setattr(internet_handler, 'dns_redirect_active', lambda uid: False)
+    (tmp_path / f"ip_cache_{USER}.json").write_text('{}')
+    (tmp_path / f"state_{USER}.json").write_text(json.dumps({'mode': 'blacklist', 'backend': 'restore',
+                                                             'sinkhole': True}))
+    return calls
+
+
+def redirects(calls):
+    return [call[1:3] for call in calls if call[0] == 'apply_dns_redirect']
+
+
+def test_apply_restrictions_from_cache_redirects_dns(firewall, tmp_path):
+    assert internet_handler.apply_restrictions_from_cache(USER)
+    assert redirects(firewall) == [(UID, sinkhole_port(UID))]
+    assert internet_handler.load_artifact(tmp_path / 'boot', USER) == {'ipv4': '*filter\nCOMMIT\n'}
+
+
+def test_update_restrictions_from_cache_restores_a_missing_redirect(firewall, tmp_path):
+    assert internet_handler.update_restrictions_from_cache(USER) == {'added': 1, 'removed': 0, 'total': 1}
+    assert redirects(firewall) == [(UID, sinkhole_port(UID))]
+    assert internet_handler.load_artifact(tmp_path / 'boot', USER) is not None
+
+
+def test_apply_boot_ruleset_redirects_dns(firewall):
+    assert not internet_handler.apply_boot_ruleset(USER)
+    internet_handler.save_boot_ruleset(USER, UID, RULESET, 'restore')
+    assert internet_handler.apply_boot_ruleset(USER)
+    assert [call[0] for call in firewall] == ['apply_boot_scripts', 'apply_dns_redirect']
+    assert redirects(firewall) == [(UID, sinkhole_port(UID))]
+
+
+def test_sinkhole_ports_must_not_collide(tmp_path, monkeypatch, capsys):
+    uids = {'alice': 1000, 'bob': 11000, 'carol': 1001}
+    monkeypatch.setattr(internet_handler, 'get_cache_dir', lambda: tmp_path)
+    monkeypatch.setattr(internet_handler.pwd, 'getpwnam', lambda user: types.SimpleNamespace(pw_uid=uids[user]))
+    assert internet_handler.sinkhole_ports_free(['alice', 'carol'])
+    assert not internet_handler.sinkhole_ports_free(['alice', 'bob'])
+    assert 'alice, bob would share sinkhole port 21000' in capsys.readouterr().out
+    (tmp_path / 'state_bob.json').write_text(json.dumps({'sinkhole': True}))
+    assert not internet_handler.sinkhole_ports_free(['alice'])
+    (tmp_path / 'state_bob.json').write_text(json.dumps({'sinkhole': False}))
+    assert internet_handler.sinkhole_ports_free(['alice'])
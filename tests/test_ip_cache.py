@@ -0,0 +1,101 @@
+"""Incremental IP cache refresh."""
+
+from contest_manager.utils.ip_cache import (
+    MIN_TTL, DEFAULT_NEGATIVE_TTL, new_cache, record_expiry, record_expired, refresh_cache, merge_cache, evict_stale,
+    cache_ip_map
+)
+
+NOW = 1000000
+
+
+class FakeResolve:
+    """resolve(names) answering from a table, recording what was asked."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.asked = []
+
+    def __call__(self, names):
+        self.asked.extend(names)
+        return {name: self.answers.get(name, {'ips': [], 'ttl': 300, 'status': 'nxdomain'}) for name in names}
+
+
+def ok(*ips, ttl=300):
+    return {'ips': list(ips), 'ttl': ttl, 'status': 'ok'}
+
+
+def test_record_expiry():
+    assert record_expiry({'resolved_at': 0}) == 0
+    assert record_expiry({'resolved_at': NOW, 'ttl': 300, 'status': 'ok'}) == NOW + 300
+    # Short TTLs are raised to MIN_TTL; negative answers without a TTL use the default
+    assert record_expiry({'resolved_at': NOW, 'ttl': 5, 'status': 'ok'}) == NOW + MIN_TTL
+    assert record_expiry({'resolved_at': NOW, 'ttl': None, 'status': 'nxdomain'}) == NOW + DEFAULT_NEGATIVE_TTL
+    assert record_expiry({'resolved_at': NOW, 'ttl': None, 'status': 'ok'}) == NOW + MIN_TTL
+    assert record_expired({'resolved_at': NOW, 'ttl': 300}, NOW + 300)
+    assert not record_expired({'resolved_at': NOW, 'ttl': 300}, NOW + 299)
+
+
+def test_first_refresh_resolves_every_name():
+    cache = new_cache()
+    resolve = FakeResolve({'example.com': ok('192.0.2.1'), 'www.example.com': ok('192.0.2.2')})
+    stats = refresh_cache(cache, {'example.com': ['example.com', 'www.example.com']}, resolve, now=NOW)
+    assert sorted(resolve.asked) == ['example.com', 'www.example.com']
+    assert stats['resolved'] == 2 and stats['changed_entries'] == 1
+    assert cache['records']['example.com']['ips'] == {'192.0.2.1': NOW}
+    assert cache_ip_map(cache) == {'example.com': ['192.0.2.1'], 'www.example.com': ['192.0.2.2']}
+
+
+def test_unchanged_fresh_entries_are_not_resolved_again():
+    cache = new_cache()
+    targets = {'example.com': ['example.com'], 'gone.test': ['gone.test']}
+    refresh_cache(cache, targets, FakeResolve({'example.com': ok('192.0.2.1')}), now=NOW)
+    resolve = FakeResolve({})
+    stats = refresh_cache(cache, targets, resolve, now=NOW + 10)
+    assert resolve.asked == []
+    assert stats['skipped'] == 2 and stats['negative_cached'] == 1
+    assert 'gone.test' not in cache_ip_map(cache)
+
+
+def test_expired_and_edited_entries_are_resolved():
+    cache = new_cache()
+    refresh_cache(cache, {'a.test': ['a.test'], 'b.test': ['b.test']},
+                  FakeResolve({'a.test': ok('192.0.2.1', ttl=60), 'b.test': ok('192.0.2.2', ttl=3600)}), now=NOW)
+    resolve = FakeResolve({'a.test': ok('192.0.2.9'), 'b.test': ok('192.0.2.2'), 'www.b.test': ok('192.0.2.3')})
+    stats = refresh_cache(cache, {'a.test': ['a.test'], 'b.test': ['b.test', 'www.b.test']}, resolve, now=NOW + 120)
+    assert sorted(resolve.asked) == ['a.test', 'b.test', 'www.b.test']
+    assert stats['changed_entries'] == 1
+    # The old address stays until it is evicted
+    assert cache['records']['a.test']['ips'] == {'192.0.2.1': NOW, '192.0.2.9': NOW + 120}
+
+
+def test_removed_entries_drop_their_names_and_failures_keep_answers():
+    cache = new_cache()
+    refresh_cache(cache, {'a.test': ['a.test'], 'b.test': ['b.test']},
+                  FakeResolve({'a.test': ok('192.0.2.1', ttl=60), 'b.test': ok('192.0.2.2')}), now=NOW)
+    resolve = FakeResolve({'a.test': {'ips': [], 'ttl': None, 'status': 'timeout'}})
+    stats = refresh_cache(cache, {'a.test': ['a.test']}, resolve, now=NOW + 120)
+    assert stats['removed_entries'] == 1 and stats['removed_names'] == 1
+    assert list(cache['records']) == ['a.test']
+    assert cache['records']['a.test']['resolved_at'] == NOW
+    assert cache['records']['a.test']['ips'] == {'192.0.2.1': NOW}
+
+
+def test_evict_stale():
+    cache = new_cache()
+    cache['records']['a.test'] = {'status': 'ok', 'ttl': 300, 'resolved_at': NOW,
+                                  'ips': {'192.0.2.1': NOW - 100, '192.0.2.2': NOW}}
+    assert evict_stale(cache, evict_after=50, now=NOW) == 1
+    assert cache['records']['a.test']['ips'] == {'192.0.2.2': NOW}
+
+
+def test_merge_keeps_names_of_the_first_cache_and_newest_answers():
+    disk = new_cache()
+    disk['records']['a.test'] = {'status': 'ok', 'ttl': 300, 'resolved_at': NOW, 'ips': {'192.0.2.1': NOW}}
+    disk['records']['new.test'] = {'status': 'ok', 'ttl': 300, 'resolved_at': NOW, 'ips': {}}
+    memory = new_cache()
+    memory['records']['a.test'] = {'status': 'ok', 'ttl': 60, 'resolved_at': NOW + 5, 'ips': {'192.0.2.9': NOW + 5}}
+    memory['records']['removed.test'] = {'status': 'ok', 'ttl': 300, 'resolved_at': NOW, 'ips': {}}
+    merged = merge_cache(disk, memory)
+    assert sorted(merged['records']) == ['a.test', 'new.test']
+    assert merged['records']['a.test']['ttl'] == 60
+    assert merged['records']['a.test']['ips'] == {'192.0.2.1': NOW, '192.0.2.9': NOW + 5}
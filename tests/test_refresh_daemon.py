@@ -0,0 +1,100 @@
+"""Enforcement daemon scheduling and cache groups."""
+
+import os
+
+import pytest
+
+pytest.importorskip('dns')
+
+from contest_manager.utils.ip_cache import new_cache, save_cache, load_cache
+from contest_manager.utils.refresh_daemon import Scheduler, CacheGroup
+
+
+def test_tasks_come_out_in_due_order():
+    scheduler = Scheduler()
+    scheduler.push('b', 20)
+    scheduler.push('a', 10)
+    scheduler.push('c', 30)
+    assert scheduler.next_due() == 10
+    assert scheduler.pop_due(25) == ['a', 'b']
+    assert len(scheduler) == 1
+    assert scheduler.pop_due(25) == []
+    assert scheduler.next_due() == 30
+
+
+def test_pushing_again_replaces_the_due_time():
+    scheduler = Scheduler()
+    scheduler.push('a', 10)
+    scheduler.push('a', 50)
+    assert len(scheduler) == 1
+    assert scheduler.pop_due(40) == []
+    assert scheduler.next_due() == 50
+    assert scheduler.pop_due(50) == ['a']
+    assert scheduler.next_due() is None
+
+
+def test_push_once_keeps_the_earlier_due_time():
+    scheduler = Scheduler()
+    scheduler.push_once('apply', 10)
+    scheduler.push_once('apply', 20)
+    assert scheduler.next_due() == 10
+    scheduler.push_once('apply', 5)
+    assert scheduler.pop_due(5) == ['apply']
+
+
+def record(ip, resolved_at):
+    return {'status': 'ok', 'ttl': 300, 'resolved_at': resolved_at, 'ips': {ip: resolved_at}}
+
+
+def rewrite(path, cache):
+    save_cache(cache, path)
+    # Make sure the rewrite is seen even on coarse mtime clocks
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_reload_merges_unsaved_answers(tmp_path):
+    path = tmp_path / 'ip_cache_participant.json'
+    cache = new_cache()
+    cache['records']['a.test'] = record('192.0.2.1', 100)
+    save_cache(cache, path)
+    group = CacheGroup(path, ['participant'])
+    assert group.reload()
+    group.cache['records']['a.test'] = record('192.0.2.9', 200)
+    group.dirty = True
+
+    other = load_cache(path)
+    other['records']['b.test'] = record('192.0.2.2', 150)
+    rewrite(path, other)
+    assert group.changed_on_disk()
+    assert group.reload()
+    assert sorted(group.cache['records']) == ['a.test', 'b.test']
+    assert group.cache['records']['a.test']['ips'] == {'192.0.2.1': 100, '192.0.2.9': 200}
+    assert group.dirty
+
+
+def test_save_merges_a_cache_rewritten_since_loading(tmp_path):
+    path = tmp_path / 'ip_cache_participant.json'
+    cache = new_cache()
+    cache['records']['a.test'] = record('192.0.2.1', 100)
+    save_cache(cache, path)
+    group = CacheGroup(path, ['participant'])
+    group.reload()
+    group.digest = 'seen'
+    group.cache['records']['a.test'] = record('192.0.2.9', 200)
+    group.dirty = True
+
+    other = load_cache(path)
+    other['records']['b.test'] = record('192.0.2.2', 150)
+    rewrite(path, other)
+    group.save()
+    saved = load_cache(path)
+    assert sorted(saved['records']) == ['a.test', 'b.test']
+    assert saved['records']['a.test']['resolved_at'] == 200
+    assert group.digest is None and not group.dirty and not group.changed_on_disk()
+
+
+def test_reload_without_a_cache_file(tmp_path):
+    group = CacheGroup(tmp_path / 'missing.json', ['participant'])
+    assert not group.reload()
+    assert group.cache is None
@@ -0,0 +1,78 @@
+"""Parsing saved rulesets and measuring drift from the boot ruleset."""
+
+from contest_manager.utils.firewall import chain_name, jump_rule, render_chain_restore
+from contest_manager.utils.status_snapshot import parse_save, parse_ipset_save, measure_drift
+
+UID = 1000
+CHAIN = chain_name(UID)
+RULES = [['-d', '192.0.2.1', '-j', 'DROP'], ['-d', '192.0.2.2', '-j', 'DROP']]
+
+SAVE = f"""# Generated by iptables-save
+*nat
+:OUTPUT ACCEPT [0:0]
+-A OUTPUT -p udp -m owner --uid-owner 1000 -m udp --dport 53 -j REDIRECT --to-ports 10053
+COMMIT
+*filter
+:INPUT ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:{CHAIN} - [0:0]
+-A OUTPUT -m owner --uid-owner 1000 -j {CHAIN}
+-A {CHAIN} -d 192.0.2.1/32 -j DROP
+-A {CHAIN} -p tcp -m string --string "chat gpt" --algo bm -j DROP
+COMMIT
+"""
+
+
+def snapshot(ipv4=SAVE, ipv6='*filter\n:OUTPUT ACCEPT [0:0]\nCOMMIT\n', ipset=None):
+    return {'iptables': {'ipv4': parse_save(ipv4) if ipv4 is not None else None,
+                         'ipv6': parse_save(ipv6) if ipv6 is not None else None},
+            'nft': None, 'ipset': ipset}
+
+
+def test_parse_save():
+    tables = parse_save(SAVE)
+    assert sorted(tables) == ['filter', 'nat']
+    assert tables['filter']['INPUT'] == []
+    assert tables['filter']['OUTPUT'] == [jump_rule(UID)]
+    assert tables['filter'][CHAIN][1] == ['-p', 'tcp', '-m', 'string', '--string', 'chat gpt', '--algo', 'bm',
+                                          '-j', 'DROP']
+    assert tables['nat']['OUTPUT'][0][-1] == '10053'
+
+
+def test_parse_ipset_save():
+    text = "create contest-1000-v4 hash:net family inet\nadd contest-1000-v4 192.0.2.1\ncreate other hash:ip\n" \
+           "add other 10.0.0.1\n"
+    assert parse_ipset_save(text) == {'contest-1000-v4': ['192.0.2.1']}
+
+
+def test_no_drift():
+    live = parse_save(SAVE)['filter'][CHAIN]
+    scripts = {'ipv4': render_chain_restore(UID, live, add_jump=False)}
+    assert measure_drift(UID, snapshot(), scripts) == {'missing': 0, 'extra': 0, 'duplicates': 0}
+
+
+def test_missing_extra_and_duplicate_rules():
+    save = SAVE.replace(f"-A {CHAIN} -d 192.0.2.1/32 -j DROP\n",
+                        f"-A {CHAIN} -d 192.0.2.1/32 -j DROP\n-A {CHAIN} -d 192.0.2.1/32 -j DROP\n")
+    scripts = {'ipv4': render_chain_restore(UID, RULES, add_jump=False)}
+    # The string rule is extra, 192.0.2.2 is missing and 192.0.2.1 is there twice
+    assert measure_drift(UID, snapshot(ipv4=save), scripts) == {'missing': 1, 'extra': 1, 'duplicates': 1}
+
+
+def test_missing_jump_counts_as_missing():
+    save = SAVE.replace(f"-A OUTPUT -m owner --uid-owner 1000 -j {CHAIN}\n", '')
+    scripts = {'ipv4': render_chain_restore(UID, RULES[:1], add_jump=False)}
+    assert measure_drift(UID, snapshot(ipv4=save), scripts)['missing'] == 1
+
+
+def test_ipset_members():
+    scripts = {'ipset': "create contest-1000-v4-tmp hash:net family inet\nadd contest-1000-v4-tmp 192.0.2.1/32\n"
+                        "add contest-1000-v4-tmp 192.0.2.2\n"}
+    drift = measure_drift(UID, snapshot(ipset={'contest-1000-v4': ['192.0.2.1', '198.51.100.1']}), scripts)
+    assert drift == {'missing': 1, 'extra': 1, 'duplicates': 0}
+
+
+def test_unavailable_snapshot_part_gives_none():
+    scripts = {'ipv4': render_chain_restore(UID, RULES, add_jump=False)}
+    assert measure_drift(UID, snapshot(ipv4=None), scripts) is None
+    assert measure_drift(UID, snapshot(), {'ipset': ''}) is None